@@ -0,0 +1,32 @@
+<?php
+
+declare(strict_types=1);
+
+namespace DoctrineMigrations;
+
+use Doctrine\DBAL\Schema\Schema;
+use Doctrine\Migrations\AbstractMigration;
+
+final class Version20261018120000 extends AbstractMigration
+{
+    public function getDescription(): string
+    {
+        return 'Theme bit positions and per-puzzle theme masks, filled by tools/puzzles/theme_mask.py';
+    }
+
+    public function up(Schema $schema): void
+    {
+        $this->addSql('ALTER TABLE theme ADD bit_position SMALLINT UNSIGNED DEFAULT NULL');
+        $this->addSql('CREATE UNIQUE INDEX UNIQ_9775E708E5620C9C ON theme (bit_position)');
+        $this->addSql('ALTER TABLE puzzle ADD theme_mask BIGINT UNSIGNED DEFAULT 0 NOT NULL');
+        $this->addSql('CREATE INDEX rating_theme_mask_idx ON puzzle (rating, theme_mask)');
+    }
+
+    public function down(Schema $schema): void
+    {
+        $this->addSql('DROP INDEX rating_theme_mask_idx ON puzzle');
+        $this->addSql('ALTER TABLE puzzle DROP theme_mask');
+        $this->addSql('DROP INDEX UNIQ_9775E708E5620C9C ON theme');
+        $this->addSql('ALTER TABLE theme DROP bit_position');
+    }
+}
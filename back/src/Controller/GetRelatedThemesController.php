@@ -0,0 +1,36 @@
+<?php
+
+namespace App\Controller;
+
+use App\Repository\PuzzleRepository;
+use Symfony\Bundle\FrameworkBundle\Controller\AbstractController;
+use Symfony\Component\HttpFoundation\Request;
+use Symfony\Component\HttpKernel\Attribute\AsController;
+use ApiPlatform\State\ProviderInterface;
+use ApiPlatform\Metadata\Operation;
+use Symfony\Component\HttpKernel\Exception\BadRequestHttpException;
+
+#[AsController]
+class GetRelatedThemesController extends AbstractController implements ProviderInterface
+{
+    public function __construct(private PuzzleRepository $puzzleRepository) {}
+
+    public function provide(Operation $operation, array $uriVariables = [], array $context = []): array
+    {
+        /** @var Request $request */
+        $request = $context['request'];
+
+        $theme = trim((string)$request->query->get('theme', ''));
+
+        if ($theme === '') {
+            throw new BadRequestHttpException('A theme must be provided.');
+        }
+
+        $limit = max(1, min(50, (int)$request->query->get('limit', 10)));
+
+        return [
+            'theme' => $theme,
+            'items' => $this->puzzleRepository->findRelatedThemes($theme, $limit),
+        ]; // API Platform auto-serialization
+    }
+}
@@ -9,12 +9,14 @@ use ApiPlatform\Metadata\Get;
 use ApiPlatform\Metadata\GetCollection;
 use App\Controller\GetRandomPuzzleController;
 use App\Controller\GetPuzzlesByThemesController;
+use App\Controller\GetRelatedThemesController;
 use Symfony\Component\Serializer\Annotation\Groups;
 use Doctrine\Common\Collections\Collection;
 use Doctrine\Common\Collections\ArrayCollection;
 
 #[ORM\Entity(repositoryClass: PuzzleRepository::class)]
 #[ORM\Index(columns: ["rating"], name: "rating_idx")]
+#[ORM\Index(columns: ["rating", "theme_mask"], name: "rating_theme_mask_idx")]
 #[ApiResource(
     operations: [
         new Get(
@@ -34,6 +36,11 @@ use Doctrine\Common\Collections\ArrayCollection;
             normalizationContext: ['groups' => ['puzzle:read']],
             name: 'get_puzzles_by_themes'
         ),
+        new GetCollection(
+            uriTemplate: '/puzzles/related-themes',
+            provider: GetRelatedThemesController::class,
+            name: 'get_related_themes'
+        ),
     ],
     normalizationContext: ['groups' => ['puzzle:read']],
     denormalizationContext: ['groups' => ['puzzle:write']]
@@ -82,6 +89,13 @@ class Puzzle
     #[Groups(['puzzle:read', 'puzzle:write'])]
     private ?string $openingTags = null;
 
+    /**
+     * OR of the bits (Theme::$bitPosition) of the puzzle's themes, kept up to
+     * date by the import tools in tools/puzzles
+     */
+    #[ORM\Column(type: 'bigint', options: ["unsigned" => true, "default" => 0])]
+    private string $themeMask = '0';
+
     public function __construct()
     {
         $this->themes = new ArrayCollection();
@@ -210,4 +224,9 @@ class Puzzle
         $this->openingTags = $openingTags;
         return $this;
     }
+
+    public function getThemeMask(): string
+    {
+        return $this->themeMask;
+    }
 } 
\ No newline at end of file
@@ -34,6 +34,12 @@ class Theme
     #[Groups(['theme:read', 'theme:write'])]
     private ?string $name = null;
 
+    /**
+     * Bit of this theme in Puzzle::$themeMask, null for themes past the 63rd
+     */
+    #[ORM\Column(type: 'smallint', nullable: true, unique: true, options: ["unsigned" => true])]
+    private ?int $bitPosition = null;
+
     #[ORM\ManyToMany(targetEntity: Puzzle::class, mappedBy: 'themes')]
     private Collection $puzzles;
 
@@ -58,6 +64,11 @@ class Theme
         return $this;
     }
 
+    public function getBitPosition(): ?int
+    {
+        return $this->bitPosition;
+    }
+
     /**
      * @return Collection<int, Puzzle>
      */
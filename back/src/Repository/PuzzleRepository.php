@@ -4,6 +4,7 @@ namespace App\Repository;
 
 use App\Entity\Puzzle;
 use Doctrine\Bundle\DoctrineBundle\Repository\ServiceEntityRepository;
+use Doctrine\DBAL\Exception\TableNotFoundException;
 use Doctrine\Persistence\ManagerRegistry;
 
 /**
@@ -43,17 +44,152 @@ class PuzzleRepository extends ServiceEntityRepository
      * Find a random puzzle within a specific rating range
      * Optimized for very large datasets
      * 
+     * Uses the puzzle_sample tables built by tools/puzzles/build_sampling_index.py
+     * and falls back to ORDER BY RAND() when they are missing, not built yet, or
+     * behind an import, sync or theme update that ran since.
+     * 
      * @param int $minRating The minimum rating value
      * @param int $maxRating The maximum rating value
      * @param array|null $themes Optional array of theme names to filter by
      * @return Puzzle|null A random puzzle or null if none found
      */
     public function findRandomPuzzleInRatingRange(int $minRating, int $maxRating, ?array $themes = null): ?Puzzle
+    {
+        $puzzleId = null;
+        if ($this->isBuiltFromCurrentData('puzzle_sample')) {
+            try {
+                $puzzleId = $this->findSampledPuzzleId($minRating, $maxRating, $themes);
+            } catch (TableNotFoundException) {
+                $puzzleId = null;
+            }
+        }
+
+        if ($puzzleId) {
+            $puzzle = $this->find($puzzleId);
+            if ($puzzle) {
+                return $puzzle;
+            }
+        }
+
+        return $this->findRandomPuzzleByOrderByRand($minRating, $maxRating, $themes);
+    }
+
+    /**
+     * Pick a random puzzle ID from the sampling tables with two indexed lookups
+     * 
+     * Within a theme (0 for all puzzles) puzzles are numbered consecutively in
+     * rating order, and puzzle_sample_slice holds the seq bounds of each rating,
+     * so a rating range is one seq interval. With several themes, one is picked
+     * with a weight equal to its puzzle count in the range, which matches the
+     * odds of the theme join. The drawn puzzle is checked against the live rating
+     * and themes, and a stale entry returns null so the caller falls back.
+     * 
+     * @return string|null The puzzle ID, or null if the tables have no matching puzzle in range
+     */
+    private function findSampledPuzzleId(int $minRating, int $maxRating, ?array $themes): ?string
     {
         $conn = $this->getEntityManager()->getConnection();
+
+        if ($themes && count($themes) > 0) {
+            $intervals = $conn->fetchAllAssociative("
+                SELECT s.theme_id, MIN(s.min_seq) AS min_seq, MAX(s.max_seq) AS max_seq
+                FROM puzzle_sample_slice s
+                JOIN theme t ON t.id = s.theme_id
+                WHERE t.name IN (:themes)
+                AND s.rating BETWEEN :min_rating AND :max_rating
+                GROUP BY s.theme_id
+            ", [
+                'themes' => $themes,
+                'min_rating' => $minRating,
+                'max_rating' => $maxRating,
+            ], [
+                'themes' => \Doctrine\DBAL\Connection::PARAM_STR_ARRAY,
+            ]);
+        } else {
+            $intervals = $conn->fetchAllAssociative("
+                SELECT theme_id, MIN(min_seq) AS min_seq, MAX(max_seq) AS max_seq
+                FROM puzzle_sample_slice
+                WHERE theme_id = 0
+                AND rating BETWEEN :min_rating AND :max_rating
+                GROUP BY theme_id
+            ", [
+                'min_rating' => $minRating,
+                'max_rating' => $maxRating,
+            ]);
+        }
+
+        $total = 0;
+        foreach ($intervals as $interval) {
+            $total += $interval['max_seq'] - $interval['min_seq'] + 1;
+        }
+
+        if ($total === 0) {
+            return null;
+        }
+
+        // Draw one position across all intervals, then find the interval it falls in
+        $position = random_int(0, $total - 1);
+        foreach ($intervals as $interval) {
+            $size = $interval['max_seq'] - $interval['min_seq'] + 1;
+            if ($position < $size) {
+                // A write that started after the generation check may have moved the puzzle
+                // out of the range or the theme before build_sampling_index.py caught up
+                $puzzleId = $conn->fetchOne("
+                    SELECT s.puzzle_id
+                    FROM puzzle_sample s
+                    JOIN puzzle p ON p.id = s.puzzle_id
+                    WHERE s.theme_id = :theme_id
+                    AND s.seq = :seq
+                    AND p.rating BETWEEN :min_rating AND :max_rating
+                    AND (s.theme_id = 0 OR EXISTS (
+                        SELECT 1 FROM puzzle_theme pt
+                        WHERE pt.puzzle_id = s.puzzle_id AND pt.theme_id = s.theme_id
+                    ))
+                ", [
+                    'theme_id' => $interval['theme_id'],
+                    'seq' => $interval['min_seq'] + $position,
+                    'min_rating' => $minRating,
+                    'max_rating' => $maxRating,
+                ]);
+
+                return $puzzleId ?: null;
+            }
+            $position -= $size;
+        }
+
+        return null;
+    }
+
+    /**
+     * Find a random puzzle by sorting the matching rows randomly
+     * 
+     * Slow on large rating bands, only used until the sampling tables are built
+     */
+    private function findRandomPuzzleByOrderByRand(int $minRating, int $maxRating, ?array $themes = null): ?Puzzle
+    {
+        $conn = $this->getEntityManager()->getConnection();
+        $mask = $themes && count($themes) > 0 ? $this->findThemeMask($themes) : null;
         
         // Base query to get a random puzzle ID
-        if ($themes && count($themes) > 0) {
+        if ($mask !== null) {
+            // With theme filtering on the theme bitmask, no join needed
+            $sql = "
+                SELECT id
+                FROM puzzle
+                WHERE rating BETWEEN :min_rating AND :max_rating
+                AND theme_mask & :mask != 0
+                ORDER BY RAND()
+                LIMIT 1
+            ";
+            
+            // Prepare the query
+            $stmt = $conn->prepare($sql);
+            
+            // Bind parameters
+            $stmt->bindValue('min_rating', $minRating);
+            $stmt->bindValue('max_rating', $maxRating);
+            $stmt->bindValue('mask', $mask);
+        } elseif ($themes && count($themes) > 0) {
             // With theme filtering
             $sql = "
                 SELECT p.id
@@ -103,6 +239,135 @@ class PuzzleRepository extends ServiceEntityRepository
         return $this->find($puzzleId);
     }
 
+    /**
+     * Combine the bits of the given themes into a puzzle.theme_mask filter
+     * 
+     * Bits are assigned by tools/puzzles/theme_mask.py. A puzzle has any of the
+     * themes when theme_mask & mask != 0, and all of them when it equals mask.
+     * 
+     * @param array $themes Array of theme names
+     * @return int|null The mask, or null if a theme is unknown or has no bit
+     */
+    private function findThemeMask(array $themes): ?int
+    {
+        $bits = $this->getEntityManager()->getConnection()->fetchFirstColumn(
+            'SELECT bit_position FROM theme WHERE name IN (:themes) AND bit_position IS NOT NULL',
+            ['themes' => $themes],
+            ['themes' => \Doctrine\DBAL\Connection::PARAM_STR_ARRAY]
+        );
+
+        if (count($bits) !== count(array_unique($themes))) {
+            return null;
+        }
+
+        $mask = 0;
+        foreach ($bits as $bit) {
+            $mask |= 1 << (int) $bit;
+        }
+
+        return $mask;
+    }
+
+    /**
+     * Count the puzzles of a theme in a rating range from puzzle_stats_rating
+     * 
+     * The table is built by tools/puzzles/build_theme_stats.py. It only answers
+     * for a single theme (a union of themes cannot be derived from per-theme
+     * counts), for ranges made of whole rating buckets, and while no import,
+     * sync or theme update ran since it was built.
+     * 
+     * @param array $themes Array of theme names
+     * @return int|null The count, or null if it has to be computed from puzzle
+     */
+    private function countFromStats(array $themes, int $minRating, int $maxRating): ?int
+    {
+        if (count(array_unique($themes)) !== 1 || !$this->isBuiltFromCurrentData('puzzle_stats')) {
+            return null;
+        }
+
+        try {
+            $row = $this->getEntityManager()->getConnection()->fetchAssociative("
+                SELECT COUNT(*) AS buckets,
+                       SUM(s.rating_min < :min_rating AND s.rating_max >= :min_rating
+                           OR s.rating_min <= :max_rating AND s.rating_max > :max_rating) AS partial,
+                       SUM(CASE WHEN s.rating_min >= :min_rating AND s.rating_max <= :max_rating
+                           THEN s.puzzles ELSE 0 END) AS total
+                FROM puzzle_stats_rating s
+                JOIN theme t ON t.id = s.theme_id
+                WHERE t.name = :theme
+            ", [
+                'theme' => reset($themes),
+                'min_rating' => $minRating,
+                'max_rating' => $maxRating,
+            ]);
+        } catch (TableNotFoundException) {
+            return null;
+        }
+
+        // No row at all also covers a theme the stats were not built for yet
+        if (!$row || (int) $row['buckets'] === 0 || (int) $row['partial'] > 0) {
+            return null;
+        }
+
+        return (int) $row['total'];
+    }
+
+    /**
+     * Check that a derived table was built from the current puzzle data
+     * 
+     * The tools writing puzzle data advance the generation recorded under
+     * 'puzzle' in puzzle_data_state, and the build tools record the generation
+     * they read under their own name (see tools/puzzles/change_log.py).
+     * 
+     * @param string $name The name the build tool records, puzzle_stats or puzzle_sample
+     * @return bool False if the data changed since the build, or it was never recorded
+     */
+    private function isBuiltFromCurrentData(string $name): bool
+    {
+        try {
+            $row = $this->getEntityManager()->getConnection()->fetchAssociative("
+                SELECT MAX(CASE WHEN name = 'puzzle' THEN generation END) AS data,
+                       MAX(CASE WHEN name = :name THEN generation END) AS built
+                FROM puzzle_data_state
+                WHERE name IN ('puzzle', :name)
+            ", [
+                'name' => $name,
+            ]);
+        } catch (TableNotFoundException) {
+            return false;
+        }
+
+        // No data row yet means no tracked write happened since the table was created
+        return $row['built'] !== null && (int) $row['built'] === (int) ($row['data'] ?? 0);
+    }
+
+    /**
+     * Find the themes most often found together with a theme
+     * 
+     * Read from puzzle_stats_pair, built by tools/puzzles/build_theme_stats.py
+     * 
+     * @param string $theme The theme name
+     * @param int $limit The number of related themes to return
+     * @return array Rows with the theme name and the number of puzzles shared
+     */
+    public function findRelatedThemes(string $theme, int $limit = 10): array
+    {
+        try {
+            return $this->getEntityManager()->getConnection()->fetchAllAssociative("
+                SELECT o.name, s.puzzles
+                FROM puzzle_stats_pair s
+                JOIN theme t ON t.id = s.theme_id
+                JOIN theme o ON o.id = s.other_theme_id
+                WHERE t.name = :theme
+                ORDER BY s.puzzles DESC, o.name
+                LIMIT " . $limit, [
+                'theme' => $theme,
+            ]);
+        } catch (TableNotFoundException) {
+            return [];
+        }
+    }
+
     /**
      * Find puzzles filtered by themes and rating range with pagination
      * 
@@ -120,20 +385,32 @@ class PuzzleRepository extends ServiceEntityRepository
         int $page = 1, 
         int $limit = 20
     ): array {
-        $qb = $this->createQueryBuilder('p')
-            ->join('p.themes', 't')
-            ->where('t.name IN (:themes)')
-            ->andWhere('p.rating >= :minRating')
+        $mask = $this->findThemeMask($themes);
+        $qb = $this->createQueryBuilder('p');
+
+        if ($mask !== null) {
+            // One row per puzzle, filtered with the (rating, theme_mask) index
+            $qb->where('BIT_AND(p.themeMask, :mask) != 0')
+               ->setParameter('mask', $mask);
+        } else {
+            $qb->join('p.themes', 't')
+               ->where('t.name IN (:themes)')
+               ->setParameter('themes', $themes);
+        }
+
+        $qb->andWhere('p.rating >= :minRating')
             ->andWhere('p.rating <= :maxRating')
-            ->setParameter('themes', $themes)
             ->setParameter('minRating', $minRating)
             ->setParameter('maxRating', $maxRating)
             ->orderBy('p.popularity', 'DESC');
             
-        // Count total results before pagination
-        $countQb = clone $qb;
-        $countQb->select('COUNT(DISTINCT p.id)');
-        $totalCount = $countQb->getQuery()->getSingleScalarResult();
+        // Count total results before pagination, from the stats tables when they can answer
+        $totalCount = $this->countFromStats($themes, $minRating, $maxRating);
+        if ($totalCount === null) {
+            $countQb = clone $qb;
+            $countQb->select($mask !== null ? 'COUNT(p.id)' : 'COUNT(DISTINCT p.id)');
+            $totalCount = $countQb->getQuery()->getSingleScalarResult();
+        }
         
         // Apply pagination
         $offset = ($page - 1) * $limit;
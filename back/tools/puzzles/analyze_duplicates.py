@@ -1,89 +1,243 @@
-import pandas as pd
 from collections import Counter
-import sys
+import os
+import argparse
+import tempfile
+import numpy as np
 from tqdm import tqdm
+from csv_stream import CsvStream
+from id_index import encode_ids, decode_ids, lower_keys, INVALID_KEY
+from metrics import StageMetrics
 
-def analyze_duplicates(file_path):
+# One record per CSV row: the packed lowercased ID first so that sorting groups
+# case variants together, then the packed ID itself
+RECORD = np.dtype([('lower', np.uint64), ('key', np.uint64)])
+
+DEFAULT_MEMORY_LIMIT = 256  # MB
+
+def sort_records(records):
+    return records[np.lexsort((records['key'], records['lower']))]
+
+class ExternalSorter:
+    """Collect records and give them back in sorted blocks.
+
+    Records are buffered in memory until `memory_limit` bytes, then sorted and
+    spilled to a run file in `tmp_dir`. The runs are merged block by block,
+    keeping about `memory_limit` bytes in memory at a time.
+    """
+
+    def __init__(self, memory_limit, tmp_dir):
+        self.memory_limit = memory_limit
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.buffered = 0
+        self.runs = []
+
+    def add(self, records):
+        self.buffer.append(records)
+        self.buffered += records.nbytes
+        if self.buffered >= self.memory_limit:
+            self._spill()
+
+    def _spill(self):
+        path = os.path.join(self.tmp_dir, f"run_{len(self.runs)}.npy")
+        np.save(path, sort_records(np.concatenate(self.buffer)))
+        self.runs.append(path)
+        self.buffer = []
+        self.buffered = 0
+
+    def sorted_blocks(self):
+        """Yield sorted blocks; their concatenation is the whole input in sorted order."""
+        if not self.runs:
+            if self.buffer:
+                yield sort_records(np.concatenate(self.buffer))
+            return
+
+        if self.buffer:
+            self._spill()
+
+        runs = [np.load(path, mmap_mode='r') for path in self.runs]
+        positions = [0] * len(runs)
+        block_size = max(1, int(self.memory_limit // (2 * RECORD.itemsize * len(runs))))
+
+        while True:
+            heads = [(i, run[pos:pos + block_size]) for i, (run, pos) in enumerate(zip(runs, positions)) if pos < len(run)]
+            if not heads:
+                return
+
+            # Nothing left in any run sorts before the smallest block tail, so up to it everything is final
+            cutoff_lower, cutoff_key = min((head['lower'][-1], head['key'][-1]) for _, head in heads)
+            parts = []
+            for i, head in heads:
+                final = (head['lower'] < cutoff_lower) | ((head['lower'] == cutoff_lower) & (head['key'] <= cutoff_key))
+                take = int(final.sum())
+                parts.append(head[:take])
+                positions[i] += take
+
+            yield sort_records(np.concatenate(parts))
+
+class DuplicateScan:
+    """Count case-sensitive and case-insensitive duplicates over sorted record blocks."""
+
+    def __init__(self):
+        self.unique = 0
+        self.unique_lower = 0
+        self.duplicates = []  # (keys, counts) per block
+        self.duplicates_lower = []  # (lower keys, counts) per block
+        self.variant_keys = []  # Keys whose lowercased ID has several case variants
+        self.carry = np.empty(0, dtype=RECORD)
+
+    def feed(self, block, final=False):
+        block = np.concatenate([self.carry, block])
+        if not final and len(block):
+            # The last case-insensitive group may continue in the next block
+            cut = np.searchsorted(block['lower'], block['lower'][-1])
+            block, self.carry = block[:cut], block[cut:]
+        if not len(block):
+            return
+
+        keys, lower = block['key'], block['lower']
+
+        key_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        key_counts = np.diff(np.r_[key_starts, len(block)])
+        self.unique += len(key_starts)
+        self.duplicates.append((keys[key_starts[key_counts > 1]], key_counts[key_counts > 1]))
+
+        lower_starts = np.flatnonzero(np.r_[True, lower[1:] != lower[:-1]])
+        lower_counts = np.diff(np.r_[lower_starts, len(block)])
+        self.unique_lower += len(lower_starts)
+        self.duplicates_lower.append((lower[lower_starts[lower_counts > 1]], lower_counts[lower_counts > 1]))
+
+        # Number of distinct IDs behind each lowercased ID
+        distinct_lower = lower[key_starts]
+        group_starts = np.flatnonzero(np.r_[True, distinct_lower[1:] != distinct_lower[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(distinct_lower)])
+        self.variant_keys.append(keys[key_starts][np.repeat(group_sizes > 1, group_sizes)])
+
+    def finish(self):
+        """Return (duplicates, duplicates_lower, case_variants) keyed by ID strings."""
+        self.feed(np.empty(0, dtype=RECORD), final=True)
+
+        duplicates = {}
+        for keys, counts in self.duplicates:
+            duplicates.update(zip(decode_ids(keys), counts.tolist()))
+
+        duplicates_lower = {}
+        for keys, counts in self.duplicates_lower:
+            duplicates_lower.update(zip(decode_ids(keys), counts.tolist()))
+
+        case_variants = {}
+        for keys in self.variant_keys:
+            for id in decode_ids(keys):
+                case_variants.setdefault(id.lower(), set()).add(id)
+
+        return duplicates, duplicates_lower, case_variants
+
+def analyze_duplicates(file_path, memory_limit=DEFAULT_MEMORY_LIMIT, metrics_path=None):
     print("Analyzing CSV file for duplicate IDs...")
-    
-    # Read the CSV file in chunks
-    chunks = pd.read_csv(file_path, chunksize=100000)
-    total_rows = sum(1 for _ in open(file_path)) - 1  # Subtract header row
-    print(f"Total rows in CSV: {total_rows}")
-    
-    # Track all IDs and their occurrences
-    all_ids = []
+    metrics = StageMetrics('analyze_duplicates')
+
+    # Read the CSV file in chunks, a single pass with progress measured in bytes
+    # IDs such as 'NA' or 'null' must stay strings rather than become NaN
+    chunks = CsvStream(file_path, 100000, usecols=['PuzzleId'], dtype=str, keep_default_na=False)
+    print(f"CSV size: {chunks.total_bytes / 1024 ** 2:.1f} MB")
+
+    # IDs are packed into integers and sorted, spilling to disk above the memory limit.
+    # The few IDs that cannot be packed (empty, too long, non [0-9A-Za-z]) are counted as strings.
+    invalid_ids = Counter()
     processed_rows = 0
-    
-    with tqdm(total=total_rows, desc="Reading CSV") as pbar:
-        for chunk in chunks:
-            # Convert IDs to strings and strip whitespace
-            ids = chunk['PuzzleId'].astype(str).str.strip()
-            all_ids.extend(ids.tolist())
-            processed_rows += len(chunk)
-            pbar.update(len(chunk))
-    
-    # Count occurrences of each ID (case-sensitive)
-    id_counts = Counter(all_ids)
-    
-    # Count occurrences of each ID (case-insensitive)
-    id_counts_lower = Counter(id.lower() for id in all_ids)
-    
-    # Find duplicates (IDs that appear more than once)
-    duplicates = {id: count for id, count in id_counts.items() if count > 1}
-    duplicates_lower = {id: count for id, count in id_counts_lower.items() if count > 1}
-    
+
+    with tempfile.TemporaryDirectory(prefix='analyze_duplicates_') as tmp_dir:
+        sorter = ExternalSorter(memory_limit * 1024 ** 2, tmp_dir)
+
+        with tqdm(total=chunks.total_bytes, desc="Reading CSV", unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+            for chunk, size in metrics.chunks(chunks):
+                with metrics.stage('validate', len(chunk), size):
+                    # Convert IDs to strings and strip whitespace
+                    ids = chunk['PuzzleId'].astype(str).str.strip()
+                    keys = encode_ids(ids)
+
+                    valid = keys != INVALID_KEY
+                    if not valid.all():
+                        invalid_ids.update(ids[~valid].tolist())
+                        keys = keys[valid]
+
+                    records = np.empty(len(keys), dtype=RECORD)
+                    records['key'] = keys
+                    records['lower'] = lower_keys(keys)
+
+                # Includes spilling sorted runs to disk
+                with metrics.stage('sort', len(chunk), size):
+                    sorter.add(records)
+
+                processed_rows += len(chunk)
+                pbar.update(chunks.advance())
+
+        if sorter.runs:
+            print(f"Spilled {len(sorter.runs)} sorted runs to disk, merging...")
+
+        with metrics.stage('scan', processed_rows, chunks.bytes_read):
+            scan = DuplicateScan()
+            for block in sorter.sorted_blocks():
+                scan.feed(block)
+            duplicates, duplicates_lower, case_variants = scan.finish()
+
+    # Fold in the IDs that could not be packed; lowercasing keeps them unpackable,
+    # so they never collide with packed IDs
+    invalid_lower = Counter()
+    invalid_lower_map = {}
+    for id, count in invalid_ids.items():
+        invalid_lower[id.lower()] += count
+        invalid_lower_map.setdefault(id.lower(), set()).add(id)
+    duplicates.update({id: count for id, count in invalid_ids.items() if count > 1})
+    duplicates_lower.update({id: count for id, count in invalid_lower.items() if count > 1})
+    case_variants.update({lower_id: variants for lower_id, variants in invalid_lower_map.items() if len(variants) > 1})
+
+    unique_ids = scan.unique + len(invalid_ids)
+    unique_ids_lower = scan.unique_lower + len(invalid_lower)
+
     # Print summary
     print("\nAnalysis Results:")
-    print(f"Total unique IDs (case-sensitive): {len(id_counts)}")
-    print(f"Total unique IDs (case-insensitive): {len(id_counts_lower)}")
+    print(f"Total rows in CSV: {processed_rows}")
+    print(f"Total unique IDs (case-sensitive): {unique_ids}")
+    print(f"Total unique IDs (case-insensitive): {unique_ids_lower}")
     print(f"Total duplicate IDs (case-sensitive): {len(duplicates)}")
     print(f"Total duplicate IDs (case-insensitive): {len(duplicates_lower)}")
-    
+
     # Check for potential case-sensitivity issues
-    if len(id_counts) != len(id_counts_lower):
+    if unique_ids != unique_ids_lower:
         print("\nPotential case-sensitivity issues found!")
-        print(f"Difference in unique IDs: {len(id_counts) - len(id_counts_lower)}")
-        
-        # Find IDs that differ only by case
-        id_lower_map = {}
-        for id in all_ids:
-            lower_id = id.lower()
-            if lower_id not in id_lower_map:
-                id_lower_map[lower_id] = set()
-            id_lower_map[lower_id].add(id)
-        
-        case_variants = {lower_id: variants for lower_id, variants in id_lower_map.items() if len(variants) > 1}
+        print(f"Difference in unique IDs: {unique_ids - unique_ids_lower}")
+
         if case_variants:
             print("\nFound IDs with case variants:")
-            for lower_id, variants in list(case_variants.items())[:10]:
+            for lower_id, variants in sorted(case_variants.items())[:10]:
                 print(f"Lowercase ID: {lower_id}")
                 print(f"Variants: {sorted(variants)}")
                 print()
-    
+
     # Save detailed analysis to file
     with open('duplicate_analysis.txt', 'w') as f:
         f.write("Detailed Duplicate Analysis\n")
         f.write("=========================\n\n")
-        
+
         f.write("Case-Sensitive Analysis:\n")
         f.write("------------------------\n")
-        f.write(f"Total unique IDs: {len(id_counts)}\n")
+        f.write(f"Total unique IDs: {unique_ids}\n")
         f.write(f"Total duplicate IDs: {len(duplicates)}\n")
         if duplicates:
             f.write("\nTop 10 most duplicated IDs:\n")
-            for id, count in sorted(duplicates.items(), key=lambda x: x[1], reverse=True)[:10]:
+            for id, count in sorted(duplicates.items(), key=lambda x: (-x[1], x[0]))[:10]:
                 f.write(f"ID: {id}, Occurrences: {count}\n")
-        
+
         f.write("\nCase-Insensitive Analysis:\n")
         f.write("-------------------------\n")
-        f.write(f"Total unique IDs: {len(id_counts_lower)}\n")
+        f.write(f"Total unique IDs: {unique_ids_lower}\n")
         f.write(f"Total duplicate IDs: {len(duplicates_lower)}\n")
         if duplicates_lower:
             f.write("\nTop 10 most duplicated IDs (case-insensitive):\n")
-            for id, count in sorted(duplicates_lower.items(), key=lambda x: x[1], reverse=True)[:10]:
+            for id, count in sorted(duplicates_lower.items(), key=lambda x: (-x[1], x[0]))[:10]:
                 f.write(f"ID: {id}, Occurrences: {count}\n")
-        
+
         if case_variants:
             f.write("\nCase Variants Found:\n")
             f.write("-------------------\n")
@@ -91,13 +245,25 @@ def analyze_duplicates(file_path):
                 f.write(f"Lowercase ID: {lower_id}\n")
                 f.write(f"Variants: {sorted(variants)}\n")
                 f.write("\n")
-    
+
     print("\nDetailed analysis saved to 'duplicate_analysis.txt'")
 
+    metrics.report()
+    if metrics_path:
+        metrics.write(metrics_path)
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Report duplicate and case-variant puzzle IDs in the Lichess CSV')
+    parser.add_argument('file_path', help='Path to the Lichess puzzle CSV (.csv, .csv.gz, .csv.bz2 or .csv.zst)')
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_MEMORY_LIMIT,
+                        help=f'MB of packed IDs kept in memory before sorted runs are spilled to disk '
+                             f'(default: {DEFAULT_MEMORY_LIMIT})')
+    parser.add_argument('--metrics', default=None, metavar='PATH',
+                        help='Write the time, rows/s and MB/s of every stage: a Prometheus textfile '
+                             'for a .prom path, JSON lines appended to any other path')
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python analyze_duplicates.py <path_to_csv>")
-        sys.exit(1)
-    
-    file_path = sys.argv[1]
-    analyze_duplicates(file_path) 
\ No newline at end of file
+    args = parse_args()
+    analyze_duplicates(args.file_path, memory_limit=args.memory_limit, metrics_path=args.metrics)
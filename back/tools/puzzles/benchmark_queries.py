@@ -0,0 +1,505 @@
+"""
+Benchmark of the candidate SQL strategies behind the puzzle endpoints.
+
+Every strategy of a group answers the same question for the same case (a
+rating band and a set of themes):
+- random: pick a random puzzle, as findRandomPuzzleInRatingRange does
+- by-themes: one page of puzzles having any of the themes, most popular first
+- count: the number of puzzles behind that page, for its total/pages
+
+Each (case, strategy) is run a number of times for latency percentiles and
+rows examined (performance_schema), then once under EXPLAIN ANALYZE. The
+by-themes and count results are compared between strategies, since a faster
+query that returns something else is no alternative. Strategies needing a
+table that does not exist yet (sampling index, theme masks, stats) are
+reported as unavailable.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+from mysql.connector import Error
+from tqdm import tqdm
+from id_index import ALPHABET
+from import_puzzles import create_connection
+from build_sampling_index import ALL_THEMES
+
+DEFAULT_BANDS = '600-1000,1200-1800,1500-1600,0-3500'
+DEFAULT_THEME_SETS = ';fork;fork,pin;mateIn2,endgame'
+PAGE_SIZE = 20
+
+class NotApplicable(Exception):
+    """The strategy cannot answer this case, e.g. a theme strategy without themes."""
+
+class RecordingCursor:
+    """Cursor wrapper remembering the statements executed through it."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, tuple(params)))
+        self.cursor.execute(sql, params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def theme_join(themes):
+    """FROM clause and params restricting puzzle p to the given theme names through puzzle_theme."""
+    return (f"FROM puzzle p JOIN puzzle_theme pt ON pt.puzzle_id = p.id "
+            f"JOIN theme t ON t.id = pt.theme_id AND t.name IN ({placeholders(themes)})"), list(themes)
+
+def theme_exists(themes):
+    return (f"EXISTS (SELECT 1 FROM puzzle_theme pt JOIN theme t ON t.id = pt.theme_id "
+            f"WHERE pt.puzzle_id = p.id AND t.name IN ({placeholders(themes)}))"), list(themes)
+
+def theme_mask(cursor, themes):
+    """Mask of the themes' bits, NotApplicable if one of them has no bit."""
+    cursor.execute(f"SELECT bit_position FROM theme WHERE name IN ({placeholders(themes)}) "
+                   f"AND bit_position IS NOT NULL", themes)
+    bits = [row[0] for row in cursor.fetchall()]
+    if len(bits) != len(set(themes)):
+        raise NotApplicable("a theme has no bit position")
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
+    return mask
+
+def require_themes(case):
+    if not case['themes']:
+        raise NotApplicable("needs themes")
+    return case['themes']
+
+# --- random puzzle --------------------------------------------------------
+
+def random_order_by_rand(cursor, case, rng):
+    """Current fallback: sort every matching row randomly."""
+    band = [case['min_rating'], case['max_rating']]
+    if case['themes']:
+        source, params = theme_join(case['themes'])
+        cursor.execute(f"SELECT p.id {source} WHERE p.rating BETWEEN %s AND %s ORDER BY RAND() LIMIT 1",
+                       params + band)
+    else:
+        cursor.execute("SELECT id FROM puzzle WHERE rating BETWEEN %s AND %s ORDER BY RAND() LIMIT 1", band)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def random_offset(cursor, case, rng):
+    """Count the matches, then skip a random number of them."""
+    band = [case['min_rating'], case['max_rating']]
+    if case['themes']:
+        source, params = theme_join(case['themes'])
+    else:
+        source, params = "FROM puzzle p", []
+    where = "WHERE p.rating BETWEEN %s AND %s"
+
+    cursor.execute(f"SELECT COUNT(*) {source} {where}", params + band)
+    count = cursor.fetchone()[0]
+    if not count:
+        return None
+    cursor.execute(f"SELECT p.id {source} {where} LIMIT 1 OFFSET %s", params + band + [rng.randrange(count)])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def random_id_range(cursor, case, rng):
+    """Seek to the first match at or after a random ID, wrapping around to the first one.
+
+    Cheap but biased towards puzzles that follow large gaps in the ID space.
+    """
+    band = [case['min_rating'], case['max_rating']]
+    pivot = bytes(rng.choice(ALPHABET) for _ in range(5)).decode('ascii')
+    if case['themes']:
+        source, params = theme_join(case['themes'])
+    else:
+        source, params = "FROM puzzle p", []
+
+    cursor.execute(f"SELECT p.id {source} WHERE p.rating BETWEEN %s AND %s AND p.id >= %s ORDER BY p.id LIMIT 1",
+                   params + band + [pivot])
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(f"SELECT p.id {source} WHERE p.rating BETWEEN %s AND %s ORDER BY p.id LIMIT 1",
+                       params + band)
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def random_sampling_table(cursor, case, rng):
+    """Draw a sequence number from puzzle_sample_slice, then look it up (build_sampling_index.py)."""
+    band = [case['min_rating'], case['max_rating']]
+    if case['themes']:
+        cursor.execute(f"""
+            SELECT s.theme_id, MIN(s.min_seq), MAX(s.max_seq)
+            FROM puzzle_sample_slice s
+            JOIN theme t ON t.id = s.theme_id
+            WHERE t.name IN ({placeholders(case['themes'])}) AND s.rating BETWEEN %s AND %s
+            GROUP BY s.theme_id
+        """, list(case['themes']) + band)
+    else:
+        cursor.execute("""
+            SELECT theme_id, MIN(min_seq), MAX(max_seq)
+            FROM puzzle_sample_slice
+            WHERE theme_id = %s AND rating BETWEEN %s AND %s
+            GROUP BY theme_id
+        """, [ALL_THEMES] + band)
+    intervals = cursor.fetchall()
+
+    total = sum(max_seq - min_seq + 1 for _, min_seq, max_seq in intervals)
+    if not total:
+        return None
+    position = rng.randrange(total)
+    for theme_id, min_seq, max_seq in intervals:
+        size = max_seq - min_seq + 1
+        if position < size:
+            cursor.execute("SELECT puzzle_id FROM puzzle_sample WHERE theme_id = %s AND seq = %s",
+                           (theme_id, min_seq + position))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        position -= size
+    return None
+
+def random_theme_mask(cursor, case, rng):
+    """ORDER BY RAND() over the theme bitmask instead of the theme join (theme_mask.py)."""
+    mask = theme_mask(cursor, require_themes(case))
+    cursor.execute("SELECT id FROM puzzle WHERE rating BETWEEN %s AND %s AND theme_mask & %s != 0 "
+                   "ORDER BY RAND() LIMIT 1", (case['min_rating'], case['max_rating'], mask))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# --- puzzles by themes ----------------------------------------------------
+
+# Ties on popularity are broken by ID so every strategy returns the same page
+PAGE_ORDER = f"ORDER BY p.popularity DESC, p.id LIMIT {PAGE_SIZE} OFFSET %s"
+
+def page_offset(case):
+    return (case['page'] - 1) * PAGE_SIZE
+
+def page_join(cursor, case, rng):
+    """Current query: join through puzzle_theme, DISTINCT against puzzles having several of the themes."""
+    source, params = theme_join(require_themes(case))
+    cursor.execute(f"SELECT DISTINCT p.id, p.popularity {source} WHERE p.rating BETWEEN %s AND %s {PAGE_ORDER}",
+                   params + [case['min_rating'], case['max_rating'], page_offset(case)])
+    return [row[0] for row in cursor.fetchall()]
+
+def page_exists(cursor, case, rng):
+    condition, params = theme_exists(require_themes(case))
+    cursor.execute(f"SELECT p.id FROM puzzle p WHERE p.rating BETWEEN %s AND %s AND {condition} {PAGE_ORDER}",
+                   [case['min_rating'], case['max_rating']] + params + [page_offset(case)])
+    return [row[0] for row in cursor.fetchall()]
+
+def page_in_subquery(cursor, case, rng):
+    themes = require_themes(case)
+    cursor.execute(f"""
+        SELECT p.id FROM puzzle p
+        WHERE p.rating BETWEEN %s AND %s
+        AND p.id IN (SELECT pt.puzzle_id FROM puzzle_theme pt JOIN theme t ON t.id = pt.theme_id
+                     WHERE t.name IN ({placeholders(themes)}))
+        {PAGE_ORDER}
+    """, [case['min_rating'], case['max_rating']] + list(themes) + [page_offset(case)])
+    return [row[0] for row in cursor.fetchall()]
+
+def page_theme_mask(cursor, case, rng):
+    mask = theme_mask(cursor, require_themes(case))
+    cursor.execute(f"SELECT p.id FROM puzzle p WHERE p.rating BETWEEN %s AND %s AND p.theme_mask & %s != 0 "
+                   f"{PAGE_ORDER}", (case['min_rating'], case['max_rating'], mask, page_offset(case)))
+    return [row[0] for row in cursor.fetchall()]
+
+# --- totals ---------------------------------------------------------------
+
+def count_join_distinct(cursor, case, rng):
+    """Current count: COUNT(DISTINCT) over the theme join."""
+    source, params = theme_join(require_themes(case))
+    cursor.execute(f"SELECT COUNT(DISTINCT p.id) {source} WHERE p.rating BETWEEN %s AND %s",
+                   params + [case['min_rating'], case['max_rating']])
+    return cursor.fetchone()[0]
+
+def count_exists(cursor, case, rng):
+    condition, params = theme_exists(require_themes(case))
+    cursor.execute(f"SELECT COUNT(*) FROM puzzle p WHERE p.rating BETWEEN %s AND %s AND {condition}",
+                   [case['min_rating'], case['max_rating']] + params)
+    return cursor.fetchone()[0]
+
+def count_theme_mask(cursor, case, rng):
+    mask = theme_mask(cursor, require_themes(case))
+    cursor.execute("SELECT COUNT(*) FROM puzzle p WHERE p.rating BETWEEN %s AND %s AND p.theme_mask & %s != 0",
+                   (case['min_rating'], case['max_rating'], mask))
+    return cursor.fetchone()[0]
+
+def count_stats(cursor, case, rng):
+    """Sum of puzzle_stats_rating (build_theme_stats.py), single themes and whole buckets only."""
+    themes = require_themes(case)
+    if len(set(themes)) != 1:
+        raise NotApplicable("stats only answer single themes")
+    cursor.execute("""
+        SELECT COUNT(*),
+               SUM(s.rating_min < %s AND s.rating_max >= %s OR s.rating_min <= %s AND s.rating_max > %s),
+               SUM(CASE WHEN s.rating_min >= %s AND s.rating_max <= %s THEN s.puzzles ELSE 0 END)
+        FROM puzzle_stats_rating s
+        JOIN theme t ON t.id = s.theme_id
+        WHERE t.name = %s
+    """, (case['min_rating'], case['min_rating'], case['max_rating'], case['max_rating'],
+          case['min_rating'], case['max_rating'], themes[0]))
+    buckets, partial, total = cursor.fetchone()
+    if not buckets or partial:
+        raise NotApplicable("rating band does not cover whole buckets")
+    return int(total)
+
+STRATEGIES = {
+    'random': {
+        'order_by_rand': random_order_by_rand,
+        'random_offset': random_offset,
+        'random_id_range': random_id_range,
+        'sampling_table': random_sampling_table,
+        'theme_mask': random_theme_mask,
+    },
+    'by-themes': {
+        'join': page_join,
+        'exists': page_exists,
+        'in_subquery': page_in_subquery,
+        'theme_mask': page_theme_mask,
+    },
+    'count': {
+        'join_distinct': count_join_distinct,
+        'exists': count_exists,
+        'theme_mask': count_theme_mask,
+        'stats': count_stats,
+    },
+}
+
+# Groups whose strategies must agree on the result
+DETERMINISTIC_GROUPS = {'by-themes', 'count'}
+
+def rows_examined(cursor, statements):
+    """Rows examined by the last `statements` statements of this connection, None without performance_schema."""
+    try:
+        cursor.execute("""
+            SELECT SUM(ROWS_EXAMINED) FROM (
+                SELECT ROWS_EXAMINED FROM performance_schema.events_statements_history
+                WHERE THREAD_ID = PS_CURRENT_THREAD_ID()
+                ORDER BY EVENT_ID DESC LIMIT %s
+            ) AS recent
+        """, (statements,))
+        value = cursor.fetchone()[0]
+        return int(value) if value is not None else None
+    except Error:
+        return None
+
+def explain(cursor, statements):
+    """EXPLAIN ANALYZE of each statement, falling back to EXPLAIN on servers without it."""
+    plans = []
+    for sql, params in statements:
+        plan = None
+        for prefix in ('EXPLAIN ANALYZE ', 'EXPLAIN FORMAT=TREE ', 'EXPLAIN '):
+            try:
+                cursor.execute(prefix + sql, params)
+                rows = cursor.fetchall()
+                plan = '\n'.join(' | '.join('' if v is None else str(v) for v in row) for row in rows)
+                break
+            except Error:
+                continue
+        plans.append({'sql': ' '.join(sql.split()), 'params': [str(p) for p in params], 'plan': plan})
+    return plans
+
+def fingerprint(result):
+    return hashlib.md5(json.dumps(result, default=str).encode()).hexdigest()[:12]
+
+def benchmark_case(cursor, group, name, strategy, case, iterations, warmup, seed, with_plans):
+    """Time one strategy on one case; returns its entry of the report."""
+    rng = random.Random(seed)
+    latencies = []
+    examined = []
+    result = None
+    recorder = None
+
+    try:
+        for i in range(warmup + iterations):
+            recorder = RecordingCursor(cursor)
+            start = time.perf_counter()
+            result = strategy(recorder, case, rng)
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                latencies.append(elapsed * 1000)
+                examined.append(rows_examined(cursor, len(recorder.statements)))
+    except NotApplicable as e:
+        return {'status': 'not applicable', 'reason': str(e)}
+    except Error as e:
+        return {'status': 'unavailable', 'reason': e.msg}
+
+    latencies = np.array(latencies)
+    known = [value for value in examined if value is not None]
+    entry = {
+        'status': 'ok',
+        'iterations': iterations,
+        'p50': float(np.percentile(latencies, 50)),
+        'p90': float(np.percentile(latencies, 90)),
+        'p99': float(np.percentile(latencies, 99)),
+        'max': float(latencies.max()),
+        'rows_examined': float(np.mean(known)) if known else None,
+        'statements': len(recorder.statements),
+    }
+    if group in DETERMINISTIC_GROUPS:
+        entry['result'] = fingerprint(result)
+    if with_plans:
+        entry['plans'] = explain(cursor, recorder.statements)
+    return entry
+
+def parse_bands(value):
+    bands = []
+    for band in value.split(','):
+        low, _, high = band.strip().partition('-')
+        bands.append((int(low), int(high)))
+    return bands
+
+def parse_theme_sets(value):
+    """'fork;fork,pin;' -> [['fork'], ['fork', 'pin'], []]; an empty entry means no theme filter."""
+    return [[t.strip() for t in entry.split(',') if t.strip()] for entry in value.split(';')]
+
+def case_label(case):
+    themes = ','.join(case['themes']) or 'no theme'
+    return f"{case['min_rating']}-{case['max_rating']} / {themes}"
+
+def write_report(path, report):
+    """Write the comparison as Markdown, one table per group and case, plans at the end."""
+    lines = [
+        "# Query strategy benchmark",
+        "",
+        f"- Run at: {report['timestamp']}",
+        f"- Server: {report['server']}",
+        f"- Puzzles: {report['puzzles']:,}",
+        f"- Iterations per strategy and case: {report['iterations']} (after {report['warmup']} warm-up)",
+        "",
+        "Latencies in milliseconds, rows examined per execution (all statements of the strategy). "
+        "`*` marks the fastest p50 of a case; a strategy whose result differs from the others is flagged.",
+    ]
+
+    plans = []
+    for group, cases in report['groups'].items():
+        lines += ["", f"## {group}"]
+        for label, strategies in cases.items():
+            lines += ["", f"### {label}", "",
+                      "| strategy | p50 | p90 | p99 | max | rows examined | note |",
+                      "|---|---:|---:|---:|---:|---:|---|"]
+
+            timed = {name: entry for name, entry in strategies.items() if entry['status'] == 'ok'}
+            fastest = min(timed, key=lambda name: timed[name]['p50']) if timed else None
+            results = [entry['result'] for entry in timed.values() if 'result' in entry]
+            majority = max(set(results), key=results.count) if results else None
+
+            for name, entry in strategies.items():
+                if entry['status'] != 'ok':
+                    lines.append(f"| {name} | | | | | | {entry['status']}: {entry['reason']} |")
+                    continue
+                note = []
+                if name == fastest:
+                    note.append('*')
+                if 'result' in entry and entry['result'] != majority:
+                    note.append('different result')
+                examined = f"{entry['rows_examined']:,.0f}" if entry['rows_examined'] is not None else ''
+                lines.append(f"| {name} | {entry['p50']:.2f} | {entry['p90']:.2f} | {entry['p99']:.2f} | "
+                             f"{entry['max']:.2f} | {examined} | {' '.join(note)} |")
+                for plan in entry.get('plans', []):
+                    plans.append((group, label, name, plan))
+
+    if plans:
+        lines += ["", "## Plans"]
+        for group, label, name, plan in plans:
+            lines += ["", f"### {group} / {label} / {name}", "", "```sql", plan['sql'],
+                      f"-- params: {', '.join(plan['params'])}", "```", "", "```",
+                      plan['plan'] or 'EXPLAIN failed', "```"]
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+def benchmark_queries(bands, theme_sets, groups, iterations=20, warmup=2, page=1, seed=0,
+                      with_plans=True, report_path='query_benchmark.md', json_path='query_benchmark.json'):
+    connection = create_connection()
+    cursor = connection.cursor(buffered=True)
+
+    try:
+        cursor.execute("SELECT VERSION()")
+        server = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM puzzle")
+        puzzles = cursor.fetchone()[0]
+
+        cases = [{'min_rating': low, 'max_rating': high, 'themes': themes, 'page': page}
+                 for low, high in bands for themes in theme_sets]
+        report = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'server': server,
+            'puzzles': puzzles,
+            'iterations': iterations,
+            'warmup': warmup,
+            'page': page,
+            'groups': {}
+        }
+
+        runs = [(group, name, strategy, case)
+                for group in groups for case in cases for name, strategy in STRATEGIES[group].items()]
+        for group, name, strategy, case in tqdm(runs, desc="Benchmarking"):
+            entry = benchmark_case(cursor, group, name, strategy, case, iterations, warmup, seed, with_plans)
+            report['groups'].setdefault(group, {}).setdefault(case_label(case), {})[name] = entry
+
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        write_report(report_path, report)
+        print(f"\nReport written to {report_path}, raw results to {json_path}")
+
+    except Error as e:
+        print(f"Error while benchmarking: {e}")
+        sys.exit(1)
+
+    finally:
+        cursor.close()
+        connection.close()
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Compare the candidate SQL strategies of the puzzle endpoints on the real tables')
+    parser.add_argument('--bands', default=DEFAULT_BANDS,
+                        help=f'Comma-separated rating bands (default: {DEFAULT_BANDS})')
+    parser.add_argument('--themes', default=DEFAULT_THEME_SETS,
+                        help=f'Semicolon-separated theme sets, comma-separated themes within a set, '
+                             f'an empty set for no theme filter (default: "{DEFAULT_THEME_SETS}")')
+    parser.add_argument('--groups', default=','.join(STRATEGIES),
+                        help=f'Comma-separated query groups to run (default: {",".join(STRATEGIES)})')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='Timed executions per strategy and case (default: 20)')
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='Untimed executions first, to warm the buffer pool (default: 2)')
+    parser.add_argument('--page', type=int, default=1,
+                        help='Page of the by-themes queries (default: 1)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random strategies (default: 0)')
+    parser.add_argument('--no-explain', action='store_true',
+                        help='Skip EXPLAIN ANALYZE, which runs every statement once more')
+    parser.add_argument('--report', default='query_benchmark.md',
+                        help='Markdown report path (default: query_benchmark.md)')
+    parser.add_argument('--json', default='query_benchmark.json',
+                        help='Raw results path (default: query_benchmark.json)')
+    args = parser.parse_args()
+
+    args.groups = [g.strip() for g in args.groups.split(',') if g.strip()]
+    unknown = [g for g in args.groups if g not in STRATEGIES]
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(unknown)}")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    benchmark_queries(parse_bands(args.bands), parse_theme_sets(args.themes), args.groups,
+                      iterations=args.iterations, warmup=args.warmup, page=args.page, seed=args.seed,
+                      with_plans=not args.no_explain, report_path=args.report, json_path=args.json)
@@ -0,0 +1,279 @@
+"""
+Sampling tables for picking random puzzles by rating and theme.
+
+Within each theme (0 for all puzzles) puzzles are numbered in (rating, id)
+order in puzzle_sample, and puzzle_sample_slice records the seq interval and
+a fingerprint of every (theme, rating) slice.
+
+The first run, or --full, fingerprints every slice with a GROUP BY over puzzle
+and puzzle_theme and renumbers the themes from their lowest changed slice.
+Later runs read the puzzles logged by the writers since the last build (see
+change_log.py) instead: where those puzzles were numbered is looked up in
+puzzle_sample and the slice table, their current rating and themes in
+puzzle, and each theme they touch is renumbered from the lowest of these
+ratings. Only the slices from there up are counted again. A write that was not
+logged per puzzle makes the next run start over from the full fingerprint.
+"""
+
+import sys
+import time
+import argparse
+from mysql.connector import Error
+from tqdm import tqdm
+from change_log import (LOG_TABLE, create_log_table, data_generation, read_generation, record_build, prune_log,
+                        unlogged_since)
+from import_puzzles import create_connection
+
+SAMPLE_TABLE = 'puzzle_sample'
+SLICE_TABLE = 'puzzle_sample_slice'
+
+# Pseudo theme under which every puzzle is numbered, for requests without a theme filter
+ALL_THEMES = 0
+
+# 64-bit fingerprint of a puzzle ID, XORed over a slice to detect membership changes
+ID_HASH = "CAST(CONV(SUBSTRING(MD5({}), 1, 16), 16, 10) AS UNSIGNED)"
+
+def create_tables(cursor):
+    """Create the sampling tables.
+
+    Within each theme, puzzles are numbered 1..n in (rating, id) order, so every
+    (theme, rating) slice owns a consecutive run of sequence numbers recorded in
+    the slice table. A rating range therefore maps to one seq interval, and a
+    random puzzle is a random seq in it followed by a primary key lookup.
+    """
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SAMPLE_TABLE} (
+            theme_id INT NOT NULL,
+            seq INT UNSIGNED NOT NULL,
+            puzzle_id VARCHAR(10) NOT NULL COLLATE utf8mb4_bin,
+            PRIMARY KEY (theme_id, seq),
+            KEY puzzle_idx (puzzle_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    # Tables created before the incremental runs lack the index they look logged puzzles up with
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = 'puzzle_idx'
+    """, (SAMPLE_TABLE,))
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"ALTER TABLE {SAMPLE_TABLE} ADD INDEX puzzle_idx (puzzle_id)")
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SLICE_TABLE} (
+            theme_id INT NOT NULL,
+            rating SMALLINT UNSIGNED NOT NULL,
+            min_seq INT UNSIGNED NOT NULL,
+            max_seq INT UNSIGNED NOT NULL,
+            checksum BIGINT UNSIGNED NOT NULL,
+            PRIMARY KEY (theme_id, rating)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def current_slices(cursor):
+    """Return {theme_id: {rating: (count, checksum)}} for the puzzles in the database."""
+    slices = {}
+
+    cursor.execute(f"SELECT rating, COUNT(*), BIT_XOR({ID_HASH.format('id')}) FROM puzzle GROUP BY rating")
+    slices[ALL_THEMES] = {rating: (count, int(checksum)) for rating, count, checksum in cursor.fetchall()}
+
+    cursor.execute(f"""
+        SELECT pt.theme_id, p.rating, COUNT(*), BIT_XOR({ID_HASH.format('p.id')})
+        FROM puzzle_theme pt
+        JOIN puzzle p ON p.id = pt.puzzle_id
+        GROUP BY pt.theme_id, p.rating
+    """)
+    for theme_id, rating, count, checksum in cursor.fetchall():
+        slices.setdefault(theme_id, {})[rating] = (count, int(checksum))
+    return slices
+
+def theme_slices(cursor, theme_id, from_rating):
+    """Return {rating: (count, checksum)} for the puzzles of a theme rated `from_rating` or more."""
+    if theme_id == ALL_THEMES:
+        cursor.execute(f"""
+            SELECT rating, COUNT(*), BIT_XOR({ID_HASH.format('id')}) FROM puzzle
+            WHERE rating >= %s GROUP BY rating
+        """, (from_rating,))
+    else:
+        cursor.execute(f"""
+            SELECT p.rating, COUNT(*), BIT_XOR({ID_HASH.format('p.id')})
+            FROM puzzle_theme pt
+            JOIN puzzle p ON p.id = pt.puzzle_id
+            WHERE pt.theme_id = %s AND p.rating >= %s
+            GROUP BY p.rating
+        """, (theme_id, from_rating))
+    return {rating: (count, int(checksum)) for rating, count, checksum in cursor.fetchall()}
+
+def stored_slices(cursor):
+    """Return {theme_id: {rating: (count, checksum, max_seq)}} from the slice table."""
+    slices = {}
+    cursor.execute(f"SELECT theme_id, rating, min_seq, max_seq, checksum FROM {SLICE_TABLE}")
+    for theme_id, rating, min_seq, max_seq, checksum in cursor.fetchall():
+        slices.setdefault(theme_id, {})[rating] = (max_seq - min_seq + 1, int(checksum), max_seq)
+    return slices
+
+def first_change(current, stored):
+    """Return the lowest rating whose slice differs, or None if the theme is unchanged."""
+    for rating in sorted(set(current) | set(stored)):
+        if rating not in current or rating not in stored or current[rating] != stored[rating][:2]:
+            return rating
+    return None
+
+def logged_changes(cursor, since, stored):
+    """Return {theme_id: lowest rating to renumber from} for the puzzles logged since `since`.
+
+    A logged puzzle leaves the slices it is numbered in and joins those of its
+    current rating and themes, so each theme changes from the lowest of both.
+    """
+    changes = {}
+
+    def lower(theme_id, rating):
+        if rating is not None:
+            changes[theme_id] = min(rating, changes.get(theme_id, rating))
+
+    # Seqs follow the rating order, so the lowest seq of a theme falls in its lowest old slice
+    cursor.execute(f"""
+        SELECT s.theme_id, MIN(s.seq)
+        FROM {LOG_TABLE} c
+        JOIN {SAMPLE_TABLE} s ON s.puzzle_id = c.puzzle_id
+        WHERE c.generation >= %s
+        GROUP BY s.theme_id
+    """, (since,))
+    for theme_id, seq in cursor.fetchall():
+        slices = stored.get(theme_id, {})
+        lower(theme_id, min((rating for rating, (_, _, max_seq) in slices.items() if max_seq >= seq), default=None))
+
+    cursor.execute(f"""
+        SELECT MIN(p.rating)
+        FROM {LOG_TABLE} c
+        JOIN puzzle p ON p.id = c.puzzle_id
+        WHERE c.generation >= %s
+    """, (since,))
+    lower(ALL_THEMES, cursor.fetchone()[0])
+
+    cursor.execute(f"""
+        SELECT pt.theme_id, MIN(p.rating)
+        FROM {LOG_TABLE} c
+        JOIN puzzle_theme pt ON pt.puzzle_id = c.puzzle_id
+        JOIN puzzle p ON p.id = c.puzzle_id
+        WHERE c.generation >= %s
+        GROUP BY pt.theme_id
+    """, (since,))
+    for theme_id, rating in cursor.fetchall():
+        lower(theme_id, rating)
+    return changes
+
+def renumber_theme(cursor, theme_id, from_rating, current, stored):
+    """Rewrite the sequence numbers of a theme from `from_rating` up.
+
+    Slices below it are unchanged, so their numbers are kept and the rewrite
+    continues after the last of them. Returns the number of rows written.
+    """
+    kept = [stored[rating][2] for rating in stored if rating < from_rating]
+    offset = max(kept) if kept else 0
+
+    cursor.execute(f"DELETE FROM {SAMPLE_TABLE} WHERE theme_id = %s AND seq > %s", (theme_id, offset))
+    cursor.execute(f"DELETE FROM {SLICE_TABLE} WHERE theme_id = %s AND rating >= %s", (theme_id, from_rating))
+
+    if theme_id == ALL_THEMES:
+        source = "FROM puzzle p WHERE p.rating >= %s"
+        params = (theme_id, offset, from_rating)
+    else:
+        source = "FROM puzzle p JOIN puzzle_theme pt ON pt.puzzle_id = p.id AND pt.theme_id = %s WHERE p.rating >= %s"
+        params = (theme_id, offset, theme_id, from_rating)
+    cursor.execute(
+        f"INSERT INTO {SAMPLE_TABLE} (theme_id, seq, puzzle_id) "
+        f"SELECT %s, %s + ROW_NUMBER() OVER (ORDER BY p.rating, p.id), p.id {source}",
+        params
+    )
+    written = cursor.rowcount
+
+    # Same (rating, id) order as ROW_NUMBER above, so the bounds follow from the counts
+    slices = []
+    next_seq = offset + 1
+    for rating in sorted(r for r in current if r >= from_rating):
+        count, checksum = current[rating]
+        slices.append((theme_id, rating, next_seq, next_seq + count - 1, checksum))
+        next_seq += count
+    if slices:
+        cursor.executemany(
+            f"INSERT INTO {SLICE_TABLE} (theme_id, rating, min_seq, max_seq, checksum) VALUES (%s, %s, %s, %s, %s)",
+            slices
+        )
+    return written
+
+def build_sampling_index(full=False):
+    start_time = time.time()
+    connection = create_connection()
+    cursor = connection.cursor()
+
+    try:
+        create_tables(cursor)
+        create_log_table(cursor)
+        # Read first, a write committed during the build leaves the tables behind
+        built_from = data_generation(cursor)
+        built = read_generation(cursor, SAMPLE_TABLE)
+        cursor.execute('SET autocommit=0')
+
+        if full:
+            print("Full rebuild requested, clearing the sampling tables")
+            cursor.execute(f"DELETE FROM {SLICE_TABLE}")
+            cursor.execute(f"DELETE FROM {SAMPLE_TABLE}")
+            connection.commit()
+
+        stored = stored_slices(cursor)
+        step_start = time.time()
+        if full or built is None or unlogged_since(cursor, built):
+            print("Fingerprinting (theme, rating) slices...")
+            current = current_slices(cursor)
+            print(f"Fingerprinted {sum(len(s) for s in current.values()):,} slices "
+                  f"in {time.time() - step_start:.2f} seconds")
+
+            changes = {}
+            for theme_id in sorted(set(current) | set(stored)):
+                from_rating = first_change(current.get(theme_id, {}), stored.get(theme_id, {}))
+                if from_rating is not None:
+                    changes[theme_id] = from_rating
+            print(f"Themes to renumber: {len(changes)} of {len(current)}")
+        else:
+            current = None
+            changes = logged_changes(cursor, built, stored)
+            print(f"Read the puzzles logged since generation {built} in {time.time() - step_start:.2f} seconds")
+            print(f"Themes to renumber: {len(changes)} of {len(stored)}")
+
+        rows_written = 0
+        for theme_id, from_rating in tqdm(sorted(changes.items()), desc="Renumbering themes"):
+            # Without a full fingerprint only the slices being renumbered are counted
+            slices = current.get(theme_id, {}) if current is not None else theme_slices(cursor, theme_id, from_rating)
+            rows_written += renumber_theme(cursor, theme_id, from_rating, slices, stored.get(theme_id, {}))
+            # One transaction per theme, readers keep sampling the old numbering until it commits
+            connection.commit()
+
+        record_build(cursor, SAMPLE_TABLE, built_from)
+        prune_log(cursor, built_from)
+        connection.commit()
+
+        print(f"\nSample rows written: {rows_written:,}")
+        print(f"Total time: {time.time() - start_time:.2f} seconds")
+
+    except Error as e:
+        print(f"Error while building the sampling index: {e}")
+        connection.rollback()
+        sys.exit(1)
+
+    finally:
+        cursor.execute('SET autocommit=1')
+        cursor.close()
+        connection.close()
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Build the puzzle_sample tables used to pick random puzzles by rating and theme; '
+                    'run after every import, only the themes of the puzzles written since the last run '
+                    'are renumbered, from their lowest changed rating')
+    parser.add_argument('--full', action='store_true',
+                        help='Clear the sampling tables and renumber every theme')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_sampling_index(full=args.full)
@@ -0,0 +1,318 @@
+"""
+Summary tables for theme and rating queries.
+
+puzzle_stats_rating holds the number of puzzles per theme and rating bucket,
+theme 0 counting every puzzle, and puzzle_stats_pair the number of puzzles
+sharing each pair of themes. The API reads its totals and related themes from
+them instead of counting over puzzle_theme.
+
+Counts come from a single scan of puzzle (id, rating, theme_mask), so the
+masks must be current (see theme_mask.py, run it after bulk imports and
+migrate_themes.py). The scanned state is saved to a snapshot file; later runs
+diff a new scan against it and only apply the counts that changed. The data
+generation read before the scan is recorded under 'puzzle_stats' (see
+change_log.py), so the API stops using the counts once the data moves on.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from mysql.connector import Error
+from tqdm import tqdm
+from change_log import data_generation, record_build
+from id_index import encode_ids, lookup, INVALID_KEY
+from import_puzzles import create_connection
+from theme_mask import MAX_BITS, has_mask_column
+
+RATING_TABLE = 'puzzle_stats_rating'
+PAIR_TABLE = 'puzzle_stats_pair'
+STATE_TABLE = 'puzzle_stats_state'
+
+# Name the data generation of the tables is recorded under in change_log.STATE_TABLE
+BUILD_NAME = 'puzzle_stats'
+
+# Same convention as the sampling index: theme 0 stands for all puzzles
+ALL_THEMES = 0
+
+DEFAULT_SNAPSHOT = 'theme_stats.npz'
+
+# API rating ranges are arbitrary inclusive bounds and only ranges made of whole
+# buckets can be answered from the table, hence one bucket per rating by default
+DEFAULT_BUCKET_SIZE = 1
+
+BLOCK_SIZE = 100000
+
+def create_tables(cursor):
+    # Counts are signed so incremental deltas can be added before empty cells are removed
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RATING_TABLE} (
+            theme_id INT NOT NULL,
+            rating_min SMALLINT UNSIGNED NOT NULL,
+            rating_max SMALLINT UNSIGNED NOT NULL,
+            puzzles INT NOT NULL,
+            PRIMARY KEY (theme_id, rating_min)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PAIR_TABLE} (
+            theme_id INT NOT NULL,
+            other_theme_id INT NOT NULL,
+            puzzles INT NOT NULL,
+            PRIMARY KEY (theme_id, other_theme_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    # Single row tying the tables to the snapshot they were last built from
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+            generation INT UNSIGNED NOT NULL,
+            bucket_size SMALLINT UNSIGNED NOT NULL,
+            built_at DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+class ThemeStats:
+    """Puzzle counts per (rating bucket, theme bit) and per pair of theme bits.
+
+    Column MAX_BITS of `ratings` counts every puzzle of the bucket. Counts are
+    signed so a delta between two scans is a ThemeStats as well.
+    """
+
+    def __init__(self, bucket_size):
+        self.bucket_size = bucket_size
+        self.ratings = np.zeros((0, MAX_BITS + 1), dtype=np.int64)
+        self.pairs = np.zeros((MAX_BITS, MAX_BITS), dtype=np.int64)
+
+    def add(self, ratings, masks, sign=1):
+        """Count the puzzles with the given ratings and theme masks, or uncount them with sign=-1."""
+        shifts = np.arange(MAX_BITS, dtype=np.uint64)
+        for start in range(0, len(masks), BLOCK_SIZE):
+            block_masks = np.asarray(masks[start:start + BLOCK_SIZE], dtype=np.uint64)
+            buckets = np.asarray(ratings[start:start + BLOCK_SIZE], dtype=np.int64) // self.bucket_size
+
+            # One row per puzzle, one column per theme bit
+            bits = ((block_masks[:, None] >> shifts) & np.uint64(1)).astype(np.float32)
+
+            rows, columns = np.nonzero(bits)
+            counts = np.bincount(buckets[rows] * (MAX_BITS + 1) + columns,
+                                 minlength=(buckets.max(initial=0) + 1) * (MAX_BITS + 1))
+            counts = counts.reshape(-1, MAX_BITS + 1)
+            counts[:, MAX_BITS] += np.bincount(buckets, minlength=len(counts))
+
+            if len(counts) > len(self.ratings):
+                self.ratings = np.pad(self.ratings, ((0, len(counts) - len(self.ratings)), (0, 0)))
+            self.ratings[:len(counts)] += sign * counts
+
+            # Float32 products are exact, a block count stays far below 2 ** 24
+            self.pairs += sign * np.rint(bits.T @ bits).astype(np.int64)
+
+    def rating_rows(self, theme_of_bit):
+        """Non-zero cells as (theme_id, rating_min, rating_max, puzzles) rows."""
+        buckets, columns = np.nonzero(self.ratings)
+        theme_ids = np.append(theme_of_bit, ALL_THEMES)[columns]
+        keep = theme_ids >= 0
+        rating_min = buckets * self.bucket_size
+        return list(zip(theme_ids[keep].tolist(), rating_min[keep].tolist(),
+                        (rating_min[keep] + self.bucket_size - 1).tolist(),
+                        self.ratings[buckets[keep], columns[keep]].tolist()))
+
+    def pair_rows(self, theme_of_bit):
+        """Non-zero cells off the diagonal as (theme_id, other_theme_id, puzzles) rows, both ways round."""
+        first, second = np.nonzero(self.pairs)
+        theme_ids, other_ids = theme_of_bit[first], theme_of_bit[second]
+        keep = (first != second) & (theme_ids >= 0) & (other_ids >= 0)
+        return list(zip(theme_ids[keep].tolist(), other_ids[keep].tolist(),
+                        self.pairs[first[keep], second[keep]].tolist()))
+
+def load_theme_bits(cursor):
+    """Return an array mapping bit -> theme_id, -1 for bits not assigned to a theme."""
+    theme_of_bit = np.full(MAX_BITS, -1, dtype=np.int64)
+    cursor.execute("SELECT id, bit_position FROM theme WHERE bit_position IS NOT NULL")
+    for theme_id, bit in cursor.fetchall():
+        if bit < MAX_BITS:
+            theme_of_bit[bit] = theme_id
+    return theme_of_bit
+
+def scan_puzzles(connection, fetch_size=100000):
+    """Stream puzzle once and return (sorted packed IDs, ratings, theme masks)."""
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM puzzle")
+    total = cursor.fetchone()[0]
+    cursor.close()
+
+    keys, ratings, masks = [], [], []
+    cursor = connection.cursor(buffered=False)
+    try:
+        cursor.execute("SELECT id, rating, theme_mask FROM puzzle")
+        with tqdm(total=total, desc="Scanning puzzles") as pbar:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                ids, row_ratings, row_masks = zip(*rows)
+                keys.append(encode_ids(ids))
+                ratings.append(np.asarray(row_ratings, dtype=np.uint16))
+                masks.append(np.asarray(row_masks, dtype=np.uint64))
+                pbar.update(len(rows))
+    finally:
+        cursor.close()
+
+    if not keys:
+        return np.array([], dtype=np.uint64), np.array([], dtype=np.uint16), np.array([], dtype=np.uint64)
+
+    keys, ratings, masks = np.concatenate(keys), np.concatenate(ratings), np.concatenate(masks)
+    valid = keys != INVALID_KEY
+    if not valid.all():
+        print(f"Skipping {int((~valid).sum())} puzzles whose ID cannot be packed")
+    order = np.argsort(keys[valid])
+    return keys[valid][order], ratings[valid][order], masks[valid][order]
+
+def load_snapshot(path):
+    """Load the scan of the previous run, or None if there is no usable one."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as snapshot:
+        return {name: snapshot[name] for name in snapshot.files}
+
+def save_snapshot(path, keys, ratings, masks, generation, bucket_size):
+    """Write the snapshot to a temporary file, returned so it can be moved in place after the commit."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, keys=keys, ratings=ratings, masks=masks,
+                 generation=np.int64(generation), bucket_size=np.int64(bucket_size))
+    return tmp_path
+
+def diff_scans(old, keys, ratings, masks, bucket_size):
+    """Return (indexes into the old scan to uncount, indexes into the new scan to count)."""
+    old_keys = old['keys']
+    if not len(old_keys) or not len(keys):
+        return np.arange(len(old_keys)), np.arange(len(keys))
+
+    found, positions = lookup(keys, old_keys)
+    changed = found & (
+        (old['ratings'] // bucket_size != ratings[positions] // bucket_size) |
+        (old['masks'] != masks[positions])
+    )
+    removed = np.flatnonzero(~found | changed)
+
+    added = np.ones(len(keys), dtype=bool)
+    added[positions[found & ~changed]] = False
+    return removed, np.flatnonzero(added)
+
+def write_rows(cursor, stats, theme_of_bit, incremental):
+    """Write the counts, as deltas added to the stored ones when `incremental`."""
+    rating_rows = stats.rating_rows(theme_of_bit)
+    pair_rows = stats.pair_rows(theme_of_bit)
+
+    if incremental:
+        rating_query = (f"INSERT INTO {RATING_TABLE} (theme_id, rating_min, rating_max, puzzles) "
+                        f"VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE puzzles = puzzles + VALUES(puzzles)")
+        pair_query = (f"INSERT INTO {PAIR_TABLE} (theme_id, other_theme_id, puzzles) "
+                      f"VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE puzzles = puzzles + VALUES(puzzles)")
+    else:
+        cursor.execute(f"DELETE FROM {RATING_TABLE}")
+        cursor.execute(f"DELETE FROM {PAIR_TABLE}")
+        rating_query = f"INSERT INTO {RATING_TABLE} (theme_id, rating_min, rating_max, puzzles) VALUES (%s, %s, %s, %s)"
+        pair_query = f"INSERT INTO {PAIR_TABLE} (theme_id, other_theme_id, puzzles) VALUES (%s, %s, %s)"
+
+    for i in range(0, len(rating_rows), 10000):
+        cursor.executemany(rating_query, rating_rows[i:i + 10000])
+    for i in range(0, len(pair_rows), 10000):
+        cursor.executemany(pair_query, pair_rows[i:i + 10000])
+
+    if incremental:
+        cursor.execute(f"DELETE FROM {RATING_TABLE} WHERE puzzles <= 0")
+        cursor.execute(f"DELETE FROM {PAIR_TABLE} WHERE puzzles <= 0")
+    return len(rating_rows), len(pair_rows)
+
+def build_theme_stats(snapshot_path=DEFAULT_SNAPSHOT, bucket_size=DEFAULT_BUCKET_SIZE, full=False):
+    start_time = time.time()
+    connection = create_connection()
+    cursor = connection.cursor()
+
+    try:
+        if not has_mask_column(cursor):
+            print("Error: puzzle.theme_mask does not exist, run the Doctrine migrations and theme_mask.py first")
+            return
+
+        create_tables(cursor)
+        # Read before the scan, a write committed during it leaves the tables behind
+        built_from = data_generation(cursor)
+        cursor.execute('SET autocommit=0')
+
+        cursor.execute(f"SELECT generation, bucket_size FROM {STATE_TABLE} WHERE id = 1")
+        state = cursor.fetchone()
+        generation = state[0] if state else 0
+
+        # The snapshot is only valid if it was saved by the run that committed the current tables
+        old = None if full else load_snapshot(snapshot_path)
+        if old is not None and (state is None or int(old['generation']) != generation
+                                or int(old['bucket_size']) != bucket_size or state[1] != bucket_size):
+            print("Snapshot does not match the stats tables, rebuilding them in full")
+            old = None
+
+        theme_of_bit = load_theme_bits(cursor)
+        if (theme_of_bit < 0).all():
+            print("Warning: no theme has a bit position yet, run theme_mask.py first")
+
+        step_start = time.time()
+        keys, ratings, masks = scan_puzzles(connection)
+        print(f"Scanned {len(keys):,} puzzles in {time.time() - step_start:.2f} seconds")
+
+        step_start = time.time()
+        stats = ThemeStats(bucket_size)
+        if old is None:
+            stats.add(ratings, masks)
+        else:
+            removed, added = diff_scans(old, keys, ratings, masks, bucket_size)
+            print(f"Puzzles to uncount: {len(removed):,}, to count: {len(added):,}")
+            stats.add(old['ratings'][removed], old['masks'][removed], sign=-1)
+            stats.add(ratings[added], masks[added])
+        print(f"Counted in {time.time() - step_start:.2f} seconds")
+
+        rating_rows, pair_rows = write_rows(cursor, stats, theme_of_bit, incremental=old is not None)
+        generation += 1
+        cursor.execute(
+            f"REPLACE INTO {STATE_TABLE} (id, generation, bucket_size, built_at) VALUES (1, %s, %s, NOW())",
+            (generation, bucket_size)
+        )
+        record_build(cursor, BUILD_NAME, built_from)
+
+        tmp_path = save_snapshot(snapshot_path, keys, ratings, masks, generation, bucket_size)
+        connection.commit()
+        os.replace(tmp_path, snapshot_path)
+
+        print(f"\n{'Rating cells changed' if old is not None else 'Rating cells written'}: {rating_rows:,}")
+        print(f"{'Theme pairs changed' if old is not None else 'Theme pairs written'}: {pair_rows:,}")
+        print(f"Total time: {time.time() - start_time:.2f} seconds")
+
+    except Error as e:
+        print(f"Error while building theme stats: {e}")
+        connection.rollback()
+        sys.exit(1)
+
+    finally:
+        cursor.execute('SET autocommit=1')
+        cursor.close()
+        connection.close()
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Build the puzzle_stats tables (puzzles per theme and rating, theme co-occurrence); '
+                    'run after imports and syncs, only the counts of changed puzzles are updated')
+    parser.add_argument('--snapshot', default=DEFAULT_SNAPSHOT,
+                        help=f'Scan of the previous run, diffed against to refresh incrementally '
+                             f'(default: {DEFAULT_SNAPSHOT})')
+    parser.add_argument('--bucket-size', type=int, default=DEFAULT_BUCKET_SIZE,
+                        help=f'Width of the rating buckets; a different size forces a full rebuild '
+                             f'(default: {DEFAULT_BUCKET_SIZE})')
+    parser.add_argument('--full', action='store_true',
+                        help='Ignore the snapshot and recount every puzzle')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_theme_stats(snapshot_path=args.snapshot, bucket_size=args.bucket_size, full=args.full)
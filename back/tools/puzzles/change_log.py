@@ -0,0 +1,178 @@
+"""
+Generation counter and change log of the puzzle data, for the tables derived from it.
+
+Every tool writing puzzle, puzzle_theme or the theme masks advances the
+generation in puzzle_data_state before its first write and again after its
+last one. The derived tables (puzzle_stats_*, puzzle_sample*) record the
+generation they were built from under their own name, and the API only reads
+them while that is still the current generation, falling back to the base
+tables otherwise.
+
+Once a table reading the log (LOG_READERS) has been built, the writers also
+log the IDs of the puzzles whose rating or themes they change in
+puzzle_change, under the generation of their run, so the next build only
+revisits those. Writes that cannot be logged per puzzle (theme migrations,
+snapshot restores) record their generation as unlogged instead, and the next
+build starts over from a full scan.
+
+    changes = DataChanges(connection)
+    try:
+        changes.begin()
+        write(...)
+        changes.log(cursor, ids)
+        connection.commit()
+    finally:
+        changes.end()
+"""
+
+STATE_TABLE = 'puzzle_data_state'
+
+LOG_TABLE = 'puzzle_change'
+
+# Row of STATE_TABLE holding the generation of the puzzle data itself
+DATA = 'puzzle'
+
+# Row of STATE_TABLE holding the last generation whose writes were not logged
+UNLOGGED = 'puzzle_unlogged'
+
+# Derived tables built from the change log; nothing is logged before one of them is built
+LOG_READERS = ('puzzle_sample',)
+
+def create_state_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            name VARCHAR(32) NOT NULL PRIMARY KEY,
+            generation INT UNSIGNED NOT NULL,
+            updated_at DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def create_log_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LOG_TABLE} (
+            generation INT UNSIGNED NOT NULL,
+            puzzle_id VARCHAR(10) NOT NULL COLLATE utf8mb4_bin,
+            PRIMARY KEY (generation, puzzle_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def read_generation(cursor, name=DATA):
+    """Return the generation recorded under `name`, None if there is none."""
+    cursor.execute(f"SELECT generation FROM {STATE_TABLE} WHERE name = %s", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def data_generation(cursor):
+    """Return the current generation of the puzzle data, 0 before the first tracked write."""
+    create_state_table(cursor)
+    return read_generation(cursor) or 0
+
+def record_build(cursor, name, generation):
+    """Record that the derived table `name` was built from `generation`, in the caller's transaction."""
+    cursor.execute(
+        f"REPLACE INTO {STATE_TABLE} (name, generation, updated_at) VALUES (%s, %s, NOW())",
+        (name, generation)
+    )
+
+def unlogged_since(cursor, generation):
+    """Whether writes that were not logged happened at `generation` or after it."""
+    unlogged = read_generation(cursor, UNLOGGED)
+    return unlogged is not None and unlogged >= generation
+
+def log_ids(cursor, generation, ids):
+    """Log the given puzzle IDs under `generation`, in the caller's transaction."""
+    rows = [(generation, puzzle_id) for puzzle_id in ids]
+    if rows:
+        cursor.executemany(f"INSERT IGNORE INTO {LOG_TABLE} (generation, puzzle_id) VALUES (%s, %s)", rows)
+
+def log_query(cursor, generation, query, params=()):
+    """Log the puzzle IDs selected by `query`, a single `id` column, under `generation`."""
+    cursor.execute(
+        f"INSERT IGNORE INTO {LOG_TABLE} (generation, puzzle_id) SELECT %s, q.id FROM ({query}) q",
+        (generation, *params)
+    )
+
+def prune_log(cursor, generation):
+    """Delete the entries logged before `generation`, once every reader was built from it or later."""
+    built = [read_generation(cursor, name) for name in LOG_READERS]
+    generation = min([g for g in built if g is not None] + [generation])
+    cursor.execute(f"DELETE FROM {LOG_TABLE} WHERE generation < %s", (generation,))
+
+def bump_generation(connection):
+    """Advance the data generation in a transaction of its own. Returns the new generation."""
+    cursor = connection.cursor()
+    try:
+        create_state_table(cursor)
+        cursor.execute(
+            f"INSERT INTO {STATE_TABLE} (name, generation, updated_at) VALUES (%s, 1, NOW()) "
+            f"ON DUPLICATE KEY UPDATE generation = generation + 1, updated_at = NOW()",
+            (DATA,)
+        )
+        generation = read_generation(cursor)
+        connection.commit()
+    finally:
+        cursor.close()
+    return generation
+
+class DataChanges:
+    """Generation bumps and change log entries of a run writing puzzle data.
+
+    begin() is called before every write, only the first call bumps, and end()
+    once the last write is committed or rolled back, typically from the
+    `finally` of the run; a run that wrote nothing leaves the generation alone.
+    Bumping on both sides makes the derived tables stale for the API while the
+    run writes, and again for a build that ran concurrently with it.
+
+    With `logged=False` the run records its generation as unlogged rather than
+    logging IDs. `log_generation` is the generation to log under, None while
+    nothing is to be logged; worker processes get it instead of the object.
+    """
+
+    def __init__(self, connection, logged=True):
+        self.connection = connection
+        self.logged = logged
+        self.generation = None
+        self.log_generation = None
+
+    def begin(self):
+        if self.generation is not None:
+            return self.generation
+        self.generation = bump_generation(self.connection)
+
+        cursor = self.connection.cursor()
+        try:
+            create_log_table(cursor)
+            readers = any(read_generation(cursor, name) is not None for name in LOG_READERS)
+            if self.logged and readers:
+                self.log_generation = self.generation
+            else:
+                # A reader may be building concurrently, it must not rely on the log for this generation
+                cursor.execute(
+                    f"INSERT INTO {STATE_TABLE} (name, generation, updated_at) VALUES (%s, %s, NOW()) "
+                    f"ON DUPLICATE KEY UPDATE generation = GREATEST(generation, VALUES(generation)), "
+                    f"updated_at = NOW()",
+                    (UNLOGGED, self.generation)
+                )
+            self.connection.commit()
+        finally:
+            cursor.close()
+        return self.generation
+
+    def log(self, cursor, ids):
+        """Log the IDs of puzzles whose rating or themes the run changes, in the batch's transaction."""
+        if self.log_generation is not None:
+            log_ids(cursor, self.log_generation, ids)
+
+    def log_query(self, cursor, query, params=()):
+        """Same as log() for the IDs selected by `query`, see log_query."""
+        if self.log_generation is not None:
+            log_query(cursor, self.log_generation, query, params)
+
+    def end(self):
+        if self.generation is None:
+            return
+        bump_generation(self.connection)
+        self.generation = None
+        self.log_generation = None
+        print("The puzzle data changed: run build_theme_stats.py and build_sampling_index.py, "
+              "the API counts and samples from the base tables until then")
@@ -0,0 +1,26 @@
+"""
+JSON checkpoint files for resumable runs.
+
+A checkpoint is rewritten after every committed batch and removed once the run
+completes, so its presence means a run stopped early and `--resume` can pick
+up after the last commit.
+"""
+
+import os
+import json
+
+def load_checkpoint(path):
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically so a crash never leaves a truncated file behind."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def remove_checkpoint(path):
+    """Remove the checkpoint of a completed run, a later run must not resume from it."""
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,197 @@
+"""
+Single-pass streaming reader for the Lichess puzzle CSV.
+
+Plain, .gz, .bz2 and .zst files are decompressed on the fly, and progress is
+measured in bytes consumed from the file on disk, so no tool has to read the
+file once just to count its lines.
+
+Chunks are parsed by pandas' C parser, or by pyarrow's multithreaded CSV
+reader with engine='pyarrow' when pyarrow is installed.
+"""
+
+import io
+import os
+import bz2
+import gzip
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    from pyarrow import csv as arrow_csv
+except ImportError:
+    pyarrow = None
+
+ENGINES = ('c', 'pyarrow')
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.zst')
+
+class CountingReader(io.RawIOBase):
+    """Raw binary reader that counts the bytes read from the underlying file.
+
+    When `end` is given, reads stop at that offset, which lets a worker parse
+    one byte range of a plain CSV without copying it.
+    """
+
+    def __init__(self, raw, end=None):
+        self.raw = raw
+        self.end = end
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        if self.end is not None:
+            size = min(size, self.end - self.raw.tell())
+            if size <= 0:
+                return 0
+        data = self.raw.read(size)
+        buffer[:len(data)] = data
+        self.bytes_read += len(data)
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+def is_compressed(file_path):
+    return file_path.endswith(COMPRESSED_EXTENSIONS)
+
+def decompress(counter, file_path):
+    """Wrap a counting reader in the decompressor matching the file extension."""
+    if file_path.endswith('.gz'):
+        return gzip.GzipFile(fileobj=counter)
+    if file_path.endswith('.bz2'):
+        return bz2.BZ2File(counter)
+    if file_path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("Reading .zst files requires the 'zstandard' package (pip install zstandard)")
+        # Lichess dumps are compressed with a long window
+        return zstandard.ZstdDecompressor(max_window_size=2 ** 31).stream_reader(counter)
+    return io.BufferedReader(counter)
+
+class CsvStream:
+    """Iterate over a CSV in DataFrame chunks while tracking bytes consumed.
+
+    Usage:
+        stream = CsvStream(file_path, chunksize=1000)
+        with tqdm(total=stream.total_bytes, unit='B', unit_scale=True) as pbar:
+            for chunk in stream:
+                ...
+                pbar.update(stream.advance())
+
+    `byte_range` restricts reading to [start, end) of an uncompressed file; the
+    header line is then not part of the range and must be passed as `names`.
+    `skip_rows` data rows are skipped after the header, e.g. to resume a run.
+
+    With engine='pyarrow' only the `usecols`, `dtype` and `names` arguments
+    are used, and only empty fields are missing values.
+    """
+
+    def __init__(self, file_path, chunksize, byte_range=None, engine='c', skip_rows=0, **read_csv_kwargs):
+        if byte_range is not None and is_compressed(file_path):
+            raise ValueError("Byte ranges can only be read from an uncompressed CSV")
+        if engine == 'pyarrow' and pyarrow is None:
+            raise RuntimeError("The pyarrow engine requires the 'pyarrow' package (pip install pyarrow)")
+
+        self.file_path = file_path
+        self.chunksize = chunksize
+        self.byte_range = byte_range
+        self.engine = engine
+        self.skip_rows = skip_rows
+        self.read_csv_kwargs = read_csv_kwargs
+
+        if byte_range is None:
+            self.total_bytes = os.path.getsize(file_path)
+        else:
+            self.total_bytes = byte_range[1] - byte_range[0]
+
+        self.counter = None
+        self._reported = 0
+
+    @property
+    def bytes_read(self):
+        return self.counter.bytes_read if self.counter else 0
+
+    def advance(self):
+        """Return the bytes consumed since the previous call."""
+        delta = self.bytes_read - self._reported
+        self._reported = self.bytes_read
+        return delta
+
+    def __iter__(self):
+        raw = open(self.file_path, 'rb')
+        if self.byte_range is not None:
+            start, end = self.byte_range
+            raw.seek(start)
+            self.counter = CountingReader(raw, end=end)
+        else:
+            self.counter = CountingReader(raw)
+
+        kwargs = dict(self.read_csv_kwargs)
+        if self.byte_range is not None:
+            kwargs.setdefault('header', None)
+        if self.skip_rows and self.engine == 'c':
+            # A range would be turned into a set of every skipped row number
+            skip_rows = self.skip_rows
+            if self.byte_range is not None:
+                kwargs['skiprows'] = skip_rows
+            else:
+                kwargs['skiprows'] = lambda i: 0 < i <= skip_rows
+
+        with decompress(self.counter, self.file_path) as stream:
+            if self.engine == 'pyarrow':
+                yield from arrow_chunks(stream, self.chunksize, skip_rows=self.skip_rows, **kwargs)
+            else:
+                for chunk in pd.read_csv(stream, chunksize=self.chunksize, **kwargs):
+                    yield chunk
+
+def arrow_type(dtype):
+    """Arrow type parsing a column into the given pandas dtype."""
+    dtype = pd.api.types.pandas_dtype(dtype)
+    if pd.api.types.is_string_dtype(dtype):
+        return pyarrow.string()
+    return pyarrow.from_numpy_dtype(getattr(dtype, 'numpy_dtype', dtype))
+
+def arrow_pandas_type(arrow_type):
+    """Nullable pandas dtype of an Arrow integer column, so missing values do not turn it into floats."""
+    if pyarrow.types.is_integer(arrow_type):
+        return pd.api.types.pandas_dtype(str(arrow_type).replace('int', 'Int').replace('uInt', 'UInt'))
+    return None
+
+def arrow_chunks(stream, chunksize, usecols=None, dtype=None, names=None, skip_rows=0, **ignored):
+    """Parse a CSV stream with pyarrow into DataFrames of `chunksize` rows.
+
+    pyarrow reads blocks of bytes rather than rows, so its batches are
+    regrouped to keep the chunk sizes the tools commit by.
+    """
+    reader = arrow_csv.open_csv(
+        stream,
+        read_options=arrow_csv.ReadOptions(column_names=names, skip_rows_after_names=skip_rows),
+        convert_options=arrow_csv.ConvertOptions(
+            include_columns=usecols,
+            column_types={column: arrow_type(t) for column, t in (dtype or {}).items()},
+            null_values=[''],
+            strings_can_be_null=True
+        )
+    )
+
+    batches = []
+    rows = 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        while rows >= chunksize:
+            table = pyarrow.Table.from_batches(batches)
+            yield table.slice(0, chunksize).to_pandas(types_mapper=arrow_pandas_type)
+            rest = table.slice(chunksize)
+            batches = rest.to_batches()
+            rows = rest.num_rows
+    if rows:
+        yield pyarrow.Table.from_batches(batches).to_pandas(types_mapper=arrow_pandas_type)
@@ -0,0 +1,173 @@
+"""
+Drop secondary indexes and foreign keys for the duration of a bulk load.
+
+InnoDB maintains every secondary index row by row while a load runs; building
+them once afterwards, in a single ALTER TABLE per table, is much cheaper.
+Primary keys and unique indexes are kept since the loads rely on them to skip
+duplicates.
+
+The definitions are written to a state file before anything is dropped. If
+the load fails they are restored on the way out, and if the process dies
+outright the next run that defers indexes restores them first.
+"""
+
+import os
+import time
+from checkpoint import load_checkpoint, save_checkpoint, remove_checkpoint
+
+DEFAULT_STATE = 'deferred_indexes.json'
+
+def secondary_indexes(cursor, table):
+    """Non-unique, non-primary indexes of `table` as JSON-serializable definitions."""
+    cursor.execute("""
+        SELECT INDEX_NAME, COLUMN_NAME, SUB_PART, COLLATION, INDEX_TYPE
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+          AND INDEX_NAME != 'PRIMARY' AND NON_UNIQUE = 1
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    indexes = {}
+    skipped = set()
+    for name, column, sub_part, collation, index_type in cursor.fetchall():
+        if column is None:
+            # Functional index, left alone
+            skipped.add(name)
+            continue
+        index = indexes.setdefault(name, {'name': name, 'type': index_type, 'columns': []})
+        index['columns'].append([column, sub_part, collation])
+    return [index for name, index in indexes.items() if name not in skipped]
+
+def foreign_keys(cursor, table):
+    """Foreign keys declared on `table` as JSON-serializable definitions."""
+    cursor.execute("""
+        SELECT k.CONSTRAINT_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME,
+               r.UPDATE_RULE, r.DELETE_RULE
+        FROM information_schema.KEY_COLUMN_USAGE k
+        JOIN information_schema.REFERENTIAL_CONSTRAINTS r
+          ON r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA AND r.CONSTRAINT_NAME = k.CONSTRAINT_NAME
+        WHERE k.TABLE_SCHEMA = DATABASE() AND k.TABLE_NAME = %s AND k.REFERENCED_TABLE_NAME IS NOT NULL
+        ORDER BY k.CONSTRAINT_NAME, k.ORDINAL_POSITION
+    """, (table,))
+    keys = {}
+    for name, column, referenced_table, referenced_column, update_rule, delete_rule in cursor.fetchall():
+        key = keys.setdefault(name, {
+            'name': name,
+            'columns': [],
+            'referenced_table': referenced_table,
+            'referenced_columns': [],
+            'update_rule': update_rule,
+            'delete_rule': delete_rule
+        })
+        key['columns'].append(column)
+        key['referenced_columns'].append(referenced_column)
+    return list(keys.values())
+
+def index_clause(index):
+    columns = ', '.join(
+        f"`{column}`" + (f"({sub_part})" if sub_part else '') + (' DESC' if collation == 'D' else '')
+        for column, sub_part, collation in index['columns']
+    )
+    kind = f"{index['type']} INDEX" if index['type'] in ('FULLTEXT', 'SPATIAL') else 'INDEX'
+    return f"ADD {kind} `{index['name']}` ({columns})"
+
+def foreign_key_clause(key):
+    columns = ', '.join(f"`{c}`" for c in key['columns'])
+    referenced_columns = ', '.join(f"`{c}`" for c in key['referenced_columns'])
+    return (f"ADD CONSTRAINT `{key['name']}` FOREIGN KEY ({columns}) "
+            f"REFERENCES `{key['referenced_table']}` ({referenced_columns}) "
+            f"ON DELETE {key['delete_rule']} ON UPDATE {key['update_rule']}")
+
+def restore_indexes(cursor, definitions):
+    """Re-create the recorded indexes and foreign keys that are missing, one ALTER TABLE per table."""
+    # Foreign keys are re-attached without validating existing rows, as they were loaded; the
+    # session may be a fresh one after a reconnect, so its own setting is put back afterwards
+    cursor.execute('SELECT @@SESSION.foreign_key_checks')
+    previous = cursor.fetchone()[0]
+    cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+    try:
+        for table, recorded in definitions.items():
+            existing_indexes = {index['name'] for index in secondary_indexes(cursor, table)}
+            existing_keys = {key['name'] for key in foreign_keys(cursor, table)}
+            clauses = [index_clause(i) for i in recorded['indexes'] if i['name'] not in existing_indexes]
+            clauses += [foreign_key_clause(k) for k in recorded['foreign_keys'] if k['name'] not in existing_keys]
+            if clauses:
+                print(f"Rebuilding {len(clauses)} indexes and foreign keys on {table}...")
+                cursor.execute(f"ALTER TABLE `{table}` {', '.join(clauses)}")
+    finally:
+        cursor.execute('SET FOREIGN_KEY_CHECKS=%s', (int(previous),))
+
+class DeferredIndexes:
+    """Context manager dropping the secondary indexes of `tables` on entry and rebuilding them on exit.
+
+    Usage:
+        with DeferredIndexes(connection, ['puzzle', 'puzzle_theme']) as deferred:
+            load(...)
+
+    The DDL runs on `connection`, which is committed on entry (and rolled back
+    if the load failed) so it holds no metadata lock on the tables.
+    """
+
+    def __init__(self, connection, tables, state_path=DEFAULT_STATE):
+        self.connection = connection
+        self.tables = tables
+        self.state_path = state_path
+        self.drop_time = 0.0
+        self.load_time = 0.0
+        self.build_time = 0.0
+
+    def __enter__(self):
+        self.connection.commit()
+        cursor = self.connection.cursor()
+        try:
+            if os.path.exists(self.state_path):
+                print(f"Restoring indexes left dropped by an interrupted run ({self.state_path})")
+                restore_indexes(cursor, load_checkpoint(self.state_path))
+
+            definitions = {
+                table: {'indexes': secondary_indexes(cursor, table), 'foreign_keys': foreign_keys(cursor, table)}
+                for table in self.tables
+            }
+            save_checkpoint(self.state_path, definitions)
+
+            start = time.time()
+            for table, recorded in definitions.items():
+                # Foreign keys first, an index they use cannot be dropped while they exist
+                if recorded['foreign_keys']:
+                    drops = ', '.join(f"DROP FOREIGN KEY `{key['name']}`" for key in recorded['foreign_keys'])
+                    cursor.execute(f"ALTER TABLE `{table}` {drops}")
+                if recorded['indexes']:
+                    drops = ', '.join(f"DROP INDEX `{index['name']}`" for index in recorded['indexes'])
+                    cursor.execute(f"ALTER TABLE `{table}` {drops}")
+                print(f"Deferred {len(recorded['indexes'])} indexes and {len(recorded['foreign_keys'])} "
+                      f"foreign keys on {table}")
+            self.drop_time = time.time() - start
+        finally:
+            cursor.close()
+
+        self.load_start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.load_time = time.time() - self.load_start
+        if exc_type is not None:
+            print("\nLoad failed, restoring the deferred indexes...")
+
+        # A dropped connection is the usual reason for a failed load
+        if not self.connection.is_connected():
+            self.connection.reconnect(attempts=3, delay=1)
+        elif exc_type is not None:
+            self.connection.rollback()
+
+        cursor = self.connection.cursor()
+        try:
+            start = time.time()
+            restore_indexes(cursor, load_checkpoint(self.state_path))
+            self.build_time = time.time() - start
+        finally:
+            cursor.close()
+
+        remove_checkpoint(self.state_path)
+        print(f"\nIndex drop time: {self.drop_time:.2f} s")
+        print(f"Load time: {self.load_time:.2f} s")
+        print(f"Index build time: {self.build_time:.2f} s")
+        return False
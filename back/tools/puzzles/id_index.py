@@ -0,0 +1,219 @@
+"""
+Compact in-memory index of puzzle IDs.
+
+Puzzle IDs are short base62 strings ([0-9A-Za-z], at most 10 characters), so
+each one packs into a single uint64. The index keeps the packed IDs in a
+sorted NumPy array and answers membership queries with a binary search, which
+costs 8 bytes per puzzle instead of a Python string in a set or dict.
+"""
+
+import os
+import numpy as np
+from checkpoint import load_checkpoint, save_checkpoint, remove_checkpoint
+
+ALPHABET = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(ALPHABET) + 1  # Digit 0 is reserved for padding so leading '0's are kept
+MAX_LENGTH = 10  # 63 ** 10 < 2 ** 63
+
+# byte value -> digit (1..62), 0 for characters outside the alphabet
+_DIGITS = np.zeros(256, dtype=np.uint64)
+_DIGITS[np.frombuffer(ALPHABET, dtype=np.uint8)] = np.arange(1, BASE, dtype=np.uint64)
+
+# digit -> digit of the same character lowercased
+_LOWER_DIGITS = np.arange(BASE, dtype=np.uint64)
+_LOWER_DIGITS[11:37] += 26
+
+INVALID_KEY = 0
+
+DEFAULT_CACHE = 'puzzle_ids.npy'
+
+# Added keys wait in a set until this many are pending, then are merged into
+# the sorted array at once instead of rebuilding it for every batch
+MERGE_THRESHOLD = 1 << 20
+
+def encode_ids(ids):
+    """Pack an iterable of ID strings into a uint64 array.
+
+    IDs that are empty, too long or contain characters outside [0-9A-Za-z]
+    are encoded as INVALID_KEY.
+    """
+    ids = list(ids)
+    try:
+        raw = np.asarray(ids, dtype=f'S{MAX_LENGTH + 1}')
+    except UnicodeEncodeError:
+        # Non-ASCII IDs become '?' and are reported as invalid
+        raw = np.asarray([str(i).encode('ascii', 'replace') for i in ids], dtype=f'S{MAX_LENGTH + 1}')
+    if raw.size == 0:
+        return np.array([], dtype=np.uint64)
+
+    chars = raw.view(np.uint8).reshape(len(raw), MAX_LENGTH + 1)
+    digits = _DIGITS[chars]
+    padding = chars == 0
+    invalid = ((digits == 0) & ~padding).any(axis=1) | ~padding[:, MAX_LENGTH] | padding[:, 0]
+
+    keys = np.zeros(len(raw), dtype=np.uint64)
+    for column in range(MAX_LENGTH):
+        digit = digits[:, column]
+        keys = np.where(padding[:, column], keys, keys * np.uint64(BASE) + digit)
+
+    keys[invalid] = INVALID_KEY
+    return keys
+
+def decode_ids(keys):
+    """Unpack uint64 keys back into ID strings."""
+    ids = []
+    for key in np.asarray(keys, dtype=np.uint64).tolist():
+        chars = []
+        while key:
+            key, digit = divmod(key, BASE)
+            chars.append(ALPHABET[digit - 1])
+        ids.append(bytes(reversed(chars)).decode('ascii'))
+    return ids
+
+def lower_keys(keys):
+    """Return the keys of the lowercased IDs, for case-insensitive comparisons."""
+    remaining = np.array(keys, dtype=np.uint64)
+    result = np.zeros(len(remaining), dtype=np.uint64)
+    scale = np.uint64(1)
+    for _ in range(MAX_LENGTH):
+        result += _LOWER_DIGITS[remaining % np.uint64(BASE)] * scale
+        remaining //= np.uint64(BASE)
+        scale *= np.uint64(BASE)
+    return result
+
+def db_fingerprint(connection):
+    """(row count, XOR of the CRC32 of every ID) of puzzle; it changes whenever an ID is added or removed."""
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*), COALESCE(BIT_XOR(CRC32(id)), 0) FROM puzzle")
+    count, checksum = cursor.fetchone()
+    cursor.close()
+    return [int(count), int(checksum)]
+
+def lookup(sorted_keys, keys):
+    """Return (found, positions) of `keys` in the sorted `sorted_keys`."""
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[positions] == keys, positions
+
+class IdIndex:
+    """Sorted set of packed puzzle IDs with case-sensitive and case-insensitive lookups."""
+
+    def __init__(self, keys=None):
+        keys = np.array([], dtype=np.uint64) if keys is None else np.asarray(keys, dtype=np.uint64)
+        self.keys = np.unique(keys[keys != INVALID_KEY])
+        self._pending = set()
+        self._lower = None
+        self._lower_order = None
+
+    def __len__(self):
+        self.flush()
+        return len(self.keys)
+
+    @classmethod
+    def from_db(cls, connection, fetch_size=100000):
+        """Stream every puzzle ID out of the database into an index."""
+        cursor = connection.cursor(buffered=False)
+        parts = []
+        try:
+            cursor.execute("SELECT id FROM puzzle")
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                parts.append(encode_ids([row[0] for row in rows]))
+        finally:
+            cursor.close()
+        return cls(np.concatenate(parts) if parts else None)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        index.keys = np.load(path)
+        return index
+
+    def save(self, path, fingerprint):
+        """Write the index atomically as a .npy file, with the db_fingerprint it matches next to it."""
+        self.flush()
+        fingerprint_path = f"{path}.json"
+        remove_checkpoint(fingerprint_path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.keys)
+        os.replace(tmp_path, path)
+        save_checkpoint(fingerprint_path, {'fingerprint': fingerprint})
+
+    @classmethod
+    def cached(cls, connection, path):
+        """Load the index from `path` if it matches the puzzle table, else rebuild and save it.
+
+        The cache is checked against the db_fingerprint saved with it, so runs
+        that delete and insert as many IDs (sync_puzzles) invalidate it too.
+        """
+        fingerprint = db_fingerprint(connection)
+        fingerprint_path = f"{path}.json" if path else None
+        if path and os.path.exists(path) and os.path.exists(fingerprint_path):
+            if load_checkpoint(fingerprint_path).get('fingerprint') == fingerprint:
+                return cls.load(path)
+
+        index = cls.from_db(connection)
+        if path:
+            index.save(path, fingerprint)
+        return index
+
+    def add(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        self._pending.update(keys[keys != INVALID_KEY].tolist())
+        if len(self._pending) >= MERGE_THRESHOLD:
+            self.flush()
+
+    def flush(self):
+        """Merge the pending added keys into the sorted array."""
+        if not self._pending:
+            return
+        pending = np.fromiter(self._pending, dtype=np.uint64, count=len(self._pending))
+        self.keys = np.union1d(self.keys, pending)
+        self._pending = set()
+        self._lower = None
+        self._lower_order = None
+
+    def contains(self, keys):
+        """Case-sensitive membership of each key."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        found = lookup(self.keys, keys)[0]
+        if self._pending:
+            found |= np.fromiter((key in self._pending for key in keys.tolist()), dtype=bool, count=len(keys))
+        return found
+
+    def _build_lower(self):
+        self.flush()
+        if self._lower is None:
+            lower = lower_keys(self.keys)
+            self._lower_order = np.argsort(lower, kind='stable').astype(np.uint32)
+            self._lower = lower[self._lower_order]
+
+    def contains_ci(self, keys):
+        """Case-insensitive membership of each key."""
+        self._build_lower()
+        return lookup(self._lower, lower_keys(keys))[0]
+
+    def resolve_ci(self, keys):
+        """Map each key to the stored key with the same ID ignoring case.
+
+        Returns (found, stored_keys); when several case variants exist the
+        smallest stored key wins.
+        """
+        self._build_lower()
+        found, positions = lookup(self._lower, lower_keys(keys))
+        if len(self.keys) == 0:
+            return found, np.zeros(len(found), dtype=np.uint64)
+        return found, self.keys[self._lower_order[positions]]
+
+    def case_variants(self):
+        """Return {lowercase id: [stored ids]} for IDs stored in more than one case."""
+        self._build_lower()
+        values, starts, counts = np.unique(self._lower, return_index=True, return_counts=True)
+        variants = {}
+        for value, start, count in zip(decode_ids(values[counts > 1]), starts[counts > 1], counts[counts > 1]):
+            variants[value] = decode_ids(self.keys[self._lower_order[start:start + count]])
+        return variants
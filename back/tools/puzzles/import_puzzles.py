@@ -1,26 +1,650 @@
-import pandas as pd
+import numpy as np
 import mysql.connector
 from mysql.connector import Error
 import sys
+import os
+import csv
+import shutil
+import queue
+import argparse
+import tempfile
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from change_log import DataChanges, log_ids, log_query
+from csv_stream import CsvStream, is_compressed, ENGINES
+from id_index import IdIndex, encode_ids, decode_ids, db_fingerprint, INVALID_KEY, DEFAULT_CACHE
+from pipeline import Pipeline, DEFAULT_DEPTH
+from checkpoint import load_checkpoint, save_checkpoint, remove_checkpoint
+from deferred_indexes import DeferredIndexes
+from theme_mask import has_mask_column, load_bits, sync_masks, sync_masks_of
+from metrics import StageMetrics
 
-def create_connection():
+# CSV header -> puzzle table column
+COLUMN_MAP = {
+    'PuzzleId': 'id',
+    'FEN': 'fen',
+    'Moves': 'moves',
+    'Rating': 'rating',
+    'RatingDeviation': 'rating_deviation',
+    'Popularity': 'popularity',
+    'NbPlays': 'nb_plays',
+    'Themes': 'themes',
+    'GameUrl': 'game_url',
+    'OpeningTags': 'opening_tags'
+}
+
+# puzzle columns, themes being stored in puzzle_theme
+PUZZLE_COLUMNS = [c for c in COLUMN_MAP.values() if c != 'themes']
+
+# puzzle table column -> CSV header
+CSV_HEADERS = {column: header for header, column in COLUMN_MAP.items()}
+
+# Parsing dtypes of the CSV columns. Integers are parsed wide and nullable: the C
+# parser silently wraps values that overflow a narrower type (70000 -> 4464 in
+# UInt16), so they are only narrowed to COMPACT_DTYPES once validated.
+CSV_DTYPES = {
+    'PuzzleId': 'str',
+    'FEN': 'str',
+    'Moves': 'str',
+    'Rating': 'Int64',
+    'RatingDeviation': 'Int64',
+    'Popularity': 'Int64',
+    'NbPlays': 'Int64',
+    'Themes': 'str',
+    'GameUrl': 'str',
+    'OpeningTags': 'str'
+}
+COMPACT_DTYPES = {
+    'rating': 'UInt16',
+    'rating_deviation': 'UInt16',
+    'popularity': 'Int8',
+    'nb_plays': 'UInt32'
+}
+
+# Columns that must be present for a row to be considered valid
+REQUIRED_COLUMNS = ['fen', 'moves', 'rating', 'rating_deviation', 'popularity', 'nb_plays', 'themes']
+
+# Accepted values, inclusive; they also keep the compact dtypes from overflowing
+VALUE_RANGES = {
+    'rating': (1, 4000),
+    'rating_deviation': (0, 1000),
+    'popularity': (-100, 100),
+    'nb_plays': (0, 2 ** 32 - 1)
+}
+
+# Shape of a FEN and of a list of UCI moves; positions are not checked for legality
+PIECES = '[1-8pnbrqkPNBRQK]{1,8}'
+FEN_PATTERN = rf'(?:{PIECES}/){{7}}{PIECES} [wb] (?:-|[KQkq]{{1,4}}) (?:-|[a-h][36]) \d+ \d+'
+MOVES_PATTERN = r'[a-h][1-8][a-h][1-8][qrbn]?(?: [a-h][1-8][a-h][1-8][qrbn]?)*'
+
+STAGING_TABLE = 'puzzle_staging'
+
+DEFAULT_BATCH_SIZE = {
+    'insert': 1000,
+    'bulk': 50000
+}
+
+DEFAULT_CHECKPOINT = 'import_puzzles.checkpoint.json'
+DEFAULT_QUARANTINE = 'import_puzzles.quarantine.csv'
+
+# Rows between two progress summaries
+REPORT_INTERVAL = 100000
+
+def create_connection(allow_local_infile=False):
     try:
         connection = mysql.connector.connect(
             host='localhost',
             database='eptrainingapp',
             user='root',
-            password=''
+            password='',
+            allow_local_infile=allow_local_infile
         )
         return connection
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
         sys.exit(1)
 
-def import_csv(file_path, batch_size=1000):
+def csv_options(headers=None):
+    """read_csv arguments parsing only the given CSV `headers` (all by default) with their CSV_DTYPES.
+
+    Only empty fields are missing, so IDs such as 'NA' or 'null' stay strings.
+    """
+    headers = list(headers or CSV_DTYPES)
+    return {
+        'usecols': headers,
+        'dtype': {header: CSV_DTYPES[header] for header in headers},
+        'keep_default_na': False,
+        'na_values': ['']
+    }
+
+def validate_chunk(data, keys):
+    """Return the reason each row of a renamed chunk is rejected, '' for valid rows."""
+    missing = data[REQUIRED_COLUMNS].isna()
+    checks = [
+        (keys == INVALID_KEY, 'invalid id'),
+        (missing.any(axis=1).to_numpy(), ('missing ' + missing.idxmax(axis=1)).to_numpy(dtype=object)),
+        (~data['fen'].str.fullmatch(FEN_PATTERN, na=False).to_numpy(dtype=bool), 'malformed fen'),
+        (~data['moves'].str.fullmatch(MOVES_PATTERN, na=False).to_numpy(dtype=bool), 'malformed moves'),
+    ]
+    for column, (low, high) in VALUE_RANGES.items():
+        in_range = (data[column] >= low) & (data[column] <= high)
+        checks.append((~in_range.fillna(False).to_numpy(dtype=bool), f'{column} out of range'))
+
+    # The first failed check of a row names it
+    conditions, reasons = zip(*checks)
+    return np.select(conditions, reasons, default='')
+
+def prepare_chunk(chunk, duplicate_ids, invalid_data):
+    """Rename CSV columns, record duplicate IDs and set invalid rows aside.
+
+    Returns the valid rows with compact dtypes, the packed keys of their IDs,
+    and the rejected rows with a 'reason' column (None when there are none).
+    """
+    data = chunk.rename(columns=COLUMN_MAP)
+
+    # Preserve the exact ID format apart from surrounding whitespace
+    data['id'] = data['id'].str.strip()
+    keys = encode_ids(data['id'].fillna(''))
+
+    # Check for duplicate IDs in current chunk
+    valid_keys = keys[keys != INVALID_KEY]
+    unique_keys, counts = np.unique(valid_keys, return_counts=True)
+    if (counts > 1).any():
+        duplicate_ids.update(unique_keys[counts > 1].tolist())
+
+    # Check for invalid data, including IDs that are not 1-10 base62 characters
+    reasons = validate_chunk(data, keys)
+    invalid = reasons != ''
+    rejected = None
+    if invalid.any():
+        rejected = data[invalid].assign(reason=reasons[invalid])
+        invalid_data.extend(rejected['id'].fillna('').tolist())
+        data = data[~invalid]
+        keys = keys[~invalid]
+
+    return data.astype(COMPACT_DTYPES), keys, rejected
+
+def quarantine_rows(path, rejected):
+    """Append rejected rows to the quarantine CSV, under the Lichess headers and a Reason column."""
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    rejected.rename(columns=dict(CSV_HEADERS, reason='Reason')).to_csv(path, mode='a', header=write_header,
+                                                                       index=False)
+
+def merge_quarantines(path, parts):
+    """Append the quarantine files of the byte ranges to `path`, in file order, and remove them."""
+    for part in parts:
+        if not os.path.exists(part):
+            continue
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(part) as source, open(path, 'a') as target:
+            header = source.readline()
+            if write_header:
+                target.write(header)
+            shutil.copyfileobj(source, target)
+        os.remove(part)
+
+def row_values(data):
+    """Rows of a chunk as tuples of Python values, None for missing ones, built column by column."""
+    columns = []
+    for name in data.columns:
+        column = data[name]
+        if column.hasnans:
+            column = column.astype(object).where(column.notna(), None)
+        columns.append(column.tolist())
+    return list(zip(*columns))
+
+def insert_chunk(cursor, data, keys, index, skipped_ids):
+    """Insert a chunk row by row with INSERT IGNORE. Returns the number of skipped rows.
+
+    `index` holds the IDs already in puzzle. Rows whose ID is in it are
+    expected to be ignored; the database is only queried when a new ID was
+    rejected as well.
+    """
+    columns = ', '.join(data.columns)
+    placeholders = ', '.join(['%s'] * len(data.columns))
+    query = f"INSERT IGNORE INTO puzzle ({columns}) VALUES ({placeholders})"
+
+    values = row_values(data)
+    try:
+        cursor.executemany(query, values)
+        inserted = cursor.rowcount
+        skipped_in_batch = len(values) - inserted
+
+        fresh = ~index.contains(keys)
+        fresh_keys = np.unique(keys[fresh])
+        if inserted == len(fresh_keys) and INVALID_KEY not in fresh_keys:
+            index.add(fresh_keys)
+        else:
+            # Some new IDs were rejected, ask the database which ones made it
+            candidates = data['id'][fresh].tolist()
+            cursor.execute("SELECT id FROM puzzle WHERE id IN (" + ",".join(["%s"] * len(candidates)) + ")", candidates)
+            existing = encode_ids([row[0] for row in cursor.fetchall()])
+            index.add(existing)
+            candidate_keys = keys[fresh]
+            rejected = candidate_keys[~np.isin(candidate_keys, existing) & (candidate_keys != INVALID_KEY)]
+            skipped_ids.update(rejected.tolist())
+
+            if len(skipped_ids) <= 5:  # Only print first 5 skipped IDs
+                print(f"\nSample of skipped IDs: {decode_ids(list(skipped_ids)[:5])}")
+        return skipped_in_batch
+    except Error as e:
+        print(f"\nError inserting batch: {e}")
+        print("First problematic row:", values[0])
+        return 0
+
+def load_theme_map(cursor):
+    cursor.execute("SELECT id, name FROM theme")
+    return {name: theme_id for theme_id, name in cursor.fetchall()}
+
+def theme_relations(cursor, data, theme_map):
+    """Split the themes of a chunk into (puzzle_id, theme_id) pairs.
+
+    Theme names missing from `theme_map` are inserted into theme first and the
+    map is refreshed in place.
+    """
+    pairs = data[['id']].assign(theme=data['themes'].str.split()).explode('theme').dropna(subset=['theme'])
+    if pairs.empty:
+        return []
+
+    # Create themes we have never seen before
+    unknown = sorted(set(pairs['theme']) - theme_map.keys())
+    if unknown:
+        cursor.executemany("INSERT IGNORE INTO theme (name) VALUES (%s)", [(name,) for name in unknown])
+        theme_map.update(load_theme_map(cursor))
+
+    pairs['theme_id'] = pairs['theme'].map(theme_map)
+    pairs = pairs.dropna(subset=['theme_id'])
+    return list(zip(pairs['id'], pairs['theme_id'].astype(int)))
+
+def insert_theme_relations(cursor, data, keys, theme_map, skipped_ids, bits=None):
+    """Insert the puzzle_theme rows of a chunk, leaving out puzzles the insert skipped.
+
+    With `bits` (see theme_mask) the theme masks of the puzzles are updated as well.
+    """
+    if skipped_ids:
+        data = data[~np.isin(keys, np.fromiter(skipped_ids, dtype=np.uint64, count=len(skipped_ids)))]
+
+    relations = theme_relations(cursor, data, theme_map)
+    if relations:
+        cursor.executemany("INSERT IGNORE INTO puzzle_theme (puzzle_id, theme_id) VALUES (%s, %s)", relations)
+        if bits is not None:
+            # Relations are only added here, so existing masks are extended rather than replaced
+            sync_masks(cursor, data['id'], relations, bits, merge=True)
+    return len(relations)
+
+def create_staging_table(cursor):
+    """Create the session-local staging table used by the bulk mode.
+
+    It has no keys so LOAD DATA never rejects a row; duplicates are resolved
+    when merging into puzzle.
+    """
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {STAGING_TABLE}")
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {STAGING_TABLE} (
+            id VARCHAR(10) COLLATE utf8mb4_bin,
+            fen VARCHAR(100),
+            moves VARCHAR(100),
+            rating INT,
+            rating_deviation INT,
+            popularity INT,
+            nb_plays INT,
+            game_url VARCHAR(255),
+            opening_tags VARCHAR(255)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def load_chunk(cursor, data, tmp_path):
+    """Write a chunk to a tab-separated file and LOAD DATA it into the staging table.
+
+    Missing values are written as empty fields and turned back into NULL by
+    the SET clause, since pandas would escape a literal \\N marker.
+    """
+    data.to_csv(
+        tmp_path,
+        sep='\t',
+        header=False,
+        index=False,
+        na_rep='',
+        float_format='%.0f',
+        quoting=csv.QUOTE_NONE,
+        escapechar='\\',
+        lineterminator='\n'
+    )
+    variables = ', '.join(f"@{c}" for c in data.columns)
+    assignments = ', '.join(f"{c} = NULLIF(@{c}, '')" for c in data.columns)
+    cursor.execute(
+        f"LOAD DATA LOCAL INFILE %s INTO TABLE {STAGING_TABLE} "
+        "CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' "
+        f"({variables}) SET {assignments}",
+        (tmp_path,)
+    )
+
+def merge_staging(cursor, columns, skipped_ids):
+    """Merge the staging table into puzzle in one statement. Returns the number of skipped rows."""
+    cursor.execute(f"SELECT COUNT(*) FROM {STAGING_TABLE}")
+    staged_rows = cursor.fetchone()[0]
+
+    column_list = ', '.join(columns)
+    cursor.execute(
+        f"INSERT IGNORE INTO puzzle ({column_list}) "
+        f"SELECT {column_list} FROM {STAGING_TABLE}"
+    )
+    skipped_rows = staged_rows - cursor.rowcount
+
+    # Staged IDs that still have no row in puzzle were rejected by the merge
+    if skipped_rows > 0:
+        cursor.execute(
+            f"SELECT DISTINCT s.id FROM {STAGING_TABLE} s "
+            "LEFT JOIN puzzle p ON p.id = s.id WHERE p.id IS NULL"
+        )
+        skipped_ids.update(encode_ids([row[0] for row in cursor.fetchall()]).tolist())
+
+    return skipped_rows
+
+def new_stats():
+    return {
+        'processed_rows': 0,
+        'skipped_rows': 0,
+        'duplicate_ids': set(),  # Packed IDs, see id_index
+        'invalid_data': [],
+        'skipped_ids': set(),  # Track skipped IDs (packed)
+        'relations': 0
+    }
+
+def merge_stats(total, part):
+    """Fold the statistics of one worker into the combined statistics."""
+    total['processed_rows'] += part['processed_rows']
+    total['skipped_rows'] += part['skipped_rows']
+    total['duplicate_ids'].update(part['duplicate_ids'])
+    total['invalid_data'].extend(part['invalid_data'])
+    total['skipped_ids'].update(part['skipped_ids'])
+    total['relations'] += part['relations']
+
+def run_identity(file_path, mode, byte_range=None):
+    """What a checkpoint must match to be resumed: the same file, mode and byte range."""
+    return {
+        'file': os.path.abspath(file_path),
+        'file_size': os.path.getsize(file_path),
+        'mode': mode,
+        'byte_range': list(byte_range) if byte_range else None
+    }
+
+def save_progress(checkpoint_path, identity, stats, complete=False):
+    """Record the rows committed so far and the running counters."""
+    save_checkpoint(checkpoint_path, dict(
+        identity,
+        complete=complete,
+        processed_rows=stats['processed_rows'],
+        skipped_rows=stats['skipped_rows'],
+        relations=stats['relations'],
+        duplicate_ids=sorted(stats['duplicate_ids']),
+        invalid_data=stats['invalid_data']
+    ))
+
+def resume_progress(checkpoint_path, identity, stats):
+    """Restore the counters of an interrupted run into `stats`.
+
+    Returns the checkpoint, or None when there is nothing to resume. Skipped IDs
+    are only counted, the IDs themselves are reported for the resumed part only.
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    state = load_checkpoint(checkpoint_path)
+    if {key: state.get(key) for key in identity} != identity:
+        raise RuntimeError(f"{checkpoint_path} was written for another file, mode or --workers count, "
+                           "remove it or run without --resume")
+
+    stats['processed_rows'] = state['processed_rows']
+    stats['skipped_rows'] = state['skipped_rows']
+    stats['relations'] = state['relations']
+    stats['duplicate_ids'].update(state['duplicate_ids'])
+    stats['invalid_data'].extend(state['invalid_data'])
+    return state
+
+def disable_checks(cursor):
+    cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+    cursor.execute('SET UNIQUE_CHECKS=0')
+    cursor.execute('SET autocommit=0')
+
+def enable_checks(cursor):
+    cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+    cursor.execute('SET UNIQUE_CHECKS=1')
+    cursor.execute('SET autocommit=1')
+
+def import_chunks(connection, cursor, chunks, mode, stats, progress, metrics, index=None, pipeline_depth=0,
+                  quarantine_path=None, log_generation=None):
+    """Import an iterable of CSV chunks on one connection, committing after every batch.
+
+    `progress` is called after each committed batch. The insert mode needs the
+    IdIndex of the puzzles already in the database. With a
+    `pipeline_depth`, chunks are parsed and validated in a background thread
+    while the previous ones are written. Stage times are recorded in `metrics`.
+    Invalid rows are not written; they are appended to `quarantine_path`
+    once their batch is committed. With a `log_generation`, the IDs of the
+    new puzzles are logged under it (see change_log).
+    """
+    tmp_path = None
+    staged = False
+    theme_map = load_theme_map(cursor)
+    bits = (load_bits(cursor) or None) if has_mask_column(cursor) else None
+
+    if mode == 'bulk':
+        create_staging_table(cursor)
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix='puzzle_staging_', suffix='.tsv')
+        os.close(tmp_fd)
+
+    def prepare(chunk, size):
+        # Rejects are collected per chunk, with a pipeline this runs ahead of the commits
+        duplicate_ids, invalid_data = set(), []
+        with metrics.stage('validate', len(chunk), size):
+            return (len(chunk), size, duplicate_ids, invalid_data) + prepare_chunk(chunk, duplicate_ids, invalid_data)
+
+    prepared = (prepare(chunk, size) for chunk, size in metrics.chunks(chunks))
+    pipeline = None
+    if pipeline_depth:
+        pipeline = prepared = Pipeline(prepared, pipeline_depth)
+
+    try:
+        for rows, size, duplicate_ids, invalid_data, data, keys, rejected in prepared:
+            if not data.empty:
+                with metrics.stage('write', rows, size):
+                    if mode == 'bulk':
+                        load_chunk(cursor, data[PUZZLE_COLUMNS], tmp_path)
+                        staged = True
+                    else:
+                        # Logged before the insert, while the index still tells the new IDs apart
+                        if log_generation is not None:
+                            log_ids(cursor, log_generation, data['id'][~index.contains(keys)])
+                        stats['skipped_rows'] += insert_chunk(cursor, data[PUZZLE_COLUMNS], keys, index,
+                                                              stats['skipped_ids'])
+                # puzzle and puzzle_theme rows of a batch go into the same transaction; staged puzzles
+                # are only in puzzle after the merge, so their masks are computed then
+                with metrics.stage('relations', rows, size):
+                    stats['relations'] += insert_theme_relations(cursor, data, keys, theme_map, stats['skipped_ids'],
+                                                                 bits if mode != 'bulk' else None)
+
+            with metrics.stage('commit', rows, size):
+                connection.commit()
+
+            if rejected is not None and quarantine_path:
+                quarantine_rows(quarantine_path, rejected)
+
+            # Only counted once committed, so a checkpoint never holds the rejects of rows a resume reads again
+            if duplicate_ids:
+                stats['duplicate_ids'].update(duplicate_ids)
+                if len(stats['duplicate_ids']) <= 5:  # Only print first 5 duplicates
+                    print(f"\nFound duplicate IDs: {decode_ids(sorted(duplicate_ids)[:5])}")
+            if invalid_data:
+                stats['invalid_data'].extend(invalid_data)
+                if len(stats['invalid_data']) <= 5:  # Only print first 5 invalid rows
+                    print(f"\nFound invalid data in rows: {invalid_data[:5]}")
+
+            stats['processed_rows'] += rows
+            progress()
+
+        if pipeline is not None:
+            pipeline.report(producer='parse/validate', consumer='write/commit')
+
+        if mode == 'bulk' and staged:
+            print(f"\nMerging {STAGING_TABLE} into puzzle...")
+            with metrics.stage('merge', stats['processed_rows']):
+                if log_generation is not None:
+                    log_query(cursor, log_generation, f"SELECT s.id FROM {STAGING_TABLE} s "
+                                                      "LEFT JOIN puzzle p ON p.id = s.id WHERE p.id IS NULL")
+                stats['skipped_rows'] += merge_staging(cursor, PUZZLE_COLUMNS, stats['skipped_ids'])
+            if bits is not None:
+                with metrics.stage('masks', stats['processed_rows']):
+                    sync_masks_of(cursor, STAGING_TABLE)
+            with metrics.stage('commit'):
+                connection.commit()
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def split_byte_ranges(file_path, workers):
+    """Split the CSV body into `workers` byte ranges aligned on line starts.
+
+    Returns the header columns and a list of (start, end) offsets.
+    """
+    with open(file_path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8')]))
+        body_start = f.tell()
+        file_size = os.fstat(f.fileno()).st_size
+
+        step = max(1, (file_size - body_start) // workers)
+        boundaries = [body_start]
+        for i in range(1, workers):
+            f.seek(body_start + i * step)
+            f.readline()  # Move to the start of the next line
+            boundaries.append(min(f.tell(), file_size))
+        boundaries.append(file_size)
+
+    ranges = [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+    return header, ranges
+
+def import_range(file_path, start, end, header, batch_size, mode, id_cache, progress_queue,
+                 checkpoint_path=None, resume=False, engine='c', quarantine_path=None, log_generation=None):
+    """Worker entry point: import one byte range on its own connection.
+
+    With a `checkpoint_path`, progress is recorded in a checkpoint of its own
+    for this range, which `resume` continues from. Rejected rows go to a
+    `quarantine_path` of the range's own. New puzzles are logged under
+    `log_generation`, see import_chunks. Returns the statistics and the
+    stage metrics of the range.
+    """
+    stats = new_stats()
+    metrics = StageMetrics('import_puzzles')
+    identity = run_identity(file_path, mode, (start, end))
+    skip_rows = 0
+    if resume and checkpoint_path:
+        state = resume_progress(checkpoint_path, identity, stats)
+        if state and state['complete']:
+            progress_queue.put(end - start)
+            return stats, metrics.stages
+        skip_rows = stats['processed_rows']
+
+    connection = create_connection(allow_local_infile=(mode == 'bulk'))
+    cursor = connection.cursor()
+    index = IdIndex.load(id_cache) if mode != 'bulk' else None
+
+    def progress():
+        progress_queue.put(stream.advance())
+        if checkpoint_path:
+            save_progress(checkpoint_path, identity, stats)
+
+    try:
+        disable_checks(cursor)
+        stream = CsvStream(file_path, batch_size, byte_range=(start, end), names=header, skip_rows=skip_rows,
+                           engine=engine, **csv_options(header))
+        import_chunks(connection, cursor, stream, mode, stats, progress, metrics, index,
+                      quarantine_path=quarantine_path, log_generation=log_generation)
+        if checkpoint_path:
+            # Kept until every range is done, so a resume does not redo this one
+            save_progress(checkpoint_path, identity, stats, complete=True)
+    except Error as e:
+        connection.rollback()
+        # mysql.connector errors do not always survive pickling, send the message instead
+        raise RuntimeError(f"Worker for bytes {start}-{end} failed: {e}")
+    finally:
+        enable_checks(cursor)
+        cursor.close()
+        connection.close()
+
+    return stats, metrics.stages
+
+def range_path(path, start):
+    """Per-range file of a byte range starting at `start`, e.g. its checkpoint."""
+    return f"{path}.{start}" if path else None
+
+def import_parallel(file_path, batch_size, mode, workers, id_cache, stats, metrics, pbar, checkpoint_path=None,
+                    resume=False, engine='c', quarantine_path=None, log_generation=None):
+    """Run import_range over byte ranges of the CSV in `workers` processes.
+
+    Each range keeps its own checkpoint, `checkpoint_path` suffixed with the
+    range start; they are removed once every range is done. The quarantine
+    files of the ranges are appended to `quarantine_path` in file order.
+    """
+    header, ranges = split_byte_ranges(file_path, workers)
+    print(f"Splitting CSV into {len(ranges)} byte ranges")
+    pbar.update(ranges[0][0] if ranges else 0)  # Header line
+
+    with multiprocessing.Manager() as manager:
+        progress_queue = manager.Queue()
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(import_range, file_path, start, end, header, batch_size, mode, id_cache, progress_queue,
+                                range_path(checkpoint_path, start), resume, engine,
+                                range_path(quarantine_path, start), log_generation)
+                for start, end in ranges
+            ]
+
+            # Feed the shared progress bar until every worker is done
+            pending = set(futures)
+            while pending:
+                try:
+                    pbar.update(progress_queue.get(timeout=0.5))
+                except queue.Empty:
+                    pass
+                pending = {f for f in pending if not f.done()}
+            while not progress_queue.empty():
+                pbar.update(progress_queue.get())
+
+            for future in futures:
+                part, stages = future.result()
+                merge_stats(stats, part)
+                metrics.merge(stages)
+
+    if quarantine_path:
+        merge_quarantines(quarantine_path, [range_path(quarantine_path, start) for start, _ in ranges])
+
+    if checkpoint_path:
+        for start, _ in ranges:
+            remove_checkpoint(range_path(checkpoint_path, start))
+
+def import_csv(file_path, batch_size=None, mode='insert', workers=1, id_cache=DEFAULT_CACHE, pipeline_depth=0,
+               checkpoint_path=DEFAULT_CHECKPOINT, resume=False, defer_indexes=False, metrics_path=None, engine='c',
+               quarantine_path=DEFAULT_QUARANTINE):
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE[mode]
+
+    # The bulk staging table is temporary, so a bulk run cannot continue after a failure
+    if mode == 'bulk':
+        if resume:
+            print("Error: --resume is not supported in bulk mode, its staging table does not survive a failure")
+            sys.exit(1)
+        checkpoint_path = None
+
     # Create database connection
-    connection = create_connection()
+    connection = create_connection(allow_local_infile=(mode == 'bulk'))
     cursor = connection.cursor()
+    changes = DataChanges(connection)
 
     try:
         # Check initial count
@@ -29,138 +653,156 @@ def import_csv(file_path, batch_size=1000):
         print(f"Initial count in puzzle table: {initial_count}")
 
         # Disable foreign key checks and unique checks
-        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
-        cursor.execute('SET UNIQUE_CHECKS=0')
-        cursor.execute('SET autocommit=0')
-
-        # Read CSV in chunks
-        chunks = pd.read_csv(file_path, chunksize=batch_size)
-        total_rows = sum(1 for _ in open(file_path)) - 1  # Subtract header row
-        print(f"Total rows in CSV: {total_rows}")
-
-        # Process each chunk
-        processed_rows = 0
-        skipped_rows = 0
-        duplicate_ids = set()
-        invalid_data = []
-        skipped_ids = set()  # Track skipped IDs
-        
-        with tqdm(total=total_rows, desc="Importing puzzles") as pbar:
-            for chunk in chunks:
-                # Prepare data for insertion
-                data = chunk.rename(columns={
-                    'PuzzleId': 'id',
-                    'FEN': 'fen',
-                    'Moves': 'moves',
-                    'Rating': 'rating',
-                    'RatingDeviation': 'rating_deviation',
-                    'Popularity': 'popularity',
-                    'NbPlays': 'nb_plays',
-                    'Themes': 'themes',
-                    'GameUrl': 'game_url',
-                    'OpeningTags': 'opening_tags'
-                })
-
-                # Force ID to be string and preserve exact format
-                data['id'] = data['id'].apply(lambda x: str(x).strip())
-
-                # Check for duplicate IDs in current chunk
-                duplicates = data[data.duplicated(subset=['id'], keep=False)]
-                if not duplicates.empty:
-                    duplicate_ids.update(duplicates['id'].tolist())
-                    if len(duplicate_ids) <= 5:  # Only print first 5 duplicates
-                        print(f"\nFound duplicate IDs: {duplicates['id'].head().tolist()}")
-
-                # Check for invalid data
-                invalid_rows = data[
-                    (data['fen'].isna()) |
-                    (data['moves'].isna()) |
-                    (data['rating'].isna()) |
-                    (data['rating_deviation'].isna()) |
-                    (data['popularity'].isna()) |
-                    (data['nb_plays'].isna()) |
-                    (data['themes'].isna())
-                ]
-                if not invalid_rows.empty:
-                    invalid_data.extend(invalid_rows['id'].tolist())
-                    if len(invalid_data) <= 5:  # Only print first 5 invalid rows
-                        print(f"\nFound invalid data in rows: {invalid_rows['id'].head().tolist()}")
-
-                # Prepare SQL query
-                columns = ', '.join(data.columns)
-                placeholders = ', '.join(['%s'] * len(data.columns))
-                query = f"INSERT IGNORE INTO puzzle ({columns}) VALUES ({placeholders})"
-
-                # Insert data
-                values = [tuple(x) for x in data.values]
-                try:
-                    cursor.executemany(query, values)
-                    affected_rows = cursor.rowcount
-                    skipped_in_batch = len(values) - affected_rows
-                    skipped_rows += skipped_in_batch
-                    
-                    # Track skipped IDs
-                    if skipped_in_batch > 0:
-                        # Get IDs that were skipped
-                        cursor.execute("SELECT id FROM puzzle WHERE id IN (" + ",".join(["%s"] * len(values)) + ")", [v[0] for v in values])
-                        existing_ids = {row[0] for row in cursor.fetchall()}
-                        skipped_ids.update(v[0] for v in values if v[0] not in existing_ids)
-                        
-                        if len(skipped_ids) <= 5:  # Only print first 5 skipped IDs
-                            print(f"\nSample of skipped IDs: {list(skipped_ids)[:5]}")
-                except Error as e:
-                    print(f"\nError inserting batch: {e}")
-                    print("First problematic row:", values[0])
+        disable_checks(cursor)
 
-                connection.commit()
+        if workers > 1 and is_compressed(file_path):
+            print("Error: --workers needs an uncompressed CSV to split it into byte ranges")
+            sys.exit(1)
+
+        if workers > 1 and pipeline_depth:
+            print("Error: --pipeline runs in a single process, it cannot be combined with --workers")
+            sys.exit(1)
 
-                # Update progress
-                processed_rows += len(chunk)
-                pbar.update(len(chunk))
+        stats = new_stats()
+        metrics = StageMetrics('import_puzzles', mode=mode, workers=workers)
 
-                # Print progress every 100k rows
-                if processed_rows % 100000 == 0:
-                    print(f"\nProcessed: {processed_rows}, Skipped: {skipped_rows}")
-                    print(f"Unique duplicate IDs found: {len(duplicate_ids)}")
-                    print(f"Invalid data rows found: {len(invalid_data)}")
-                    print(f"Unique skipped IDs: {len(skipped_ids)}")
+        # Skip the rows committed by the interrupted run
+        identity = run_identity(file_path, mode)
+        skip_rows = 0
+        if resume and workers == 1 and resume_progress(checkpoint_path, identity, stats):
+            skip_rows = stats['processed_rows']
+            print(f"Resuming after {skip_rows:,} rows recorded in {checkpoint_path}")
+
+        # Read CSV in chunks, a single pass with progress measured in bytes
+        stream = CsvStream(file_path, batch_size, engine=engine, skip_rows=skip_rows, **csv_options())
+        print(f"CSV size: {stream.total_bytes / 1024 ** 2:.1f} MB")
+
+        # IDs already in puzzle, used by the insert mode instead of per-batch lookups
+        index = None
+        if mode != 'bulk':
+            index = IdIndex.cached(connection, id_cache)
+            print(f"Loaded {len(index):,} puzzle IDs into the ID index")
+
+        # Secondary indexes of the tables written to are rebuilt once the load is done
+        deferred = nullcontext()
+        if defer_indexes:
+            deferred = DeferredIndexes(connection, ['puzzle', 'puzzle_theme'])
+
+        changes.begin()
+        with deferred, tqdm(total=stream.total_bytes, desc="Importing puzzles", unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+            if workers > 1:
+                import_parallel(file_path, batch_size, mode, workers, id_cache, stats, metrics, pbar, checkpoint_path,
+                                resume, engine, quarantine_path, changes.log_generation)
+            else:
+                reported_rows = stats['processed_rows']
+
+                def progress():
+                    nonlocal reported_rows
+                    # With a pipeline this counts bytes parsed, which can run a few chunks ahead of the writes
+                    pbar.update(stream.advance())
+                    if checkpoint_path:
+                        save_progress(checkpoint_path, identity, stats)
+
+                    # Print progress each time another REPORT_INTERVAL rows are done, whatever the batch size
+                    if stats['processed_rows'] // REPORT_INTERVAL > reported_rows // REPORT_INTERVAL:
+                        reported_rows = stats['processed_rows']
+                        print(f"\nProcessed: {stats['processed_rows']}, Skipped: {stats['skipped_rows']}")
+                        print(f"Unique duplicate IDs found: {len(stats['duplicate_ids'])}")
+                        print(f"Invalid data rows found: {len(stats['invalid_data'])}")
+                        print(f"Unique skipped IDs: {len(stats['skipped_ids'])}")
+
+                import_chunks(connection, cursor, stream, mode, stats, progress, metrics, index, pipeline_depth,
+                              quarantine_path, changes.log_generation)
+                if checkpoint_path:
+                    remove_checkpoint(checkpoint_path)
+
+        if index is not None and workers == 1:
+            index.save(id_cache, db_fingerprint(connection))
+
+        duplicate_ids = decode_ids(sorted(stats['duplicate_ids']))
+        invalid_data = stats['invalid_data']
+        skipped_ids = decode_ids(sorted(stats['skipped_ids']))
 
         # Check final count
         cursor.execute("SELECT COUNT(*) FROM puzzle")
         final_count = cursor.fetchone()[0]
         print(f"\nFinal count in puzzle table: {final_count}")
         print(f"Rows added: {final_count - initial_count}")
-        print(f"Rows processed from CSV: {processed_rows}")
-        print(f"Rows skipped: {skipped_rows}")
+        print(f"Rows processed from CSV: {stats['processed_rows']}")
+        print(f"Rows skipped: {stats['skipped_rows']}")
         print(f"Total unique duplicate IDs: {len(duplicate_ids)}")
         print(f"Total invalid data rows: {len(invalid_data)}")
         print(f"Total unique skipped IDs: {len(skipped_ids)}")
+        print(f"Puzzle-theme relations written: {stats['relations']}")
         if duplicate_ids:
-            print("Sample of duplicate IDs:", list(duplicate_ids)[:5])
+            print("Sample of duplicate IDs:", duplicate_ids[:5])
         if invalid_data:
             print("Sample of invalid data IDs:", invalid_data[:5])
+            if quarantine_path:
+                print(f"Invalid rows quarantined to {quarantine_path}")
         if skipped_ids:
-            print("Sample of skipped IDs:", list(skipped_ids)[:5])
+            print("Sample of skipped IDs:", skipped_ids[:5])
 
-    except Error as e:
+        metrics.report()
+        if metrics_path:
+            metrics.write(metrics_path)
+
+    except (Error, RuntimeError) as e:
         print(f"Error during import: {e}")
         connection.rollback()
         sys.exit(1)
 
     finally:
+        changes.end()
+
         # Re-enable checks
-        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
-        cursor.execute('SET UNIQUE_CHECKS=1')
-        cursor.execute('SET autocommit=1')
-        
+        enable_checks(cursor)
+
         # Close connections
         cursor.close()
         connection.close()
 
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Import the Lichess puzzle CSV into the puzzle table')
+    parser.add_argument('file_path', help='Path to the Lichess puzzle CSV (.csv, .csv.gz, .csv.bz2 or .csv.zst)')
+    parser.add_argument('--mode', choices=['insert', 'bulk'], default='insert',
+                        help='insert: batched INSERT IGNORE (default); '
+                             'bulk: LOAD DATA LOCAL INFILE into a staging table, then one merge. '
+                             'Both write puzzle_theme, and new themes, in the same batches')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Rows per chunk (default: 1000 for insert, 50000 for bulk)')
+    parser.add_argument('--id-cache', default=DEFAULT_CACHE,
+                        help=f'File caching the puzzle ID index between runs (default: {DEFAULT_CACHE})')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes, each importing a byte range of the CSV '
+                             'on its own connection (default: 1)')
+    parser.add_argument('--pipeline', type=int, nargs='?', const=DEFAULT_DEPTH, default=0, metavar='DEPTH',
+                        help='Parse chunks in a background thread while the previous ones are written, '
+                             f'with at most DEPTH parsed chunks waiting (default depth: {DEFAULT_DEPTH})')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help=f'Checkpoint file written after every committed batch (default: {DEFAULT_CHECKPOINT}); '
+                             'with --workers each byte range gets its own, suffixed with the range start')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the rows committed by an interrupted run, as recorded in the checkpoint '
+                             '(same file, mode and --workers; not available in bulk mode)')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='Drop the secondary indexes and foreign keys of the tables being loaded '
+                             'and rebuild them in one ALTER TABLE at the end')
+    parser.add_argument('--metrics', default=None, metavar='PATH',
+                        help='Write the time, rows/s and MB/s of every stage: a Prometheus textfile '
+                             'for a .prom path, JSON lines appended to any other path')
+    parser.add_argument('--engine', choices=ENGINES, default='c',
+                        help='CSV parser: c, the pandas parser (default), or pyarrow, '
+                             'multithreaded (needs pyarrow installed)')
+    parser.add_argument('--quarantine', default=DEFAULT_QUARANTINE, metavar='PATH',
+                        help='CSV the rejected rows are appended to, with the reason they were rejected '
+                             f'(default: {DEFAULT_QUARANTINE})')
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python import_puzzles.py <path_to_csv>")
-        sys.exit(1)
-    
-    file_path = sys.argv[1]
-    import_csv(file_path) 
\ No newline at end of file
+    args = parse_args()
+    import_csv(args.file_path, batch_size=args.batch_size, mode=args.mode, workers=args.workers,
+               id_cache=args.id_cache, pipeline_depth=args.pipeline, checkpoint_path=args.checkpoint,
+               resume=args.resume, defer_indexes=args.defer_indexes, metrics_path=args.metrics,
+               engine=args.engine, quarantine_path=args.quarantine)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+Per-stage timings of the puzzle tools, in a machine-readable form.
+
+A tool records how long each stage of its run takes (CSV parsing,
+validation, database writes, commits...) together with the rows and CSV
+bytes that went through it, then writes one summary per run:
+- to a .prom file: a Prometheus textfile, meant for the node exporter's
+  textfile collector, rewritten on every run (use one file per tool)
+- to any other path: JSON lines, one line per stage, appended so nightly
+  runs accumulate in the same file
+
+Rates are per second spent in the stage itself, which is what tells a stage
+that regressed apart from one that was merely waiting. With several workers
+the stage times add up over the workers; the 'run' entry gives the wall-clock
+time and the end-to-end rates.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PROMETHEUS_PREFIX = 'puzzle_tool'
+
+class StageMetrics:
+    """Accumulate time, calls, rows and bytes per stage name.
+
+    Usage:
+        metrics = StageMetrics('import_puzzles', mode='insert')
+        for chunk, size in metrics.chunks(stream):
+            with metrics.stage('write', rows=len(chunk), size=size):
+                ...
+        metrics.write(path)
+
+    Stages may be recorded from several threads, e.g. by a Pipeline producer.
+    """
+
+    def __init__(self, tool, **labels):
+        self.tool = tool
+        self.labels = labels
+        self.stages = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, rows=0, size=0):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'bytes': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['rows'] += rows
+            stage['bytes'] += size
+
+    @contextmanager
+    def stage(self, name, rows=0, size=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, rows, size)
+
+    def chunks(self, stream, name='parse'):
+        """Yield (chunk, CSV bytes it was parsed from) from a chunk iterator, timing the parsing.
+
+        Bytes are taken from the `bytes_read` of a CsvStream, 0 for other iterables.
+        """
+        iterator = iter(stream)
+        while True:
+            before = getattr(stream, 'bytes_read', 0)
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            size = getattr(stream, 'bytes_read', 0) - before
+            self.add(name, time.perf_counter() - start, len(chunk), size)
+            yield chunk, size
+
+    def merge(self, stages):
+        """Fold in the `stages` of another StageMetrics, e.g. returned by a worker process."""
+        with self._lock:
+            for name, part in stages.items():
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'bytes': 0})
+                for key in stage:
+                    stage[key] += part[key]
+
+    def summary(self):
+        """One dict per stage, then a 'run' entry for the whole run."""
+        elapsed = time.time() - self.started
+        entries = [dict(stage=name, **stage) for name, stage in self.stages.items()]
+        # The run went through as many rows and bytes as were parsed from the CSV
+        parsed = self.stages.get('parse', {})
+        entries.append({'stage': 'run', 'seconds': elapsed, 'calls': 1,
+                        'rows': parsed.get('rows', 0), 'bytes': parsed.get('bytes', 0)})
+
+        for entry in entries:
+            seconds = entry['seconds']
+            entry['rows_per_second'] = entry['rows'] / seconds if seconds else 0.0
+            entry['mb_per_second'] = entry['bytes'] / 1024 ** 2 / seconds if seconds else 0.0
+        return entries
+
+    def report(self):
+        """Print the stage table."""
+        print(f"\nStages ({self.tool}):")
+        for entry in self.summary():
+            print(f"  {entry['stage']:<12} {entry['seconds']:9.2f}s  {entry['calls']:>7} calls  "
+                  f"{entry['rows_per_second']:>11,.0f} rows/s  {entry['mb_per_second']:8.1f} MB/s")
+
+    def write(self, path):
+        """Append the summary as JSON lines, or write it as a Prometheus textfile for a .prom path."""
+        if path.endswith('.prom'):
+            self._write_prometheus(path)
+        else:
+            self._write_json_lines(path)
+        print(f"Metrics written to {path}")
+
+    def _write_json_lines(self, path):
+        timestamp = datetime.fromtimestamp(self.started, timezone.utc).isoformat()
+        with open(path, 'a') as f:
+            for entry in self.summary():
+                f.write(json.dumps(dict(tool=self.tool, started=timestamp, **self.labels, **entry)) + '\n')
+
+    def _write_prometheus(self, path):
+        entries = self.summary()
+        lines = []
+        for metric, key, description in (
+            ('stage_seconds', 'seconds', 'Seconds spent in the stage during the last run'),
+            ('stage_calls', 'calls', 'Times the stage ran during the last run'),
+            ('stage_rows', 'rows', 'Rows that went through the stage during the last run'),
+            ('stage_bytes', 'bytes', 'CSV bytes that went through the stage during the last run'),
+            ('stage_rows_per_second', 'rows_per_second', 'Rows per second spent in the stage'),
+            ('stage_megabytes_per_second', 'mb_per_second', 'CSV megabytes per second spent in the stage'),
+        ):
+            name = f"{PROMETHEUS_PREFIX}_{metric}"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            for entry in entries:
+                lines.append(f"{name}{{{self._labels(stage=entry['stage'])}}} {entry[key]}")
+
+        name = f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds"
+        lines += [f"# HELP {name} Start time of the last run", f"# TYPE {name} gauge",
+                  f"{name}{{{self._labels()}}} {self.started:.0f}"]
+
+        # The collector may read the file at any time, so it is replaced in one step
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def _labels(self, **extra):
+        labels = dict(tool=self.tool, **self.labels, **extra)
+        return ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
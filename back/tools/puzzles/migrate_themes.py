@@ -2,9 +2,46 @@ import pandas as pd
 import mysql.connector
 from mysql.connector import Error
 import sys
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from tqdm import tqdm
+from change_log import DataChanges
+from checkpoint import load_checkpoint, save_checkpoint, remove_checkpoint
+from deferred_indexes import DeferredIndexes
+from theme_mask import has_mask_column, load_bits, sync_masks
 import time
 
+DEFAULT_CHECKPOINT = 'migrate_themes.checkpoint.json'
+
+POOL_SIZE = 10
+
+# Expands the space-separated themes of each puzzle into one row per theme,
+# e.g. 'fork short' -> '["fork","short"]' -> two JSON_TABLE rows (MySQL 8)
+THEME_SPLIT_FROM = """
+    FROM puzzle p,
+    JSON_TABLE(
+        CONCAT('["', REPLACE(TRIM(p.themes), ' ', '","'), '"]'),
+        '$[*]' COLUMNS (name VARCHAR(50) PATH '$')
+    ) AS jt
+"""
+THEME_SPLIT_WHERE = "WHERE p.themes IS NOT NULL AND p.themes != '' AND jt.name != ''"
+
+# Recomputes the theme masks of the puzzles of an ID range from their relations
+MASK_UPDATE = """
+    UPDATE puzzle p
+    JOIN (
+        SELECT pt.puzzle_id, BIT_OR(1 << t.bit_position) AS theme_mask
+        FROM puzzle_theme pt
+        JOIN theme t ON t.id = pt.theme_id
+        WHERE t.bit_position IS NOT NULL {range_filter}
+        GROUP BY pt.puzzle_id
+    ) m ON m.puzzle_id = p.id
+    SET p.theme_mask = m.theme_mask
+    WHERE p.theme_mask != m.theme_mask
+"""
+
 def create_connection():
     try:
         connection = mysql.connector.connect(
@@ -13,7 +50,7 @@ def create_connection():
             user='root',
             password='',
             buffered=True,
-            pool_size=10,
+            pool_size=POOL_SIZE,
             pool_name="mypool",
             pool_reset_session=True
         )
@@ -22,134 +59,311 @@ def create_connection():
         print(f"Error connecting to MySQL: {e}")
         sys.exit(1)
 
-def migrate_themes():
+def create_themes_python(connection, cursor):
+    """Step 1, python strategy: split the distinct themes strings client-side."""
+    # Use a separate cursor for this large query
+    theme_cursor = connection.cursor()
+    theme_cursor.execute("SELECT DISTINCT themes FROM puzzle WHERE themes IS NOT NULL AND themes != ''")
+
+    # Extract unique themes
+    all_themes = set()
+    for (themes,) in theme_cursor:
+        if themes:
+            theme_list = [t.strip() for t in themes.split() if t.strip()]
+            all_themes.update(theme_list)
+
+    theme_cursor.close()
+
+    # Create theme entries
+    print(f"Found {len(all_themes)} unique themes")
+
+    theme_batch_size = 1000
+    theme_batches = [list(all_themes)[i:i + theme_batch_size] for i in range(0, len(all_themes), theme_batch_size)]
+
+    for batch in tqdm(theme_batches, desc="Creating theme entries"):
+        # Prepare values for batch insert
+        values_list = [(name,) for name in batch]
+
+        # Insert themes in batch
+        cursor.executemany("INSERT IGNORE INTO theme (name) VALUES (%s)", values_list)
+        connection.commit()
+
+def create_themes_sql(connection, cursor):
+    """Step 1, sql strategy: split and insert the theme names inside the server."""
+    cursor.execute(f"INSERT IGNORE INTO theme (name) SELECT DISTINCT jt.name {THEME_SPLIT_FROM} {THEME_SPLIT_WHERE}")
+    print(f"Inserted {cursor.rowcount} new themes")
+    connection.commit()
+
+def link_themes_python(connection, cursor, theme_map, batch_size, checkpoint_path, state=None, bits=None):
+    """Step 2, python strategy: build the relations client-side, batch by batch.
+
+    `state` is the checkpoint of an interrupted run to resume. With `bits`
+    (see theme_mask) the masks of the puzzles are updated in the same
+    transaction. Returns the number of relationships sent to the server.
+    """
+    # Disable keys for faster inserts
+    cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+    cursor.execute('SET UNIQUE_CHECKS=0')
+    cursor.execute('SET autocommit=0')
+
+    # Process puzzles in batches to avoid memory issues, walking the primary key
+    # (keyset pagination) so every batch reads only its own rows
+    last_id = ''
+    total_processed = 0
+    total_relationships = 0
+
+    if state:
+        last_id = state['last_id']
+        total_processed = state['total_processed']
+        total_relationships = state['total_relationships']
+        print(f"Resuming after puzzle {last_id} ({total_processed:,} puzzles already processed)")
+
+    # Get total count for progress bar
+    cursor.execute("SELECT COUNT(*) FROM puzzle WHERE themes IS NOT NULL AND themes != ''")
+    total_puzzles = cursor.fetchone()[0]
+
+    batch_rates = []
+
+    with tqdm(total=total_puzzles, initial=total_processed, desc="Processing puzzles") as pbar:
+        while True:
+            batch_start = time.time()
+
+            # Get batch of puzzles
+            cursor.execute(
+                "SELECT id, themes FROM puzzle WHERE themes IS NOT NULL AND themes != '' "
+                "AND id > %s ORDER BY id LIMIT %s",
+                (last_id, batch_size)
+            )
+            puzzles = cursor.fetchall()
+            scan_time = time.time() - batch_start
+
+            if not puzzles:
+                break  # No more puzzles to process
+
+            # Process batch
+            relations_batch = []
+            for puzzle_id, themes in puzzles:
+                if themes:
+                    theme_list = [t.strip() for t in themes.split() if t.strip()]
+                    for theme_name in theme_list:
+                        if theme_name in theme_map:
+                            relations_batch.append((puzzle_id, theme_map[theme_name]))
+
+            # Insert relations in sub-batches to avoid too large queries
+            relation_batch_size = 5000
+            for i in range(0, len(relations_batch), relation_batch_size):
+                sub_batch = relations_batch[i:i + relation_batch_size]
+                cursor.executemany(
+                    "INSERT IGNORE INTO puzzle_theme (puzzle_id, theme_id) VALUES (%s, %s)",
+                    sub_batch
+                )
+                total_relationships += len(sub_batch)
+
+            if bits is not None:
+                sync_masks(cursor, [puzzle_id for puzzle_id, _ in puzzles], relations_batch, bits, merge=True)
+
+            connection.commit()
+
+            # Move to next batch and record where a restart should continue
+            processed = len(puzzles)
+            total_processed += processed
+            last_id = puzzles[-1][0]
+            save_checkpoint(checkpoint_path, {
+                'strategy': 'python',
+                'last_id': last_id,
+                'total_processed': total_processed,
+                'total_relationships': total_relationships
+            })
+
+            # Update progress with the rate of this batch, which should stay flat
+            batch_time = time.time() - batch_start
+            batch_rates.append(processed / batch_time if batch_time > 0 else 0)
+            pbar.update(processed)
+            pbar.set_postfix(scan_ms=f"{scan_time * 1000:.0f}", rows_per_s=f"{batch_rates[-1]:,.0f}")
+
+    if batch_rates:
+        window = max(1, len(batch_rates) // 10)
+        first = sum(batch_rates[:window]) / window
+        last = sum(batch_rates[-window:]) / window
+        print(f"\nBatch rate: first {window} batches {first:,.0f} puzzles/sec, "
+              f"last {window} batches {last:,.0f} puzzles/sec")
+
+    remove_checkpoint(checkpoint_path)
+
+    # Re-enable keys
+    cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+    cursor.execute('SET UNIQUE_CHECKS=1')
+    cursor.execute('SET autocommit=1')
+
+    return total_relationships
+
+def id_ranges(cursor, range_size):
+    """Split the puzzle primary key into (start, end] ranges of about `range_size` rows.
+
+    The last range has no upper bound (end is None).
+    """
+    boundaries = ['']
+    while True:
+        cursor.execute(
+            "SELECT id FROM puzzle WHERE id > %s ORDER BY id LIMIT 1 OFFSET %s",
+            (boundaries[-1], range_size - 1)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            break
+        boundaries.append(row[0])
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:] + [None])]
+
+def link_range_sql(start, end, masks=False):
+    """Insert the relations of one ID range in a single statement on its own connection.
+
+    With `masks`, the theme masks of the range are recomputed in the same transaction.
+    """
+    connection = create_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+        cursor.execute('SET UNIQUE_CHECKS=0')
+
+        range_filter = "AND p.id > %s" + (" AND p.id <= %s" if end is not None else "")
+        params = (start, end) if end is not None else (start,)
+
+        range_start = time.time()
+        cursor.execute(
+            "INSERT IGNORE INTO puzzle_theme (puzzle_id, theme_id) "
+            f"SELECT p.id, t.id {THEME_SPLIT_FROM} JOIN theme t ON t.name = jt.name "
+            f"{THEME_SPLIT_WHERE} {range_filter}",
+            params
+        )
+        inserted = cursor.rowcount
+        if masks:
+            cursor.execute(MASK_UPDATE.format(range_filter=range_filter.replace('p.id', 'pt.puzzle_id')), params)
+        connection.commit()
+        return inserted, time.time() - range_start
+    finally:
+        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+        cursor.execute('SET UNIQUE_CHECKS=1')
+        cursor.close()
+        connection.close()
+
+def link_themes_sql(cursor, range_size, jobs, checkpoint_path, state=None, masks=False):
+    """Step 2, sql strategy: run one INSERT ... SELECT JSON_TABLE per ID range, `jobs` at a time.
+
+    `state` is the checkpoint of an interrupted run to resume; its ranges are
+    reused and the completed ones skipped. With `masks` the theme masks of
+    every range are recomputed too. Returns the number of relationships
+    inserted.
+    """
+    if state:
+        ranges = [tuple(r) for r in state['ranges']]
+        done = set(state['done'])
+        total_relationships = state['total_relationships']
+        print(f"Resuming with {len(done)} of {len(ranges)} ID ranges already done")
+    else:
+        ranges = id_ranges(cursor, range_size)
+        done = set()
+        total_relationships = 0
+        print(f"Split puzzle IDs into {len(ranges)} ranges of about {range_size:,} rows")
+
+    range_times = []
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(link_range_sql, start, end, masks): i
+            for i, (start, end) in enumerate(ranges) if i not in done
+        }
+        with tqdm(total=len(ranges), initial=len(done), desc="Processing ID ranges") as pbar:
+            for future in as_completed(futures):
+                inserted, range_time = future.result()
+                total_relationships += inserted
+                range_times.append(range_time)
+
+                # Ranges finish out of order, so record each committed one
+                done.add(futures[future])
+                save_checkpoint(checkpoint_path, {
+                    'strategy': 'sql',
+                    'ranges': ranges,
+                    'done': sorted(done),
+                    'total_relationships': total_relationships
+                })
+
+                pbar.update(1)
+                pbar.set_postfix(range_s=f"{range_time:.2f}")
+
+    if range_times:
+        print(f"\nRange time: min {min(range_times):.2f}s, "
+              f"avg {sum(range_times) / len(range_times):.2f}s, max {max(range_times):.2f}s")
+
+    remove_checkpoint(checkpoint_path)
+
+    return total_relationships
+
+def migrate_themes(batch_size=10000, checkpoint_path=DEFAULT_CHECKPOINT, resume=False, strategy='python', jobs=4,
+                   defer_indexes=False):
     start_time = time.time()
+    timings = {}
     # Create database connection
     connection = create_connection()
     cursor = connection.cursor()
+    # Every relation is rewritten, far too many to log one by one
+    changes = DataChanges(connection, logged=False)
 
     try:
         # Verify tables exist
         cursor.execute("SHOW TABLES LIKE 'theme'")
         theme_exists = cursor.fetchone() is not None
-        
+
         cursor.execute("SHOW TABLES LIKE 'puzzle_theme'")
         puzzle_theme_exists = cursor.fetchone() is not None
-        
+
         if not theme_exists or not puzzle_theme_exists:
             print("Error: theme or puzzle_theme table does not exist")
             return
-        
-        print("Tables verified. Starting migration...")
+
+        print(f"Tables verified. Starting migration with the {strategy} strategy...")
+
+        state = None
+        if resume and os.path.exists(checkpoint_path):
+            state = load_checkpoint(checkpoint_path)
+            if state.get('strategy', 'python') != strategy:
+                print(f"Error: {checkpoint_path} was written by the {state.get('strategy', 'python')} strategy, "
+                      f"resume with --strategy {state.get('strategy', 'python')}")
+                return
+
+        changes.begin()
 
         # Step 1: Get all unique themes
         print("\nStep 1: Collecting unique themes")
-        # Use a separate cursor for this large query
-        theme_cursor = connection.cursor()
-        theme_cursor.execute("SELECT DISTINCT themes FROM puzzle WHERE themes IS NOT NULL AND themes != ''")
-        
-        # Extract unique themes
-        all_themes = set()
-        for (themes,) in theme_cursor:
-            if themes:
-                theme_list = [t.strip() for t in themes.split() if t.strip()]
-                all_themes.update(theme_list)
-        
-        theme_cursor.close()
-        
-        # Create theme entries
-        theme_map = {}
-        print(f"Found {len(all_themes)} unique themes")
-        
-        theme_batch_size = 1000
-        theme_batches = [list(all_themes)[i:i + theme_batch_size] for i in range(0, len(all_themes), theme_batch_size)]
-        
-        for batch in tqdm(theme_batches, desc="Creating theme entries"):
-            # Prepare values for batch insert
-            values_list = [(name,) for name in batch]
-            
-            # Insert themes in batch
-            cursor.executemany("INSERT IGNORE INTO theme (name) VALUES (%s)", values_list)
-            connection.commit()
-        
+        step_start = time.time()
+        if strategy == 'sql':
+            create_themes_sql(connection, cursor)
+        else:
+            create_themes_python(connection, cursor)
+
         # Get all themes and their IDs in one query
+        theme_map = {}
         cursor.execute("SELECT id, name FROM theme")
         for theme_id, theme_name in cursor.fetchall():
             theme_map[theme_name] = theme_id
-            
+
         print(f"Loaded {len(theme_map)} themes from database")
 
+        # Masks only need syncing once theme_mask.py has given the themes their bits
+        bits = (load_bits(cursor) or None) if has_mask_column(cursor) else None
+        timings['themes'] = time.time() - step_start
+
         # Step 2: Create puzzle-theme relationships in batches
         print("\nStep 2: Creating puzzle-theme relationships")
-        
-        # Disable keys for faster inserts
-        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
-        cursor.execute('SET UNIQUE_CHECKS=0')
-        cursor.execute('SET autocommit=0')
-        
-        # Process puzzles in batches to avoid memory issues
-        batch_size = 10000
-        offset = 0
-        total_processed = 0
-        total_relationships = 0
-        
-        # Get total count for progress bar
-        cursor.execute("SELECT COUNT(*) FROM puzzle WHERE themes IS NOT NULL AND themes != ''")
-        total_puzzles = cursor.fetchone()[0]
-        
-        with tqdm(total=total_puzzles, desc="Processing puzzles") as pbar:
-            while True:
-                # Get batch of puzzles
-                cursor.execute(
-                    "SELECT id, themes FROM puzzle WHERE themes IS NOT NULL AND themes != '' LIMIT %s OFFSET %s", 
-                    (batch_size, offset)
-                )
-                puzzles = cursor.fetchall()
-                
-                if not puzzles:
-                    break  # No more puzzles to process
-                
-                # Process batch
-                relations_batch = []
-                for puzzle_id, themes in puzzles:
-                    if themes:
-                        theme_list = [t.strip() for t in themes.split() if t.strip()]
-                        for theme_name in theme_list:
-                            if theme_name in theme_map:
-                                relations_batch.append((puzzle_id, theme_map[theme_name]))
-                
-                # Insert relations in sub-batches to avoid too large queries
-                relation_batch_size = 5000
-                for i in range(0, len(relations_batch), relation_batch_size):
-                    sub_batch = relations_batch[i:i + relation_batch_size]
-                    cursor.executemany(
-                        "INSERT IGNORE INTO puzzle_theme (puzzle_id, theme_id) VALUES (%s, %s)",
-                        sub_batch
-                    )
-                    total_relationships += len(sub_batch)
-                
-                connection.commit()
-                
-                # Update progress
-                processed = len(puzzles)
-                total_processed += processed
-                pbar.update(processed)
-                
-                # Print progress info
-                if total_processed % 100000 == 0:
-                    elapsed = time.time() - start_time
-                    relations_per_sec = total_relationships / elapsed if elapsed > 0 else 0
-                    print(f"\nProcessed {total_processed:,}/{total_puzzles:,} puzzles, "
-                          f"Created {total_relationships:,} relationships, "
-                          f"Rate: {relations_per_sec:.2f} relations/sec")
-                
-                # Move to next batch
-                offset += batch_size
-        
-        # Re-enable keys
-        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
-        cursor.execute('SET UNIQUE_CHECKS=1')
-        cursor.execute('SET autocommit=1')
+        step_start = time.time()
+        deferred = DeferredIndexes(connection, ['puzzle_theme']) if defer_indexes else nullcontext()
+        with deferred:
+            if strategy == 'sql':
+                total_relationships = link_themes_sql(cursor, batch_size, jobs, checkpoint_path, state,
+                                                      bits is not None)
+            else:
+                total_relationships = link_themes_python(connection, cursor, theme_map, batch_size, checkpoint_path,
+                                                         state, bits)
+        timings['relationships'] = time.time() - step_start
 
         # Step 3: Verify the migration
         print("\nStep 3: Verifying migration")
@@ -157,12 +371,19 @@ def migrate_themes():
         theme_count = cursor.fetchone()[0]
         cursor.execute("SELECT COUNT(*) FROM puzzle_theme")
         puzzle_theme_count = cursor.fetchone()[0]
-        
+
         elapsed = time.time() - start_time
         print(f"Created {theme_count:,} themes and {puzzle_theme_count:,} puzzle-theme relationships")
         print(f"Total time: {elapsed:.2f} seconds ({elapsed/60:.2f} minutes)")
         print(f"Average rate: {puzzle_theme_count/elapsed:.2f} relationships per second")
 
+        # Same layout for both strategies so runs can be compared side by side
+        print(f"\nTimings ({strategy} strategy):")
+        print(f"  Theme collection:     {timings['themes']:10.2f} s")
+        print(f"  Relationship inserts: {timings['relationships']:10.2f} s "
+              f"({total_relationships / timings['relationships'] if timings['relationships'] > 0 else 0:,.0f} relations/sec)")
+        print(f"  Total:                {elapsed:10.2f} s")
+
         connection.commit()
 
     except Error as e:
@@ -171,8 +392,34 @@ def migrate_themes():
         sys.exit(1)
 
     finally:
+        changes.end()
         cursor.close()
         connection.close()
 
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Migrate puzzle.themes into the theme and puzzle_theme tables')
+    parser.add_argument('--strategy', choices=['python', 'sql'], default='python',
+                        help='python: split themes client-side (default); '
+                             'sql: split and insert inside MySQL 8 with JSON_TABLE, one statement per ID range')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Puzzles per batch, or per ID range with the sql strategy (default: 10000)')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help=f'ID ranges processed concurrently by the sql strategy (default: 4, max: {POOL_SIZE - 1})')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help=f'Checkpoint file written after every batch (default: {DEFAULT_CHECKPOINT})')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue after the last committed batch (python) or ID range (sql) '
+                             'recorded in the checkpoint')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='Drop the secondary indexes and foreign keys of puzzle_theme '
+                             'and rebuild them in one ALTER TABLE at the end')
+    args = parser.parse_args()
+    if not 1 <= args.jobs < POOL_SIZE:
+        parser.error(f"--jobs must be between 1 and {POOL_SIZE - 1} (connection pool size is {POOL_SIZE})")
+    return args
+
 if __name__ == "__main__":
-    migrate_themes() 
\ No newline at end of file
+    args = parse_args()
+    migrate_themes(batch_size=args.batch_size, checkpoint_path=args.checkpoint, resume=args.resume,
+                   strategy=args.strategy, jobs=args.jobs, defer_indexes=args.defer_indexes)
\ No newline at end of file
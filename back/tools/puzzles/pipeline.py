@@ -0,0 +1,122 @@
+"""
+Two-stage producer/consumer pipeline for the puzzle tools.
+
+The producer stage (CSV parsing and transformation) runs in a background
+thread and hands its results to the consumer stage (database writes) through
+a bounded queue, so pandas can parse the next chunk while MySQL executes and
+commits the previous one. The queue bound applies back-pressure: when writes
+are the bottleneck the producer blocks instead of buffering the whole file.
+
+Both pandas' C parser and the MySQL client release the GIL while they work,
+which is what lets the two stages overlap in threads.
+"""
+
+import time
+import queue
+import threading
+
+DEFAULT_DEPTH = 4
+
+_DONE = object()
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+class Pipeline:
+    """Iterate over `source` with the iteration itself running in a background thread.
+
+    Usage:
+        pipeline = Pipeline(prepare(chunk) for chunk in stream)
+        for item in pipeline:
+            write(item)
+        pipeline.report()
+
+    At most `depth` produced items wait in the queue. Exceptions raised by the
+    producer are re-raised in the consumer.
+    """
+
+    def __init__(self, source, depth=DEFAULT_DEPTH):
+        self.source = source
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+
+        self.items = 0
+        self.producer_busy = 0.0
+        self.producer_blocked = 0.0  # Back-pressure: waiting for room in the queue
+        self.consumer_busy = 0.0
+        self.consumer_idle = 0.0  # Starvation: waiting for the next item
+        self.full_waits = 0
+        self.max_depth = 0
+
+    def _put(self, item):
+        if self.queue.full():
+            self.full_waits += 1
+        start = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.producer_blocked += time.perf_counter() - start
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _produce(self):
+        try:
+            iterator = iter(self.source)
+            while not self.stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self.producer_busy += time.perf_counter() - start
+                self._put(item)
+        except BaseException as e:
+            self._put(_Failure(e))
+            return
+        self._put(_DONE)
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._produce, name='pipeline-producer', daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self.queue.get()
+                self.consumer_idle += time.perf_counter() - start
+
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+
+                self.items += 1
+                start = time.perf_counter()
+                yield item
+                self.consumer_busy += time.perf_counter() - start
+        finally:
+            # Unblock the producer if the consumer stopped early
+            self.stop.set()
+            thread.join()
+
+    def close(self):
+        """Stop the producer, for consumers that bail out of the loop with an exception."""
+        self.stop.set()
+
+    def report(self, producer='parse', consumer='write'):
+        """Print per-stage busy/idle times and a hint on which stage limits throughput."""
+        print(f"\nPipeline ({self.items} chunks, queue depth {self.depth}):")
+        print(f"  {producer}: {self.producer_busy:.2f}s busy, "
+              f"{self.producer_blocked:.2f}s blocked on a full queue ({self.full_waits} times)")
+        print(f"  {consumer}: {self.consumer_busy:.2f}s busy, "
+              f"{self.consumer_idle:.2f}s waiting for chunks")
+        print(f"  Max queue depth reached: {self.max_depth}")
+
+        if self.producer_blocked > self.consumer_idle:
+            print(f"  The {consumer} stage is the bottleneck; larger batches amortize per-commit costs")
+        else:
+            print(f"  The {producer} stage is the bottleneck; larger batches amortize per-chunk parsing overhead")
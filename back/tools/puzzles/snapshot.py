@@ -0,0 +1,458 @@
+"""
+Binary snapshots of the puzzle dataset.
+
+`export` dumps the puzzle, theme and puzzle_theme tables into a directory of
+zstd-compressed Parquet files, each holding about --rows-per-file rows in
+primary key order. A manifest.json, written last, records the CREATE TABLE
+statement, columns and row count of every table and the size and SHA-256 of
+every file. All tables are read in one consistent snapshot transaction, so
+relations always match the exported puzzles.
+
+`restore` checks every file against its checksum before touching the
+database, creates missing tables from their recorded statement, then loads
+the files with LOAD DATA LOCAL INFILE in --workers processes, each on its own
+connection. Row counts are compared with the manifest at the end.
+
+    python snapshot.py export snapshots/2026-10-18
+    python snapshot.py restore snapshots/2026-10-18 --workers 8 --replace
+
+Derived tables (sampling index, theme stats) can be added with --tables or
+rebuilt after a restore. Requires the 'pyarrow' package.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from mysql.connector import Error
+from tqdm import tqdm
+from import_puzzles import create_connection
+from change_log import DataChanges
+from csv_stream import arrow_pandas_type
+from deferred_indexes import DeferredIndexes
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+FORMAT_VERSION = 1
+
+MANIFEST = 'manifest.json'
+
+DEFAULT_TABLES = ['theme', 'puzzle', 'puzzle_theme']
+
+DEFAULT_ROWS_PER_FILE = 1000000
+
+# Rows fetched from MySQL per Parquet row group, and loaded per LOAD DATA statement
+FETCH_SIZE = 100000
+
+COMPRESSIONS = ['zstd', 'snappy', 'gzip', 'none']
+
+# MySQL integer type -> bits of its Arrow type
+INTEGER_TYPES = {'tinyint': 8, 'smallint': 16, 'mediumint': 32, 'int': 32, 'bigint': 64}
+
+# Read back as text, MySQL converts them when they are loaded
+TEXT_TYPES = {'char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'enum', 'set'}
+CAST_TYPES = {'decimal', 'json'}
+
+# Prefixed to every non-NULL text value in the load files, so an empty
+# string and NULL, both otherwise an empty field, stay apart
+TEXT_MARKER = 'v'
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise RuntimeError("Snapshots require the 'pyarrow' package (pip install pyarrow)")
+
+def arrow_type(column):
+    """Arrow type a MySQL column is stored as in the snapshot."""
+    data_type = column['data_type']
+    if data_type in INTEGER_TYPES:
+        sign = 'uint' if 'unsigned' in column['column_type'] else 'int'
+        return getattr(pyarrow, f"{sign}{INTEGER_TYPES[data_type]}")()
+    if data_type in TEXT_TYPES or data_type in CAST_TYPES:
+        return pyarrow.string()
+    if data_type in ('float', 'double'):
+        return pyarrow.float64()
+    if data_type == 'year':
+        return pyarrow.int16()
+    if data_type == 'date':
+        return pyarrow.date32()
+    if data_type in ('datetime', 'timestamp'):
+        return pyarrow.timestamp('us')
+    raise ValueError(f"Column {column['name']} has type {column['column_type']}, which snapshots do not support")
+
+def table_columns(cursor, table):
+    """Stored columns of `table` in order; generated columns are left for MySQL to compute."""
+    cursor.execute("""
+        SELECT COLUMN_NAME, DATA_TYPE, COLUMN_TYPE, IS_NULLABLE
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND EXTRA NOT LIKE %s
+        ORDER BY ORDINAL_POSITION
+    """, (table, '%GENERATED%'))
+    return [
+        {'name': name, 'data_type': data_type.lower(), 'column_type': column_type.lower(),
+         'nullable': nullable == 'YES'}
+        for name, data_type, column_type, nullable in cursor.fetchall()
+    ]
+
+def primary_key(cursor, table):
+    cursor.execute("""
+        SELECT COLUMN_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY'
+        ORDER BY ORDINAL_POSITION
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+def file_digest(path):
+    """SHA-256 of a file, None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def export_table(connection, cursor, directory, table, rows_per_file, compression):
+    """Write `table` into Parquet files under directory/table and return its manifest entry."""
+    cursor.execute(f"SHOW CREATE TABLE `{table}`")
+    create_statement = cursor.fetchone()[1]
+    columns = table_columns(cursor, table)
+    key = primary_key(cursor, table)
+    schema = pyarrow.schema([(column['name'], arrow_type(column)) for column in columns])
+
+    select = ', '.join(
+        f"CAST(`{c['name']}` AS CHAR) AS `{c['name']}`" if c['data_type'] in CAST_TYPES else f"`{c['name']}`"
+        for c in columns
+    )
+    order = f" ORDER BY {', '.join(f'`{c}`' for c in key)}" if key else ''
+    os.makedirs(os.path.join(directory, table), exist_ok=True)
+
+    files = []
+    writer = None
+    path = None
+    file_rows = 0
+
+    def close_file():
+        writer.close()
+        files.append({
+            'path': os.path.relpath(path, directory),
+            'rows': file_rows,
+            'bytes': os.path.getsize(path),
+            'sha256': file_digest(path)
+        })
+
+    fetch_size = min(FETCH_SIZE, rows_per_file)
+    stream = connection.cursor(buffered=False)
+    try:
+        stream.execute(f"SELECT {select} FROM `{table}`{order}")
+        with tqdm(desc=f"Exporting {table}", unit=' rows', unit_scale=True) as pbar:
+            while True:
+                rows = stream.fetchmany(fetch_size)
+                if not rows:
+                    break
+
+                if writer is not None and file_rows >= rows_per_file:
+                    close_file()
+                    writer = None
+                if writer is None:
+                    path = os.path.join(directory, table, f"part-{len(files):05d}.parquet")
+                    writer = parquet.ParquetWriter(path, schema, compression=compression)
+                    file_rows = 0
+
+                arrays = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+                file_rows += len(rows)
+                pbar.update(len(rows))
+    finally:
+        stream.close()
+
+    if writer is not None:
+        close_file()
+
+    return {
+        'create_statement': create_statement,
+        'columns': columns,
+        'primary_key': key,
+        'rows': sum(f['rows'] for f in files),
+        'files': files
+    }
+
+def export_snapshot(directory, tables=DEFAULT_TABLES, rows_per_file=DEFAULT_ROWS_PER_FILE, compression='zstd'):
+    try:
+        require_pyarrow()
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest_path):
+        print(f"Error: {directory} already holds a snapshot")
+        sys.exit(1)
+    os.makedirs(directory, exist_ok=True)
+
+    start_time = time.time()
+    connection = create_connection()
+    cursor = connection.cursor()
+    manifest = {
+        'format': FORMAT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'compression': compression,
+        'tables': {}
+    }
+
+    try:
+        # Every table is read from the same view of the database
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+        for table in tables:
+            manifest['tables'][table] = export_table(connection, cursor, directory, table, rows_per_file,
+                                                     None if compression == 'none' else compression)
+        connection.commit()
+
+    except (Error, ValueError) as e:
+        print(f"Error during export: {e}")
+        connection.rollback()
+        sys.exit(1)
+
+    finally:
+        cursor.close()
+        connection.close()
+
+    # Written last: a directory without a manifest is an incomplete export
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    elapsed = time.time() - start_time
+    size = sum(f['bytes'] for entry in manifest['tables'].values() for f in entry['files'])
+    print(f"\nSnapshot written to {directory} ({size / 1024 ** 2:.1f} MB) in {elapsed:.2f} s")
+    for table, entry in manifest['tables'].items():
+        print(f"  {table:<16} {entry['rows']:>12,} rows in {len(entry['files'])} files")
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        raise RuntimeError(f"{directory} has no {MANIFEST}, it is not a snapshot or its export did not complete")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise RuntimeError(f"Snapshot format {manifest.get('format')} is not supported (expected {FORMAT_VERSION})")
+    return manifest
+
+def load_statement(table, columns):
+    """LOAD DATA statement for the tab-separated files written by write_load_file."""
+    variables = ', '.join(f"@v{i}" for i in range(len(columns)))
+    assignments = []
+    for i, column in enumerate(columns):
+        value = f"@v{i}"
+        if column['data_type'] in TEXT_TYPES or column['data_type'] in CAST_TYPES:
+            value = f"IF(@v{i} = '', NULL, SUBSTRING(@v{i}, {len(TEXT_MARKER) + 1}))"
+        elif column['nullable']:
+            value = f"NULLIF(@v{i}, '')"
+        assignments.append(f"`{column['name']}` = {value}")
+    return (
+        f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table}` "
+        "CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' "
+        f"({variables}) SET {', '.join(assignments)}"
+    )
+
+def write_load_file(batch, columns, tmp_path):
+    """Write a record batch as a tab-separated file for load_statement, NULLs as empty fields."""
+    data = batch.to_pandas(types_mapper=arrow_pandas_type)
+    for column in columns:
+        if column['data_type'] in TEXT_TYPES or column['data_type'] in CAST_TYPES:
+            data[column['name']] = TEXT_MARKER + data[column['name']]
+    data.to_csv(
+        tmp_path,
+        sep='\t',
+        header=False,
+        index=False,
+        na_rep='',
+        quoting=csv.QUOTE_NONE,
+        escapechar='\\',
+        lineterminator='\n'
+    )
+
+def restore_file(path, table, columns):
+    """Worker entry point: load one snapshot file into `table` on its own connection.
+
+    Returns the number of rows loaded.
+    """
+    connection = create_connection(allow_local_infile=True)
+    cursor = connection.cursor()
+    fd, tmp_path = tempfile.mkstemp(suffix='.tsv')
+    os.close(fd)
+    statement = load_statement(table, columns)
+    rows = 0
+
+    try:
+        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+        cursor.execute('SET UNIQUE_CHECKS=0')
+        for batch in parquet.ParquetFile(path).iter_batches(batch_size=FETCH_SIZE):
+            write_load_file(batch, columns, tmp_path)
+            cursor.execute(statement, (tmp_path,))
+            connection.commit()
+            rows += batch.num_rows
+    except Error as e:
+        connection.rollback()
+        # mysql.connector errors do not always survive pickling, send the message instead
+        raise RuntimeError(f"Restoring {path} into {table} failed: {e}")
+    finally:
+        cursor.close()
+        connection.close()
+        os.remove(tmp_path)
+
+    return rows
+
+def prepare_tables(cursor, manifest, tables, replace):
+    """Create the missing tables and make sure the others can take the snapshot rows."""
+    for table in tables:
+        entry = manifest['tables'][table]
+        cursor.execute("SHOW TABLES LIKE %s", (table,))
+        if not cursor.fetchall():
+            cursor.execute(entry['create_statement'])
+            print(f"Created table {table}")
+            continue
+
+        existing = {column['name'] for column in table_columns(cursor, table)}
+        missing = [column['name'] for column in entry['columns'] if column['name'] not in existing]
+        if missing:
+            raise RuntimeError(f"Table {table} has no column {', '.join(missing)}, migrate the schema first")
+
+        cursor.execute(f"SELECT COUNT(*) FROM `{table}`")
+        count = cursor.fetchone()[0]
+        if count and not replace:
+            raise RuntimeError(f"Table {table} already holds {count:,} rows, restore with --replace to empty it")
+        if count:
+            cursor.execute(f"TRUNCATE TABLE `{table}`")
+            print(f"Emptied table {table} ({count:,} rows)")
+
+def restore_snapshot(directory, tables=None, workers=4, replace=False, defer_indexes=False):
+    start_time = time.time()
+    try:
+        require_pyarrow()
+        manifest = load_manifest(directory)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    tables = tables or list(manifest['tables'])
+    unknown = [table for table in tables if table not in manifest['tables']]
+    if unknown:
+        print(f"Error: the snapshot has no table {', '.join(unknown)}")
+        sys.exit(1)
+
+    # Largest files first, so the pool does not end up waiting on a single big one
+    files = [(table, entry) for table in tables for entry in manifest['tables'][table]['files']]
+    files.sort(key=lambda f: f[1]['bytes'], reverse=True)
+    paths = [os.path.join(directory, entry['path']) for _, entry in files]
+    total_rows = sum(manifest['tables'][table]['rows'] for table in tables)
+
+    connection = create_connection(allow_local_infile=True)
+    cursor = connection.cursor()
+    # Whole tables are replaced, far too many puzzles to log one by one
+    changes = DataChanges(connection, logged=False)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Nothing is written unless every file is intact
+            print(f"Verifying {len(files)} snapshot files...")
+            corrupt = [path for path, (_, entry), digest in zip(paths, files, executor.map(file_digest, paths))
+                       if digest != entry['sha256']]
+            if corrupt:
+                raise RuntimeError(f"{len(corrupt)} snapshot files are missing or do not match their checksum: "
+                                   f"{', '.join(corrupt[:5])}")
+
+            changes.begin()
+            cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+            prepare_tables(cursor, manifest, tables, replace)
+            connection.commit()
+
+            deferred = DeferredIndexes(connection, tables) if defer_indexes else nullcontext()
+            load_start = time.time()
+            with deferred, tqdm(total=total_rows, desc="Restoring", unit=' rows', unit_scale=True) as pbar:
+                futures = [
+                    executor.submit(restore_file, path, table, manifest['tables'][table]['columns'])
+                    for path, (table, _) in zip(paths, files)
+                ]
+                for future in as_completed(futures):
+                    pbar.update(future.result())
+            load_time = time.time() - load_start
+
+        # The row counts must match the snapshot
+        mismatches = []
+        for table in tables:
+            cursor.execute(f"SELECT COUNT(*) FROM `{table}`")
+            count = cursor.fetchone()[0]
+            expected = manifest['tables'][table]['rows']
+            print(f"  {table:<16} {count:>12,} rows")
+            if count != expected:
+                mismatches.append(f"{table} has {count:,} rows instead of {expected:,}")
+        if mismatches:
+            raise RuntimeError('; '.join(mismatches))
+
+        elapsed = time.time() - start_time
+        print(f"\nRestored {total_rows:,} rows from {directory} (snapshot of {manifest['created']})")
+        print(f"Load time: {load_time:.2f} s ({total_rows / load_time if load_time > 0 else 0:,.0f} rows/sec)")
+        print(f"Total time: {elapsed:.2f} s")
+
+    except (Error, RuntimeError) as e:
+        print(f"Error during restore: {e}")
+        connection.rollback()
+        sys.exit(1)
+
+    finally:
+        changes.end()
+        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+        cursor.close()
+        connection.close()
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Export the puzzle dataset to a Parquet snapshot, or restore one')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='Dump the tables into a snapshot directory')
+    export.add_argument('directory', help='Directory the snapshot is written to, created if needed')
+    export.add_argument('--tables', nargs='+', default=DEFAULT_TABLES,
+                        help=f"Tables to export (default: {' '.join(DEFAULT_TABLES)})")
+    export.add_argument('--rows-per-file', type=int, default=DEFAULT_ROWS_PER_FILE,
+                        help=f'Rows per Parquet file, the unit restore workers load (default: {DEFAULT_ROWS_PER_FILE})')
+    export.add_argument('--compression', choices=COMPRESSIONS, default='zstd',
+                        help='Parquet compression codec (default: zstd)')
+
+    restore = commands.add_parser('restore', help='Load a snapshot directory into the database')
+    restore.add_argument('directory', help='Snapshot directory written by export')
+    restore.add_argument('--tables', nargs='+', default=None,
+                         help='Tables to restore (default: every table in the snapshot)')
+    restore.add_argument('--workers', type=int, default=4,
+                         help='Processes loading snapshot files in parallel, each on its own connection (default: 4)')
+    restore.add_argument('--replace', action='store_true',
+                         help='Empty tables that already hold rows instead of refusing to restore into them')
+    restore.add_argument('--defer-indexes', action='store_true',
+                         help='Drop the secondary indexes and foreign keys of the restored tables '
+                              'and rebuild them in one ALTER TABLE at the end')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'export':
+        export_snapshot(args.directory, tables=args.tables, rows_per_file=args.rows_per_file,
+                        compression=args.compression)
+    else:
+        restore_snapshot(args.directory, tables=args.tables, workers=args.workers, replace=args.replace,
+                         defer_indexes=args.defer_indexes)
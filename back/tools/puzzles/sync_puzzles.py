@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+from mysql.connector import Error
+import sys
+import os
+import time
+import argparse
+from tqdm import tqdm
+from change_log import DataChanges
+from csv_stream import CsvStream
+from id_index import decode_ids, lookup
+from import_puzzles import (PUZZLE_COLUMNS, create_connection, csv_options, prepare_chunk, quarantine_rows, row_values,
+                            load_theme_map, theme_relations)
+from theme_mask import has_mask_column, load_bits, sync_masks
+from metrics import StageMetrics
+
+NUMERIC_COLUMNS = ['rating', 'rating_deviation', 'popularity', 'nb_plays']
+
+DEFAULT_MANIFEST = 'puzzle_manifest.npz'
+DELETE_BATCH_SIZE = 1000
+DEFAULT_QUARANTINE = 'sync_puzzles.quarantine.csv'
+
+def load_manifest(path):
+    """Load the manifest of the previous sync: sorted packed IDs with their row and theme hashes."""
+    if not os.path.exists(path):
+        empty = np.array([], dtype=np.uint64)
+        return empty, empty, empty
+
+    with np.load(path) as manifest:
+        return manifest['keys'], manifest['row_hash'], manifest['theme_hash']
+
+def save_manifest(path, keys, row_hash, theme_hash):
+    """Write the manifest atomically so a crash never leaves a truncated file behind."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, keys=keys, row_hash=row_hash, theme_hash=theme_hash)
+    os.replace(tmp_path, path)
+
+def hash_chunk(data):
+    """Return (row_hash, theme_hash) uint64 arrays for a renamed chunk."""
+    content = data[PUZZLE_COLUMNS[1:]].copy()
+    # Normalize dtypes so the same value hashes the same whether or not the chunk has NaNs
+    for column in NUMERIC_COLUMNS:
+        content[column] = pd.to_numeric(content[column], errors='coerce').astype('Int64')
+    content = content.astype(str)
+
+    row_hash = pd.util.hash_pandas_object(content, index=False).to_numpy()
+    theme_hash = pd.util.hash_pandas_object(data['themes'].fillna('').str.strip(), index=False).to_numpy()
+    return row_hash, theme_hash
+
+def upsert_puzzles(cursor, rows):
+    columns = ', '.join(PUZZLE_COLUMNS)
+    placeholders = ', '.join(['%s'] * len(PUZZLE_COLUMNS))
+    updates = ', '.join(f"{c} = VALUES({c})" for c in PUZZLE_COLUMNS[1:])
+    query = f"INSERT INTO puzzle ({columns}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates}"
+
+    cursor.executemany(query, row_values(rows[PUZZLE_COLUMNS]))
+
+def replace_themes(cursor, rows, theme_map, bits=None):
+    """Rewrite puzzle_theme, and with `bits` the theme masks, for the given rows.
+
+    The stored relations of every row are deleted first, new rows included: a
+    puzzle missing from the manifest may still be in the database, e.g. on the
+    first sync of an imported database. Returns the number of relations inserted.
+    """
+    ids = rows['id'].tolist()
+    placeholders = ','.join(['%s'] * len(ids))
+    cursor.execute(f"DELETE FROM puzzle_theme WHERE puzzle_id IN ({placeholders})", ids)
+
+    relations = theme_relations(cursor, rows, theme_map)
+    if bits is not None:
+        sync_masks(cursor, rows['id'], relations, bits)
+    if not relations:
+        return 0
+
+    cursor.executemany("INSERT IGNORE INTO puzzle_theme (puzzle_id, theme_id) VALUES (%s, %s)", relations)
+    return len(relations)
+
+def delete_missing(connection, cursor, missing_ids, changes):
+    """Delete puzzles that disappeared from the CSV, in batches logged in `changes`."""
+    for i in tqdm(range(0, len(missing_ids), DELETE_BATCH_SIZE), desc="Deleting puzzles"):
+        batch = missing_ids[i:i + DELETE_BATCH_SIZE]
+        changes.log(cursor, batch)
+        placeholders = ','.join(['%s'] * len(batch))
+        cursor.execute(f"DELETE FROM puzzle_theme WHERE puzzle_id IN ({placeholders})", batch)
+        cursor.execute(f"DELETE FROM puzzle WHERE id IN ({placeholders})", batch)
+        connection.commit()
+
+def sync_puzzles(file_path, manifest_path=DEFAULT_MANIFEST, batch_size=10000, delete=False, dry_run=False,
+                 metrics_path=None, quarantine_path=DEFAULT_QUARANTINE):
+    start_time = time.time()
+    metrics = StageMetrics('sync_puzzles', dry_run=dry_run)
+
+    old_ids, old_row_hash, old_theme_hash = load_manifest(manifest_path)
+    if len(old_ids):
+        print(f"Loaded manifest with {len(old_ids):,} puzzles from {manifest_path}")
+    else:
+        print(f"No manifest at {manifest_path}, every puzzle will be upserted")
+
+    connection = create_connection()
+    cursor = connection.cursor()
+    changes = DataChanges(connection)
+
+    try:
+        cursor.execute('SET FOREIGN_KEY_CHECKS=0')
+        cursor.execute('SET autocommit=0')
+
+        theme_map = load_theme_map(cursor)
+        bits = (load_bits(cursor) or None) if has_mask_column(cursor) else None
+
+        new_rows = 0
+        changed_rows = 0
+        theme_changes = 0
+        unchanged_rows = 0
+        relations = 0
+        duplicate_ids = set()
+        invalid_data = []
+        seen_ids = []
+        seen_row_hash = []
+        seen_theme_hash = []
+
+        stream = CsvStream(file_path, batch_size, **csv_options())
+        with tqdm(total=stream.total_bytes, desc="Syncing puzzles", unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+            for chunk, size in metrics.chunks(stream):
+                rows = len(chunk)
+                with metrics.stage('validate', rows, size):
+                    # Same checks as import_puzzles, invalid rows are neither written nor tracked in the manifest
+                    data, ids, rejected = prepare_chunk(chunk, duplicate_ids, invalid_data)
+
+                with metrics.stage('hash', rows, size):
+                    row_hash, theme_hash = hash_chunk(data)
+                    seen_ids.append(ids)
+                    seen_row_hash.append(row_hash)
+                    seen_theme_hash.append(theme_hash)
+
+                    if len(old_ids):
+                        found, positions = lookup(old_ids, ids)
+                        row_changed = found & (old_row_hash[positions] != row_hash)
+                        themes_changed = found & (old_theme_hash[positions] != theme_hash)
+                    else:
+                        found = row_changed = themes_changed = np.zeros(len(ids), dtype=bool)
+                    is_new = ~found
+
+                upsert_mask = is_new | row_changed
+                theme_mask = is_new | themes_changed
+
+                new_rows += int(is_new.sum())
+                changed_rows += int(row_changed.sum())
+                theme_changes += int(themes_changed.sum())
+                unchanged_rows += int((~upsert_mask & ~theme_mask).sum())
+
+                if not dry_run:
+                    if upsert_mask.any() or theme_mask.any():
+                        changes.begin()
+                        changes.log(cursor, data['id'][upsert_mask | theme_mask])
+                    if upsert_mask.any():
+                        with metrics.stage('write', rows, size):
+                            upsert_puzzles(cursor, data[upsert_mask])
+                    if theme_mask.any():
+                        with metrics.stage('relations', rows, size):
+                            relations += replace_themes(cursor, data[theme_mask], theme_map, bits)
+                    with metrics.stage('commit', rows, size):
+                        connection.commit()
+                    if rejected is not None and quarantine_path:
+                        quarantine_rows(quarantine_path, rejected)
+
+                pbar.update(stream.advance())
+
+        # Build the new manifest, keeping the last occurrence of duplicated IDs
+        ids = np.concatenate(seen_ids)[::-1] if seen_ids else np.array([], dtype=np.uint64)
+        row_hash = np.concatenate(seen_row_hash)[::-1] if seen_row_hash else np.array([], dtype=np.uint64)
+        theme_hash = np.concatenate(seen_theme_hash)[::-1] if seen_theme_hash else np.array([], dtype=np.uint64)
+        ids, first = np.unique(ids, return_index=True)
+        row_hash = row_hash[first]
+        theme_hash = theme_hash[first]
+
+        missing_mask = ~np.isin(old_ids, ids)
+        missing = old_ids[missing_mask]
+        print(f"\nNew puzzles: {new_rows:,}")
+        print(f"Changed puzzles: {changed_rows:,}")
+        print(f"Puzzles with changed themes: {theme_changes:,}")
+        print(f"Unchanged puzzles: {unchanged_rows:,}")
+        print(f"Puzzle-theme relations written: {relations:,}")
+        print(f"Puzzles no longer in the CSV: {len(missing):,}")
+        print(f"IDs found more than once in a chunk: {len(duplicate_ids):,}")
+        print(f"Invalid rows skipped: {len(invalid_data):,}")
+        if invalid_data and quarantine_path and not dry_run:
+            print(f"Invalid rows quarantined to {quarantine_path}")
+
+        if dry_run:
+            print("Dry run: database and manifest left untouched")
+            metrics.report()
+            if metrics_path:
+                metrics.write(metrics_path)
+            return
+
+        if delete and len(missing):
+            changes.begin()
+            with metrics.stage('delete', len(missing)):
+                delete_missing(connection, cursor, decode_ids(missing), changes)
+            print(f"Deleted {len(missing):,} puzzles")
+        elif len(missing):
+            # Still in the database, keep tracking them
+            ids = np.concatenate([ids, missing])
+            row_hash = np.concatenate([row_hash, old_row_hash[missing_mask]])
+            theme_hash = np.concatenate([theme_hash, old_theme_hash[missing_mask]])
+            order = np.argsort(ids)
+            ids, row_hash, theme_hash = ids[order], row_hash[order], theme_hash[order]
+
+        with metrics.stage('manifest', len(ids)):
+            save_manifest(manifest_path, ids, row_hash, theme_hash)
+        print(f"Manifest with {len(ids):,} puzzles saved to {manifest_path}")
+        print(f"Total time: {time.time() - start_time:.2f} seconds")
+
+        metrics.report()
+        if metrics_path:
+            metrics.write(metrics_path)
+
+    except Error as e:
+        print(f"Error during sync: {e}")
+        connection.rollback()
+        sys.exit(1)
+
+    finally:
+        changes.end()
+        cursor.execute('SET FOREIGN_KEY_CHECKS=1')
+        cursor.execute('SET autocommit=1')
+        cursor.close()
+        connection.close()
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Sync the puzzle tables with a new Lichess CSV, writing only new or changed puzzles')
+    parser.add_argument('file_path', help='Path to the Lichess puzzle CSV (.csv, .csv.gz, .csv.bz2 or .csv.zst)')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST,
+                        help=f'Content-hash manifest of the previous sync (default: {DEFAULT_MANIFEST}); '
+                             'without it every puzzle is upserted')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Rows per chunk (default: 10000)')
+    parser.add_argument('--delete', action='store_true',
+                        help='Delete puzzles that are in the manifest but no longer in the CSV')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report what would change')
+    parser.add_argument('--metrics', default=None, metavar='PATH',
+                        help='Write the time, rows/s and MB/s of every stage: a Prometheus textfile '
+                             'for a .prom path, JSON lines appended to any other path')
+    parser.add_argument('--quarantine', default=DEFAULT_QUARANTINE, metavar='PATH',
+                        help='CSV the invalid rows are appended to, with the reason they were rejected '
+                             f'(default: {DEFAULT_QUARANTINE})')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    sync_puzzles(args.file_path, manifest_path=args.manifest, batch_size=args.batch_size,
+                 delete=args.delete, dry_run=args.dry_run, metrics_path=args.metrics,
+                 quarantine_path=args.quarantine)
@@ -10,15 +10,26 @@ import json
 import logging
 import time
 import os
+import sys
 import argparse
+import itertools
 from datetime import datetime
 from config import (
     API_BASE_URL, 
     DEFAULT_MIN_RATING,
     DEFAULT_MAX_RATING,
     DEFAULT_THEMES,
-    PERFORMANCE_TEST
+    PERFORMANCE_TEST,
+    LOAD_TEST,
+    REGRESSION_THRESHOLDS,
+    WORKLOAD
 )
+from load_test import LatencyHistogram, LoadTest, log_results, timed_session, timed_get
+from baseline import save_baseline, load_baseline, compare_results, log_comparison
+from workload import WorkloadGenerator, distributions_from_csv, distributions_from_db, read_access_log
+
+# Tests whose results can be saved as or compared against a baseline
+LOAD_TESTS = ('load', 'workload', 'replay')
 
 # Setup logging directory
 LOG_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'logs')
@@ -37,6 +48,24 @@ console.setLevel(logging.INFO)
 console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logging.getLogger('').addHandler(console)
 
+# Shared keep-alive session of the single-request tests, unless --cold asks for a new connection every time
+SESSION = timed_session()
+COLD_CONNECTIONS = False
+
+def http_session():
+    """Session for the next request: the shared one, or a new one for cold connections."""
+    return timed_session() if COLD_CONNECTIONS else SESSION
+
+def log_sample(sample):
+    """Log the time breakdown, size and Server-Timing metrics of a response."""
+    total = sample.connect + sample.ttfb + sample.download
+    logging.info(f"Response time: {total:.2f} seconds (connect {sample.connect * 1000:.1f} ms, "
+                 f"first byte {sample.ttfb * 1000:.1f} ms, download {sample.download * 1000:.1f} ms)")
+    logging.info(f"Response size: {sample.size / 1024:.1f} KB")
+    if sample.server_timing:
+        logging.info("Server-Timing: " + ', '.join(f"{metric} {duration:.1f} ms"
+                                                   for metric, duration in sample.server_timing.items()))
+
 def check_server_connectivity():
     """Check if the API server is reachable"""
     base_url = API_BASE_URL.split('/api')[0]  # Extract base URL without /api
@@ -81,11 +110,8 @@ def test_random_puzzle(min_rating=DEFAULT_MIN_RATING, max_rating=DEFAULT_MAX_RAT
     try:
         logging.info(f"Testing URL: {full_url}")
         logging.info(f"Testing random puzzle endpoint with params: {params}")
-        start_time = time.time()
-        response = requests.get(url, params=params, timeout=10)
-        elapsed_time = time.time() - start_time
-        
-        logging.info(f"Response time: {elapsed_time:.2f} seconds")
+        response, sample = timed_get(http_session(), url, params, timeout=10)
+        log_sample(sample)
         logging.info(f"Status code: {response.status_code}")
         
         if response.status_code == 200:
@@ -130,11 +156,8 @@ def test_puzzles_by_themes(themes=DEFAULT_THEMES, min_rating=DEFAULT_MIN_RATING,
     try:
         logging.info(f"Testing URL: {full_url}")
         logging.info(f"Testing puzzles by themes endpoint with params: {params}")
-        start_time = time.time()
-        response = requests.get(url, params=params, timeout=10)
-        elapsed_time = time.time() - start_time
-        
-        logging.info(f"Response time: {elapsed_time:.2f} seconds")
+        response, sample = timed_get(http_session(), url, params, timeout=10)
+        log_sample(sample)
         logging.info(f"Status code: {response.status_code}")
         
         if response.status_code == 200:
@@ -178,15 +201,14 @@ def run_performance_test(endpoint='random', iterations=10, **params):
     
     total_time = 0
     successful = 0
+    latency = LatencyHistogram()
     
     for i in range(iterations):
         logging.info(f"Performance test iteration {i+1}/{iterations}")
         
         start_time = time.time()
         if endpoint == 'random':
-            # Extract themes from params if it exists
-            themes = params.pop('themes', None)
-            result = test_random_puzzle(themes=themes, **params)
+            result = test_random_puzzle(**params)
         elif endpoint == 'by-themes':
             result = test_puzzles_by_themes(**params)
         else:
@@ -198,12 +220,15 @@ def run_performance_test(endpoint='random', iterations=10, **params):
         if result:
             successful += 1
             total_time += elapsed_time
+            latency.record(elapsed_time)
     
     avg_time = total_time / iterations if iterations > 0 else 0
     success_rate = (successful / iterations) * 100 if iterations > 0 else 0
     
     logging.info(f"Performance test completed:")
     logging.info(f"  - Average response time: {avg_time:.2f} seconds")
+    logging.info(f"  - p50/p90/p99/max: {latency.percentile(50):.0f}/{latency.percentile(90):.0f}/"
+                 f"{latency.percentile(99):.0f}/{latency.max / 1000:.0f} ms")
     logging.info(f"  - Success rate: {success_rate:.1f}%")
     logging.info(f"  - Successful requests: {successful}/{iterations}")
     
@@ -215,6 +240,79 @@ def run_performance_test(endpoint='random', iterations=10, **params):
         'successful': successful
     }
 
+def endpoint_request(endpoint, themes, min_rating, max_rating, page=1, limit=20):
+    """Return the (url, params) of a request to one of the puzzle endpoints."""
+    params = {'min_rating': min_rating, 'max_rating': max_rating}
+    if endpoint == 'random':
+        if themes:
+            params['themes'] = ','.join(themes)
+        return f"{API_BASE_URL}/puzzles/random", params
+    if endpoint == 'by-themes':
+        params.update({'themes': ','.join(themes), 'page': page, 'limit': limit})
+        return f"{API_BASE_URL}/puzzles/by-themes", params
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+def run_load_test(endpoints, themes, min_rating, max_rating, concurrency=LOAD_TEST['concurrency'],
+                  requests_count=None, duration=LOAD_TEST['duration'], rps=LOAD_TEST['rps'],
+                  warmup=LOAD_TEST['warmup'], timeout=LOAD_TEST['timeout'], cold=False):
+    """Send concurrent requests to the endpoints in turn and log per-endpoint latency percentiles."""
+    prepared = [(endpoint,) + endpoint_request(endpoint, themes, min_rating, max_rating) for endpoint in endpoints]
+    next_request = itertools.cycle(prepared).__next__
+
+    logging.info(f"Starting load test on {', '.join(endpoints)}: concurrency {concurrency}, "
+                 + (f"{rps} req/s" if rps else "closed loop") + ", "
+                 + (f"{requests_count} requests" if requests_count else f"{duration} s")
+                 + f" after {warmup} s of warm-up")
+
+    results = LoadTest(next_request, concurrency=concurrency, total_requests=requests_count,
+                       duration=None if requests_count else duration, rps=rps,
+                       warmup=warmup, timeout=timeout, cold=cold).run()
+    results['params'] = {'endpoints': endpoints, 'themes': themes, 'min_rating': min_rating, 'max_rating': max_rating}
+    log_results(results)
+    return results
+
+def run_workload_test(source, csv_path=None, sample_rows=None, seed=None, concurrency=LOAD_TEST['concurrency'],
+                      requests_count=None, duration=LOAD_TEST['duration'], rps=LOAD_TEST['rps'],
+                      warmup=LOAD_TEST['warmup'], timeout=LOAD_TEST['timeout'], cold=False):
+    """Load the API with a query mix drawn from the real rating and theme distributions."""
+    if source == 'csv':
+        logging.info(f"Reading rating and theme distributions from {csv_path}")
+        ratings, themes = distributions_from_csv(csv_path, sample_rows)
+    else:
+        logging.info("Reading rating and theme distributions from the database")
+        ratings, themes = distributions_from_db()
+    logging.info(f"Workload built from {sum(ratings.values()):,} puzzles, {len(themes)} themes")
+
+    generator = WorkloadGenerator(ratings, themes, seed=seed)
+    logging.info(f"Starting workload test: concurrency {concurrency}, "
+                 + (f"{rps} req/s" if rps else "closed loop") + ", "
+                 + (f"{requests_count} requests" if requests_count else f"{duration} s")
+                 + f" after {warmup} s of warm-up")
+
+    results = LoadTest(generator, concurrency=concurrency, total_requests=requests_count,
+                       duration=None if requests_count else duration, rps=rps,
+                       warmup=warmup, timeout=timeout, cold=cold).run()
+    results['params'] = {'workload': source, 'seed': seed, 'mix': WORKLOAD['mix']}
+    log_results(results)
+    return results
+
+def run_replay_test(log_path, speed=1.0, concurrency=LOAD_TEST['concurrency'], timeout=LOAD_TEST['timeout'],
+                    cold=False):
+    """Replay the puzzle API requests of an access log, `speed` times faster than recorded."""
+    trace = read_access_log(log_path)
+    if not trace:
+        logging.error(f"No puzzle API requests found in {log_path}")
+        return None
+    logging.info(f"Replaying {len(trace):,} requests spanning {trace[-1][0]:.0f} s at {speed}x speed")
+
+    arrivals = (offset / speed for offset, *_ in trace)
+    requests_iter = iter([request for _, *request in trace])
+    results = LoadTest(lambda: tuple(next(requests_iter)), concurrency=concurrency, total_requests=len(trace),
+                       timeout=timeout, arrivals=arrivals, cold=cold).run()
+    results['params'] = {'access_log': os.path.basename(log_path), 'speed': speed}
+    log_results(results)
+    return results
+
 def check_individual_puzzle(puzzle_id):
     """Test retrieving a single puzzle by ID."""
     url = f"{API_BASE_URL}/puzzles/{puzzle_id}"
@@ -222,11 +320,8 @@ def check_individual_puzzle(puzzle_id):
     try:
         logging.info(f"Testing URL: {url}")
         logging.info(f"Testing individual puzzle endpoint for puzzle ID: {puzzle_id}")
-        start_time = time.time()
-        response = requests.get(url, timeout=10)
-        elapsed_time = time.time() - start_time
-        
-        logging.info(f"Response time: {elapsed_time:.2f} seconds")
+        response, sample = timed_get(http_session(), url, timeout=10)
+        log_sample(sample)
         logging.info(f"Status code: {response.status_code}")
         
         if response.status_code == 200:
@@ -255,8 +350,10 @@ def check_individual_puzzle(puzzle_id):
 def parse_args():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description='Test Chess Puzzle API endpoints')
-    parser.add_argument('--test', choices=['random', 'themes', 'puzzle', 'perf-random', 'perf-themes', 'all'],
-                       default='all', help='Which test to run (default: all)')
+    parser.add_argument('--test', choices=['random', 'themes', 'puzzle', 'perf-random', 'perf-themes',
+                                           'load', 'workload', 'replay', 'all'],
+                       default='all', help='Which test to run (default: all, which does not include load, '
+                                           'workload or replay)')
     parser.add_argument('--min-rating', type=int, default=DEFAULT_MIN_RATING,
                        help=f'Minimum rating (default: {DEFAULT_MIN_RATING})')
     parser.add_argument('--max-rating', type=int, default=DEFAULT_MAX_RATING,
@@ -267,11 +364,64 @@ def parse_args():
                        help='Number of iterations for performance tests (default: 5)')
     parser.add_argument('--puzzle-id', type=str, 
                        help='Puzzle ID to test individual puzzle endpoint')
+    parser.add_argument('--cold', action='store_true',
+                       help='Open a new connection for every request instead of keeping connections alive')
+    
+    load = parser.add_argument_group('load test options (--test load)')
+    load.add_argument('--endpoints', type=str, default=','.join(LOAD_TEST['endpoints']),
+                      help=f'Comma-separated endpoints to load, in turn (default: {",".join(LOAD_TEST["endpoints"])})')
+    load.add_argument('--concurrency', type=int, default=LOAD_TEST['concurrency'],
+                      help=f'Concurrent workers (default: {LOAD_TEST["concurrency"]})')
+    load.add_argument('--requests', type=int, dest='requests_count',
+                      help='Stop after this many measured requests instead of after --duration')
+    load.add_argument('--duration', type=float, default=LOAD_TEST['duration'],
+                      help=f'Measured seconds (default: {LOAD_TEST["duration"]})')
+    load.add_argument('--rps', type=float, default=LOAD_TEST['rps'],
+                      help='Send at this fixed rate (open loop) instead of back to back')
+    load.add_argument('--warmup', type=float, default=LOAD_TEST['warmup'],
+                      help=f'Seconds of unmeasured requests first (default: {LOAD_TEST["warmup"]})')
+    load.add_argument('--timeout', type=float, default=LOAD_TEST['timeout'],
+                      help=f'Per-request timeout in seconds (default: {LOAD_TEST["timeout"]})')
     
-    return parser.parse_args()
+    workload = parser.add_argument_group('workload options (--test workload and --test replay)')
+    workload.add_argument('--workload-source', choices=['csv', 'db'], default='csv',
+                          help='Where the rating and theme distributions come from (default: csv)')
+    workload.add_argument('--csv', type=str,
+                          help='Lichess puzzle CSV, for --workload-source csv')
+    workload.add_argument('--sample-rows', type=int,
+                          help='Only read the first rows of the CSV')
+    workload.add_argument('--seed', type=int,
+                          help='Random seed, to send the same sequence of queries again')
+    workload.add_argument('--access-log', type=str,
+                          help='Access log (common or combined format) to replay, for --test replay')
+    workload.add_argument('--speed', type=float, default=1.0,
+                          help='Replay speed, 2 replays twice as fast as recorded (default: 1)')
+    
+    baseline = parser.add_argument_group('baselines (--test load, workload or replay)')
+    baseline.add_argument('--save-baseline', metavar='PATH',
+                          help='Save the load test results as a JSON baseline')
+    baseline.add_argument('--compare', metavar='PATH',
+                          help='Compare the load test against a saved baseline, exit with status 1 on regressions')
+    baseline.add_argument('--max-latency-increase', type=float, default=REGRESSION_THRESHOLDS['latency'],
+                          help=f'Allowed p50/p90/p99 increase in percent (default: {REGRESSION_THRESHOLDS["latency"]})')
+    baseline.add_argument('--max-throughput-drop', type=float, default=REGRESSION_THRESHOLDS['throughput'],
+                          help=f'Allowed throughput drop in percent (default: {REGRESSION_THRESHOLDS["throughput"]})')
+    baseline.add_argument('--max-error-increase', type=float, default=REGRESSION_THRESHOLDS['error_rate'],
+                          help=f'Allowed error and timeout rate increase in percentage points '
+                               f'(default: {REGRESSION_THRESHOLDS["error_rate"]})')
+    
+    args = parser.parse_args()
+    if (args.save_baseline or args.compare) and args.test not in LOAD_TESTS:
+        parser.error('--save-baseline and --compare require --test load, workload or replay')
+    if args.test == 'workload' and args.workload_source == 'csv' and not args.csv:
+        parser.error('--test workload with --workload-source csv requires --csv')
+    if args.test == 'replay' and not args.access_log:
+        parser.error('--test replay requires --access-log')
+    return args
 
 if __name__ == "__main__":
     args = parse_args()
+    COLD_CONNECTIONS = args.cold
     logging.info("===== API Tester Starting =====")
     
     # Check server connectivity first
@@ -318,4 +468,45 @@ if __name__ == "__main__":
         perf_params['iterations'] = args.iterations
         run_performance_test('by-themes', **perf_params)
     
-    logging.info("===== API Tester Completed =====") 
\ No newline at end of file
+    # Load tests, only on request since they send many requests
+    results = None
+    if args.test == 'load':
+        logging.info("\n----- Load Test -----")
+        endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+        results = run_load_test(endpoints, themes, args.min_rating, args.max_rating,
+                                concurrency=args.concurrency, requests_count=args.requests_count,
+                                duration=args.duration, rps=args.rps, warmup=args.warmup, timeout=args.timeout,
+                                cold=args.cold)
+    
+    if args.test == 'workload':
+        logging.info("\n----- Workload Test -----")
+        results = run_workload_test(args.workload_source, args.csv, args.sample_rows, args.seed,
+                                    concurrency=args.concurrency, requests_count=args.requests_count,
+                                    duration=args.duration, rps=args.rps, warmup=args.warmup, timeout=args.timeout,
+                                    cold=args.cold)
+    
+    if args.test == 'replay':
+        logging.info("\n----- Access Log Replay -----")
+        results = run_replay_test(args.access_log, args.speed, concurrency=args.concurrency, timeout=args.timeout,
+                                  cold=args.cold)
+    
+    regressions = []
+    if results:
+        if args.compare:
+            thresholds = {
+                'latency': args.max_latency_increase,
+                'throughput': args.max_throughput_drop,
+                'error_rate': args.max_error_increase
+            }
+            baseline = load_baseline(args.compare)
+            regressions = compare_results(baseline, results, thresholds)
+            log_comparison(baseline, results, regressions)
+        
+        if args.save_baseline:
+            save_baseline(args.save_baseline, results)
+    
+    logging.info("===== API Tester Completed =====")
+    
+    # Non-zero exit status so a release can be gated on the comparison
+    if regressions:
+        sys.exit(1) 
\ No newline at end of file
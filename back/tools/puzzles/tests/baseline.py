@@ -0,0 +1,109 @@
+"""
+Benchmark baselines for the Chess Puzzle API load test
+
+A baseline is the JSON results of a load test run together with the git
+commit and time it was taken at. A later run is compared endpoint by endpoint
+against it, and any metric worse than its threshold is a regression.
+"""
+
+import os
+import json
+import logging
+import subprocess
+from datetime import datetime, timezone
+
+# Percentiles compared against the baseline
+LATENCY_METRICS = ['p50', 'p90', 'p99']
+
+def git_sha():
+    """Commit the tester runs from, None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_baseline(path, results):
+    """Write the results of a run as a baseline, atomically."""
+    baseline = dict(results, git_sha=git_sha(), timestamp=datetime.now(timezone.utc).isoformat())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(tmp_path, path)
+    logging.info(f"Baseline saved to {path}")
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare_results(baseline, results, thresholds):
+    """Compare a run against a baseline.
+
+    `thresholds` has 'latency' and 'throughput' as allowed relative changes
+    in percent, and 'error_rate' as allowed increase in percentage points.
+    Returns a list of (endpoint, metric, baseline value, current value, change)
+    for every regression.
+    """
+    regressions = []
+    for endpoint, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(endpoint)
+        if previous is None:
+            logging.warning(f"  - {endpoint}: not in the baseline, skipped")
+            continue
+
+        for metric in LATENCY_METRICS:
+            change = relative_change(previous[metric], current[metric])
+            if change > thresholds['latency']:
+                regressions.append((endpoint, metric, previous[metric], current[metric], f"+{change:.1f}%"))
+
+        change = relative_change(previous['throughput'], current['throughput'])
+        if -change > thresholds['throughput']:
+            regressions.append((endpoint, 'throughput', previous['throughput'], current['throughput'],
+                                f"{change:.1f}%"))
+
+        for metric in ('error_rate', 'timeout_rate'):
+            change = current[metric] - previous[metric]
+            if change > thresholds['error_rate']:
+                regressions.append((endpoint, metric, previous[metric], current[metric], f"+{change:.1f} pts"))
+
+    for endpoint in baseline['endpoints']:
+        if endpoint not in results['endpoints']:
+            logging.warning(f"  - {endpoint}: in the baseline but not in this run")
+    return regressions
+
+def relative_change(previous, current):
+    """Change from `previous` to `current` in percent, 0 when there is nothing to compare to."""
+    if not previous:
+        return 0.0
+    return (current - previous) / previous * 100
+
+def log_comparison(baseline, results, regressions):
+    """Log the run next to the baseline, and every regression."""
+    logging.info(f"Comparison against baseline from {baseline.get('timestamp')} (commit {baseline.get('git_sha')}):")
+
+    for key in ('mode', 'connections', 'concurrency', 'rps', 'params'):
+        if baseline.get(key) != results.get(key):
+            logging.warning(f"  {key} differs from the baseline ({baseline.get(key)} vs {results.get(key)}), "
+                            f"the comparison may not be meaningful")
+
+    width = max((len(endpoint) for endpoint in results['endpoints']), default=0)
+    for endpoint, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(endpoint)
+        if previous is None:
+            continue
+        logging.info(
+            f"  - {endpoint:<{width}} "
+            + "  ".join(f"{m} {previous[m]:.1f} -> {current[m]:.1f} ms" for m in LATENCY_METRICS)
+            + f"  throughput {previous['throughput']:.1f} -> {current['throughput']:.1f} req/s"
+            + f"  errors {previous['error_rate']:.1f} -> {current['error_rate']:.1f}%"
+        )
+
+    if regressions:
+        logging.error(f"{len(regressions)} regressions against the baseline:")
+        for endpoint, metric, previous, current, change in regressions:
+            logging.error(f"  - {endpoint} {metric}: {previous:.2f} -> {current:.2f} ({change})")
+    else:
+        logging.info("No regressions against the baseline")
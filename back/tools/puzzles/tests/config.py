@@ -32,4 +32,48 @@ PERFORMANCE_TEST = {
         "page": 1,
         "limit": 20
     }
-} 
\ No newline at end of file
+}
+
+# Load test settings (--test load)
+LOAD_TEST = {
+    "endpoints": ["random", "by-themes"],
+    "concurrency": 10,      # Workers, i.e. the maximum number of requests in flight
+    "duration": 30,         # Measured seconds, unless --requests is given
+    "rps": None,            # Fixed request rate (open loop); None sends back to back (closed loop)
+    "warmup": 5,            # Seconds of requests sent before measuring
+    "timeout": 10           # Per-request timeout in seconds
+}
+
+# Regression thresholds for --compare
+REGRESSION_THRESHOLDS = {
+    "latency": 20.0,        # Allowed p50/p90/p99 increase, in percent
+    "throughput": 10.0,     # Allowed throughput drop, in percent
+    "error_rate": 1.0       # Allowed error and timeout rate increase, in percentage points
+}
+
+# Generated workload (--test workload)
+WORKLOAD = {
+    # Share of each kind of query: endpoint, then the number of themes after a colon
+    "mix": {
+        "random": 40,
+        "random:1": 25,
+        "random:2": 5,
+        "by-themes:1": 20,
+        "by-themes:2": 10
+    },
+    # Share of each rating band width, bands are centred on a real puzzle rating
+    "band_widths": {
+        200: 50,
+        400: 30,
+        1000: 15,
+        3500: 5
+    }
+}
+
+# Database read by --workload-source db (same as the import tools)
+DATABASE = {
+    "host": "localhost",
+    "database": "eptrainingapp",
+    "user": "root",
+    "password": ""
+}
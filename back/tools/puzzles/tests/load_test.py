@@ -0,0 +1,425 @@
+"""
+Concurrent load generation for the Chess Puzzle API
+
+Requests are sent either closed-loop, by a fixed number of workers that each
+send the next request as soon as the previous one completes, or open-loop at
+a fixed rate or recorded times regardless of how fast the server answers.
+Latencies are recorded per endpoint or query class in constant-memory
+histograms, split into connect, time to first byte and download, along with
+response sizes and the Server-Timing metrics reported by the server.
+
+Each worker thread keeps its connection alive across requests, like a real
+client would; a cold run opens a new connection for every request instead.
+"""
+
+import math
+import time
+import itertools
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+PHASES = ['connect', 'ttfb', 'download']
+
+class LatencyHistogram:
+    """Latency histogram with a bounded relative error, in the spirit of HdrHistogram.
+
+    Values are recorded in microseconds into buckets whose width doubles with
+    each power of two, split into 2 ** SUB_BUCKET_BITS sub-buckets, so every
+    percentile is within 1 / 2 ** (SUB_BUCKET_BITS - 1) of the exact value.
+    """
+
+    SUB_BUCKET_BITS = 7  # Under 1.6% error
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        value = max(1, int(seconds * 1_000_000))
+        shift = max(0, value.bit_length() - self.SUB_BUCKET_BITS)
+        index = (shift << self.SUB_BUCKET_BITS) + (value >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _bucket_value(self, index):
+        """Highest value recorded into bucket `index`."""
+        shift = index >> self.SUB_BUCKET_BITS
+        sub_bucket = index & ((1 << self.SUB_BUCKET_BITS) - 1)
+        return ((sub_bucket + 1) << shift) - 1
+
+    def percentile(self, percent):
+        """Return the `percent` percentile in milliseconds, 0 for an empty histogram."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._bucket_value(index), self.max) / 1000
+        return self.max / 1000
+
+    def mean(self):
+        return self.total / self.count / 1000 if self.count else 0.0
+
+# Outcome of one request. Times in seconds: connect (TCP and TLS, 0 on a reused
+# connection), ttfb (request sent to response headers) and download (body).
+Sample = namedtuple('Sample', ['status', 'timed_out', 'connect', 'ttfb', 'download', 'size', 'server_timing'])
+
+_connect_time = threading.local()
+
+class _TimedConnectionMixin:
+    """Add the time spent opening the connection to the calling thread's total."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_time.total = getattr(_connect_time, 'total', 0.0) + time.perf_counter() - start
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedAdapter(HTTPAdapter):
+    """Transport adapter whose connections report how long they took to open."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+def timed_session():
+    """Return a requests session that keeps connections alive and times their setup."""
+    session = requests.Session()
+    adapter = TimedAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def parse_server_timing(header):
+    """Parse a Server-Timing header into {metric: duration in ms}, metrics without dur are left out."""
+    metrics = {}
+    for entry in (header or '').split(','):
+        name, *attributes = [part.strip() for part in entry.split(';')]
+        for attribute in attributes:
+            key, _, value = attribute.partition('=')
+            if name and key.strip() == 'dur':
+                try:
+                    metrics[name] = float(value.strip('"'))
+                except ValueError:
+                    pass
+    return metrics
+
+def timed_get(session, url, params=None, timeout=10):
+    """Send a GET request on `session` and return (response, Sample), the body already downloaded.
+
+    Raises the requests exceptions, like requests.get.
+    """
+    _connect_time.total = 0.0
+    start = time.perf_counter()
+    response = session.get(url, params=params, timeout=timeout, stream=True)
+    headers_received = time.perf_counter()
+    content = response.content
+    done = time.perf_counter()
+
+    connect = _connect_time.total
+    sample = Sample(
+        status=response.status_code,
+        timed_out=False,
+        connect=connect,
+        ttfb=max(0.0, headers_received - start - connect),
+        download=done - headers_received,
+        size=len(content),
+        server_timing=parse_server_timing(response.headers.get('Server-Timing'))
+    )
+    return response, sample
+
+def send_request(session, url, params, timeout):
+    """Send one GET request and return its Sample, with a None status if it failed."""
+    try:
+        return timed_get(session, url, params, timeout)[1]
+    except requests.exceptions.Timeout:
+        return Sample(None, True, 0.0, 0.0, 0.0, 0, {})
+    except requests.exceptions.RequestException:
+        return Sample(None, False, 0.0, 0.0, 0.0, 0, {})
+
+class EndpointStats:
+    """Outcome counts, latencies and response sizes of the requests sent to one endpoint."""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.phases = {phase: LatencyHistogram() for phase in PHASES}
+        self.server_timing = {}
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.new_connections = 0
+        self.bytes = 0
+        self.max_bytes = 0
+        self.status_codes = {}
+
+    def record(self, elapsed, sample):
+        self.requests += 1
+        if sample.timed_out:
+            self.timeouts += 1
+            return
+        if sample.status is None or sample.status >= 400:
+            self.errors += 1
+        # Only answered requests have a meaningful latency
+        if sample.status is None:
+            return
+
+        self.status_codes[sample.status] = self.status_codes.get(sample.status, 0) + 1
+        self.latency.record(elapsed)
+        for phase in PHASES:
+            self.phases[phase].record(getattr(sample, phase))
+        for metric, duration in sample.server_timing.items():
+            self.server_timing.setdefault(metric, LatencyHistogram()).record(duration / 1000)
+        if sample.connect > 0:
+            self.new_connections += 1
+        self.bytes += sample.size
+        self.max_bytes = max(self.max_bytes, sample.size)
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        for phase in PHASES:
+            self.phases[phase].merge(other.phases[phase])
+        for metric, histogram in other.server_timing.items():
+            self.server_timing.setdefault(metric, LatencyHistogram()).merge(histogram)
+        self.requests += other.requests
+        self.errors += other.errors
+        self.timeouts += other.timeouts
+        self.new_connections += other.new_connections
+        self.bytes += other.bytes
+        self.max_bytes = max(self.max_bytes, other.max_bytes)
+        for status, count in other.status_codes.items():
+            self.status_codes[status] = self.status_codes.get(status, 0) + count
+
+    def summary(self, duration):
+        """Return the stats as a JSON-serializable dict, latencies in milliseconds."""
+        def percentiles(histogram):
+            return {'p50': histogram.percentile(50), 'p90': histogram.percentile(90),
+                    'p99': histogram.percentile(99), 'max': histogram.max / 1000}
+
+        answered = self.latency.count
+        return {
+            'requests': self.requests,
+            'throughput': self.requests / duration if duration > 0 else 0.0,
+            'mean': self.latency.mean(),
+            'p50': self.latency.percentile(50),
+            'p90': self.latency.percentile(90),
+            'p99': self.latency.percentile(99),
+            'max': self.latency.max / 1000,
+            'error_rate': self.errors / self.requests * 100 if self.requests else 0.0,
+            'timeout_rate': self.timeouts / self.requests * 100 if self.requests else 0.0,
+            'status_codes': {str(status): count for status, count in sorted(self.status_codes.items())},
+            'phases': {phase: percentiles(self.phases[phase]) for phase in PHASES},
+            'new_connection_rate': self.new_connections / answered * 100 if answered else 0.0,
+            'response_bytes': {'mean': self.bytes / answered if answered else 0.0, 'max': self.max_bytes},
+            'server_timing': {metric: percentiles(h) for metric, h in sorted(self.server_timing.items())}
+        }
+
+class LoadTest:
+    """Send the requests produced by `next_request` and collect per-endpoint stats.
+
+    `next_request()` returns an (endpoint name, url, params) tuple for every
+    request to send. Without `rps` the test is closed-loop: `concurrency`
+    workers send back to back. With `rps` it is open-loop: requests are
+    scheduled at a fixed rate and their latency is measured from the
+    scheduled time, so a slow server is not hidden by the test slowing down
+    (coordinated omission). `arrivals`, an iterable of send times in seconds
+    from the start, schedules them at given times instead, e.g. to replay a
+    log. Results of requests scheduled during the first `warmup` seconds are
+    discarded. The test ends after `total_requests` measured requests or
+    `duration` seconds, whichever comes first, or when `arrivals` runs out.
+    """
+
+    def __init__(self, next_request, concurrency=10, total_requests=None, duration=None, rps=None,
+                 warmup=0, timeout=10, arrivals=None, cold=False):
+        if total_requests is None and duration is None:
+            raise ValueError("Either total_requests or duration must be set")
+        self.next_request = next_request
+        self.concurrency = concurrency
+        self.total_requests = total_requests
+        self.duration = duration
+        self.rps = rps
+        self.arrivals = arrivals
+        self.warmup = warmup
+        self.timeout = timeout
+        self.cold = cold
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {}
+        self.sent = 0
+        self.late_starts = 0
+        self.start_time = None
+        self.measure_start = None
+        self.end_time = None
+
+    def _claim(self):
+        """Reserve the next request slot; returns (request, measured) or None when the test is over."""
+        with self.lock:
+            now = time.perf_counter()
+            measured = now >= self.measure_start
+            if measured:
+                if self.total_requests is not None and self.sent >= self.total_requests:
+                    return None
+                if self.duration is not None and now - self.measure_start >= self.duration:
+                    return None
+                self.sent += 1
+            return self.next_request(), measured
+
+    def _session(self):
+        """Session of the calling worker thread, or a fresh one per request for a cold run."""
+        if self.cold:
+            return timed_session()
+        if not hasattr(self.local, 'session'):
+            self.local.session = timed_session()
+        return self.local.session
+
+    def _execute(self, request, measured, scheduled=None):
+        name, url, params = request
+        session = self._session()
+        start = time.perf_counter()
+        try:
+            sample = send_request(session, url, params, self.timeout)
+        finally:
+            if self.cold:
+                session.close()
+        elapsed = time.perf_counter() - (scheduled if scheduled is not None else start)
+        if measured:
+            with self.lock:
+                self.stats.setdefault(name, EndpointStats()).record(elapsed, sample)
+
+    def _closed_loop_worker(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                return
+            self._execute(*claimed)
+
+    def _run_closed_loop(self):
+        workers = [threading.Thread(target=self._closed_loop_worker, daemon=True) for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def _run_open_loop(self, arrivals):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = threading.Semaphore(self.concurrency)
+            for offset in arrivals:
+                scheduled = self.start_time + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                claimed = self._claim()
+                if claimed is None:
+                    break
+                # Every worker busy: the request leaves late, its latency still counts from `scheduled`
+                if not in_flight.acquire(blocking=False):
+                    self.late_starts += 1
+                    in_flight.acquire()
+
+                def task(request=claimed[0], measured=claimed[1], at=scheduled):
+                    try:
+                        self._execute(request, measured, at)
+                    finally:
+                        in_flight.release()
+
+                pool.submit(task)
+
+    def run(self):
+        """Run the test and return its results as a JSON-serializable dict."""
+        self.start_time = time.perf_counter()
+        self.measure_start = self.start_time + self.warmup
+        if self.arrivals is not None:
+            self._run_open_loop(self.arrivals)
+        elif self.rps:
+            self._run_open_loop(i / self.rps for i in itertools.count())
+        else:
+            self._run_closed_loop()
+        self.end_time = time.perf_counter()
+        return self.results()
+
+    def results(self):
+        duration = self.end_time - self.measure_start
+        overall = EndpointStats()
+        for stats in self.stats.values():
+            overall.merge(stats)
+        return {
+            'mode': 'replay' if self.arrivals is not None else 'open-loop' if self.rps else 'closed-loop',
+            'connections': 'cold' if self.cold else 'keep-alive',
+            'concurrency': self.concurrency,
+            'rps': self.rps,
+            'warmup': self.warmup,
+            'timeout': self.timeout,
+            'duration': duration,
+            'late_starts': self.late_starts,
+            'endpoints': {name: stats.summary(duration) for name, stats in sorted(self.stats.items())},
+            'overall': overall.summary(duration)
+        }
+
+def log_results(results):
+    """Log one line of percentiles and error rates per endpoint."""
+    logging.info(f"Load test completed ({results['mode']}, {results['connections']} connections, "
+                 f"concurrency {results['concurrency']}"
+                 + (f", target {results['rps']} req/s" if results['rps'] else '')
+                 + f", {results['duration']:.1f} s measured):")
+    rows = list(results['endpoints'].items()) + [('overall', results['overall'])]
+    width = max(len(name) for name, _ in rows)
+    for name, summary in rows:
+        logging.info(
+            f"  - {name:<{width}} {summary['requests']:>7} req  {summary['throughput']:>7.1f} req/s  "
+            f"p50 {summary['p50']:>8.1f} ms  p90 {summary['p90']:>8.1f} ms  "
+            f"p99 {summary['p99']:>8.1f} ms  max {summary['max']:>8.1f} ms  "
+            f"errors {summary['error_rate']:.1f}%  timeouts {summary['timeout_rate']:.1f}%"
+        )
+        phases = summary['phases']
+        logging.info(
+            f"    {'':<{width}} connect p50/p99 {phases['connect']['p50']:.1f}/{phases['connect']['p99']:.1f} ms"
+            f" ({summary['new_connection_rate']:.0f}% new)  "
+            f"first byte {phases['ttfb']['p50']:.1f}/{phases['ttfb']['p99']:.1f} ms  "
+            f"download {phases['download']['p50']:.1f}/{phases['download']['p99']:.1f} ms  "
+            f"size {summary['response_bytes']['mean'] / 1024:.1f} KB avg, "
+            f"{summary['response_bytes']['max'] / 1024:.1f} KB max"
+            + ''.join(f"  {metric} {timing['p50']:.1f}/{timing['p99']:.1f} ms"
+                      for metric, timing in summary['server_timing'].items())
+        )
+    if results['late_starts']:
+        logging.warning(f"  {results['late_starts']} requests started late because all {results['concurrency']} "
+                        f"workers were busy; raise --concurrency to sustain the target rate")
@@ -0,0 +1,149 @@
+"""
+Regression checks for sync_puzzles.py against an in-memory stand-in of the puzzle tables.
+
+Only the statements the sync issues are understood: puzzle upserts, theme and
+puzzle_theme writes, the theme mask updates of theme_mask.write_masks and the
+generation bumps and change log entries of change_log.
+"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync_puzzles
+from change_log import DATA, LOG_TABLE, STATE_TABLE
+from theme_mask import MASK_TABLE
+
+HEADER = 'PuzzleId,FEN,Moves,Rating,RatingDeviation,Popularity,NbPlays,Themes,GameUrl,OpeningTags'
+ROW = 'AbCd1,4n3/KP1N4/k7/8/8/8/1R6/5P2 b - - 5 19,g2f1 e8c4,1798,104,80,153,{themes},https://lichess.org/8demAbCd#37,'
+
+class FakeDatabase:
+    """puzzle, theme and puzzle_theme as Python containers, behind a connection-like interface."""
+
+    def __init__(self, themes):
+        self.themes = dict(themes)  # id -> (name, bit_position)
+        self.puzzles = {}  # id -> theme_mask
+        self.relations = set()  # (puzzle_id, theme_id)
+        self.staged_masks = {}
+        self.state = {}  # name -> generation
+        self.logged = set()  # (generation, puzzle_id)
+        self.rowcount = 0
+        self.result = []
+
+    def cursor(self, **kwargs):
+        return self
+
+    def execute(self, query, params=None):
+        query = ' '.join(query.split())
+        self.result = []
+        if query.startswith('SELECT id, name FROM theme'):
+            self.result = [(theme_id, name) for theme_id, (name, _) in self.themes.items()]
+        elif query.startswith('SELECT id, bit_position FROM theme'):
+            self.result = [(theme_id, bit) for theme_id, (_, bit) in self.themes.items() if bit is not None]
+        elif 'information_schema.COLUMNS' in query:
+            self.result = [(1,)]
+        elif query.startswith('DELETE FROM puzzle_theme WHERE puzzle_id IN'):
+            self.relations = {(p, t) for p, t in self.relations if p not in params}
+        elif query.startswith(f'TRUNCATE TABLE {MASK_TABLE}'):
+            self.staged_masks = {}
+        elif query.startswith(f'UPDATE puzzle p JOIN {MASK_TABLE}'):
+            assert 'p.theme_mask | m.theme_mask' not in query
+            changed = {i: m for i, m in self.staged_masks.items() if i in self.puzzles and self.puzzles[i] != m}
+            self.puzzles.update(changed)
+            self.rowcount = len(changed)
+        elif query.startswith(f'INSERT INTO {STATE_TABLE}'):
+            name, generation = (params[0], self.state.get(DATA, 0) + 1) if len(params) == 1 else params
+            self.state[name] = max(generation, self.state.get(name, 0))
+        elif query.startswith(f'SELECT generation FROM {STATE_TABLE}'):
+            self.result = [(self.state[params[0]],)] if params[0] in self.state else []
+        elif not re.match(r'(SET|CREATE TEMPORARY TABLE|CREATE TABLE IF NOT EXISTS)', query):
+            raise AssertionError(f"Unexpected query: {query}")
+
+    def executemany(self, query, rows):
+        query = ' '.join(query.split())
+        rows = list(rows)
+        if query.startswith('INSERT INTO puzzle '):
+            for row in rows:
+                self.puzzles.setdefault(row[0], 0)
+        elif query.startswith('INSERT IGNORE INTO theme '):
+            for (name,) in rows:
+                if name not in (n for n, _ in self.themes.values()):
+                    self.themes[max(self.themes, default=0) + 1] = (name, None)
+        elif query.startswith('INSERT IGNORE INTO puzzle_theme '):
+            self.relations.update((p, int(t)) for p, t in rows)
+        elif query.startswith(f'INSERT IGNORE INTO {LOG_TABLE} '):
+            self.logged.update(rows)
+        elif query.startswith(f'INSERT IGNORE INTO {MASK_TABLE} '):
+            self.staged_masks.update((i, int(m)) for i, m in rows)
+        else:
+            raise AssertionError(f"Unexpected query: {query}")
+        self.rowcount = len(rows)
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def write_csv(path, themes):
+    path.write_text(f"{HEADER}\n{ROW.format(themes=themes)}\n")
+    return str(path)
+
+def test_first_sync_replaces_the_themes_of_puzzles_already_in_the_database(tmp_path, monkeypatch):
+    db = FakeDatabase({1: ('fork', 0), 2: ('pin', 1)})
+    db.puzzles['AbCd1'] = 0b11
+    db.relations = {('AbCd1', 1), ('AbCd1', 2)}
+    monkeypatch.setattr(sync_puzzles, 'create_connection', lambda: db)
+
+    # No manifest: the puzzle counts as new, yet its stored links must not survive
+    sync_puzzles.sync_puzzles(write_csv(tmp_path / 'puzzles.csv', 'fork'), manifest_path=str(tmp_path / 'manifest.npz'),
+                              quarantine_path=str(tmp_path / 'quarantine.csv'))
+
+    assert db.relations == {('AbCd1', 1)}
+    assert db.puzzles['AbCd1'] == 0b01
+    # Before the first write and after the last one
+    assert db.state[DATA] == 2
+
+def test_second_sync_rewrites_changed_themes_only(tmp_path, monkeypatch):
+    db = FakeDatabase({1: ('fork', 0), 2: ('pin', 1)})
+    monkeypatch.setattr(sync_puzzles, 'create_connection', lambda: db)
+    manifest = str(tmp_path / 'manifest.npz')
+    quarantine = str(tmp_path / 'quarantine.csv')
+
+    sync_puzzles.sync_puzzles(write_csv(tmp_path / 'a.csv', 'fork pin'), manifest_path=manifest,
+                              quarantine_path=quarantine)
+    assert db.relations == {('AbCd1', 1), ('AbCd1', 2)}
+    assert db.puzzles['AbCd1'] == 0b11
+
+    sync_puzzles.sync_puzzles(write_csv(tmp_path / 'b.csv', 'pin'), manifest_path=manifest,
+                              quarantine_path=quarantine)
+    assert db.relations == {('AbCd1', 2)}
+    assert db.puzzles['AbCd1'] == 0b10
+
+def test_sync_logs_the_puzzles_it_writes_once_the_sampling_index_is_built(tmp_path, monkeypatch):
+    db = FakeDatabase({1: ('fork', 0), 2: ('pin', 1)})
+    db.state['puzzle_sample'] = 0
+    monkeypatch.setattr(sync_puzzles, 'create_connection', lambda: db)
+    manifest = str(tmp_path / 'manifest.npz')
+    quarantine = str(tmp_path / 'quarantine.csv')
+
+    sync_puzzles.sync_puzzles(write_csv(tmp_path / 'a.csv', 'fork'), manifest_path=manifest,
+                              quarantine_path=quarantine)
+    assert db.logged == {(1, 'AbCd1')}
+
+    # Unchanged on the second sync, nothing to write or log
+    sync_puzzles.sync_puzzles(write_csv(tmp_path / 'b.csv', 'fork'), manifest_path=manifest,
+                              quarantine_path=quarantine)
+    assert db.logged == {(1, 'AbCd1')}
+    assert db.state[DATA] == 2
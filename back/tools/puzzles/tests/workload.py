@@ -0,0 +1,192 @@
+"""
+Realistic workloads for the Chess Puzzle API load test
+
+Two sources of requests:
+- a generated mix, where rating bands and themes are drawn from the real
+  rating and theme distributions of the Lichess CSV or of the database, and
+  the share of each kind of query comes from WORKLOAD['mix'] in config.py
+- a recorded access log (common or combined log format), replayed with the
+  original spacing between requests, optionally sped up or slowed down
+
+Every request is tagged with a query class such as "by-themes/2+ themes/wide"
+so results are reported per class.
+"""
+
+import re
+import random
+import logging
+import bisect
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qsl
+from config import API_BASE_URL, WORKLOAD, DATABASE
+
+# Widest rating range accepted by the API
+MIN_RATING = 0
+MAX_RATING = 3500
+
+# "GET /api/puzzles/random?min_rating=1200 HTTP/1.1" with its [10/Oct/2026:13:55:36 +0000] timestamp
+LOG_LINE = re.compile(r'\[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<target>\S+) [^"]*"')
+LOG_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+def classify(endpoint, params):
+    """Query class of a request, grouping requests expected to cost about the same."""
+    if endpoint not in ('random', 'by-themes'):
+        return endpoint
+
+    themes = [t for t in params.get('themes', '').split(',') if t.strip()]
+    theme_class = 'no theme' if not themes else '1 theme' if len(themes) == 1 else '2+ themes'
+
+    try:
+        width = int(params.get('max_rating', 3000)) - int(params.get('min_rating', 0))
+    except ValueError:
+        width = MAX_RATING
+    band_class = 'narrow' if width <= 200 else 'medium' if width <= 600 else 'wide'
+
+    name = f"{endpoint}/{theme_class}/{band_class}"
+    if endpoint == 'by-themes' and str(params.get('page', 1)) not in ('', '0', '1'):
+        name += '/deep page'
+    return name
+
+class Distribution:
+    """Weighted random choice over values."""
+
+    def __init__(self, weights):
+        self.values = list(weights)
+        total = 0
+        self.cumulative = []
+        for value in self.values:
+            total += weights[value]
+            self.cumulative.append(total)
+        self.total = total
+
+    def __bool__(self):
+        return self.total > 0
+
+    def sample(self, rng):
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.total)]
+
+def distributions_from_csv(path, sample_rows=None):
+    """Return (rating counts, theme counts) read from the Lichess puzzle CSV."""
+    import pandas as pd
+
+    ratings = Counter()
+    themes = Counter()
+    for chunk in pd.read_csv(path, usecols=['Rating', 'Themes'], chunksize=100000, nrows=sample_rows,
+                             dtype={'Themes': str}, keep_default_na=False):
+        ratings.update(pd.to_numeric(chunk['Rating'], errors='coerce').dropna().astype(int).tolist())
+        themes.update(chunk['Themes'].str.split().explode().dropna().tolist())
+    return ratings, themes
+
+def distributions_from_db():
+    """Return (rating counts, theme counts) from the puzzle database."""
+    import mysql.connector
+
+    connection = mysql.connector.connect(**DATABASE)
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT rating, COUNT(*) FROM puzzle GROUP BY rating")
+        ratings = Counter(dict(cursor.fetchall()))
+        cursor.execute("""
+            SELECT t.name, COUNT(*)
+            FROM puzzle_theme pt
+            JOIN theme t ON t.id = pt.theme_id
+            GROUP BY t.name
+        """)
+        themes = Counter(dict(cursor.fetchall()))
+    finally:
+        cursor.close()
+        connection.close()
+    return ratings, themes
+
+class WorkloadGenerator:
+    """Produce (query class, url, params) requests following the configured query mix.
+
+    Rating bands are centred on a rating drawn from the puzzle ratings, and
+    themes are drawn by how many puzzles have them.
+    """
+
+    def __init__(self, ratings, themes, mix=None, band_widths=None, seed=None):
+        self.ratings = Distribution(ratings)
+        self.themes = Distribution(themes)
+        self.mix = Distribution(mix or WORKLOAD['mix'])
+        self.band_widths = Distribution(band_widths or WORKLOAD['band_widths'])
+        self.rng = random.Random(seed)
+        if not self.ratings or not self.themes:
+            raise ValueError("The workload source has no ratings or no themes")
+
+    def _band(self):
+        center = self.ratings.sample(self.rng)
+        half_width = self.band_widths.sample(self.rng) // 2
+        return max(MIN_RATING, center - half_width), min(MAX_RATING, center + half_width)
+
+    def _themes(self, count):
+        chosen = []
+        while len(chosen) < count:
+            theme = self.themes.sample(self.rng)
+            if theme not in chosen:
+                chosen.append(theme)
+        return chosen
+
+    def __call__(self):
+        kind = self.mix.sample(self.rng)
+        min_rating, max_rating = self._band()
+        params = {'min_rating': min_rating, 'max_rating': max_rating}
+
+        endpoint, _, theme_count = kind.partition(':')
+        theme_count = int(theme_count or 0)
+        if theme_count:
+            params['themes'] = ','.join(self._themes(min(theme_count, len(self.themes.values))))
+
+        if endpoint == 'by-themes':
+            # Most readers stay on the first pages
+            params['page'] = 1 if self.rng.random() < 0.8 else self.rng.randint(2, 10)
+            params['limit'] = 20
+
+        return classify(endpoint, params), f"{API_BASE_URL}/puzzles/{endpoint}", params
+
+def endpoint_of(path):
+    """Name of the puzzle endpoint a request path targets, None if it is not one."""
+    match = re.search(r'/puzzles/([^/?]+)$', path)
+    if not match:
+        return None
+    name = match.group(1)
+    return name if name in ('random', 'by-themes', 'related-themes') else 'puzzle'
+
+def read_access_log(path):
+    """Return [(seconds since the first request, query class, url, params)] for the puzzle API requests in a log."""
+    base = urlsplit(API_BASE_URL)
+    trace = []
+    skipped = 0
+
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = LOG_LINE.search(line)
+            if not match or match.group('method') != 'GET':
+                skipped += 1
+                continue
+            target = urlsplit(match.group('target'))
+            endpoint = endpoint_of(target.path)
+            if endpoint is None:
+                skipped += 1
+                continue
+            try:
+                timestamp = datetime.strptime(match.group('time'), LOG_TIME_FORMAT).timestamp()
+            except ValueError:
+                skipped += 1
+                continue
+
+            params = dict(parse_qsl(target.query))
+            # Same path on the server under test
+            url = f"{base.scheme}://{base.netloc}{target.path}"
+            trace.append((timestamp, classify(endpoint, params), url, params))
+
+    if skipped:
+        logging.info(f"Skipped {skipped} log lines that are not GET requests to the puzzle API")
+    if not trace:
+        return trace
+
+    # Logs are written at completion time, so lines can be slightly out of order
+    trace.sort(key=lambda entry: entry[0])
+    first = trace[0][0]
+    return [(timestamp - first,) + tuple(entry) for timestamp, *entry in trace]
@@ -0,0 +1,278 @@
+"""
+Per-puzzle theme bitmask.
+
+Every theme gets a stable bit position (theme.bit_position, assigned once and
+never reused), and puzzle.theme_mask holds the OR of the bits of the puzzle's
+themes. Theme filters then become bitwise predicates next to the rating, for
+example "fork AND NOT mate":
+
+    WHERE rating BETWEEN 1500 AND 1800
+      AND theme_mask & :fork = :fork AND theme_mask & :mate = 0
+
+Bits 0 to 62 are used so a mask always fits a signed 64-bit integer (PHP int).
+Themes beyond that get no bit and are only found through puzzle_theme.
+
+Run this module to (re)compute every mask; the import tools keep the masks of
+the puzzles they write in sync through sync_masks(). Only this module gives
+themes a bit, as it recomputes every mask at the same time: the API filters on
+masks as soon as every requested theme has a bit, so a bit handed out by a tool
+that only writes some puzzles would drop the others from theme searches.
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import mysql.connector
+from mysql.connector import Error
+from tqdm import tqdm
+from change_log import DataChanges
+from id_index import encode_ids, decode_ids, INVALID_KEY
+
+MAX_BITS = 63
+MASK_TABLE = 'puzzle_mask_update'
+
+def create_connection():
+    try:
+        connection = mysql.connector.connect(
+            host='localhost',
+            database='eptrainingapp',
+            user='root',
+            password=''
+        )
+        return connection
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        sys.exit(1)
+
+def has_mask_column(cursor):
+    """Whether the theme mask migration has been run on this database."""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'puzzle' AND COLUMN_NAME = 'theme_mask'
+    """)
+    return cursor.fetchone()[0] > 0
+
+def assign_bits(cursor):
+    """Give the themes without a bit the lowest free positions, in theme ID order.
+
+    Returns {theme_id: bit} for every theme that has one.
+    """
+    cursor.execute("SELECT id, bit_position FROM theme ORDER BY id")
+    rows = cursor.fetchall()
+    bits = {theme_id: bit for theme_id, bit in rows if bit is not None}
+
+    free = sorted(set(range(MAX_BITS)) - set(bits.values()))
+    missing = [theme_id for theme_id, bit in rows if bit is None]
+    new = list(zip(free, missing))
+    if new:
+        cursor.executemany("UPDATE theme SET bit_position = %s WHERE id = %s", new)
+        bits.update({theme_id: bit for bit, theme_id in new})
+
+    unassigned = len(rows) - len(bits)
+    if unassigned:
+        print(f"Warning: {unassigned} themes have no bit position left and are only filterable via puzzle_theme")
+    return bits
+
+def load_bits(cursor):
+    """Return {theme_id: bit} for the themes that have a bit, without assigning new ones."""
+    cursor.execute("SELECT id, bit_position FROM theme WHERE bit_position IS NOT NULL")
+    return {theme_id: bit for theme_id, bit in cursor.fetchall()}
+
+def bit_lookup(bits):
+    """Array mapping theme_id to its single-bit mask, 0 for themes without a bit."""
+    lookup = np.zeros(max(bits, default=0) + 1, dtype=np.uint64)
+    for theme_id, bit in bits.items():
+        lookup[theme_id] = np.uint64(1) << np.uint64(bit)
+    return lookup
+
+def puzzle_masks(ids, relations, bits):
+    """Compute the masks of `ids` from their complete list of (puzzle_id, theme_id) relations.
+
+    Puzzles without relations get 0. Returns a uint64 array aligned with `ids`.
+    """
+    masks = np.zeros(len(ids), dtype=np.uint64)
+    if not relations:
+        return masks
+
+    puzzle_ids, theme_ids = zip(*relations)
+    theme_ids = np.asarray(theme_ids, dtype=np.int64)
+    lookup = bit_lookup(bits)
+    known = theme_ids < len(lookup)
+
+    positions = pd.Index(ids).get_indexer(list(puzzle_ids))
+    valid = known & (positions >= 0)
+    np.bitwise_or.at(masks, positions[valid], lookup[theme_ids[valid]])
+    return masks
+
+def write_masks(cursor, ids, masks, merge=False):
+    """Set theme_mask for `ids` with one batched insert into a temporary table and one join update.
+
+    With `merge`, the masks are ORed into the stored ones instead of replacing them.
+    """
+    if len(ids) == 0:
+        return 0
+
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {MASK_TABLE} (
+            id VARCHAR(10) COLLATE utf8mb4_bin PRIMARY KEY,
+            theme_mask BIGINT UNSIGNED NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute(f"TRUNCATE TABLE {MASK_TABLE}")
+    cursor.executemany(
+        f"INSERT IGNORE INTO {MASK_TABLE} (id, theme_mask) VALUES (%s, %s)",
+        list(zip(ids, np.asarray(masks, dtype=np.uint64).tolist()))
+    )
+    cursor.execute(f"""
+        UPDATE puzzle p JOIN {MASK_TABLE} m ON m.id = p.id
+        SET p.theme_mask = {'p.theme_mask | m.theme_mask' if merge else 'm.theme_mask'}
+        WHERE p.theme_mask != {'p.theme_mask | m.theme_mask' if merge else 'm.theme_mask'}
+    """)
+    return cursor.rowcount
+
+def sync_masks(cursor, ids, relations, bits, merge=False):
+    """Recompute and write the masks of puzzles whose relations were just rewritten.
+
+    `relations` must be all the relations of `ids`, or with `merge` the ones
+    just added to them. Themes without a bit in `bits`, e.g. created since the
+    masks were built, are left out of the masks. Returns the number of puzzles
+    whose mask changed.
+    """
+    ids = list(dict.fromkeys(ids))
+    return write_masks(cursor, ids, puzzle_masks(ids, relations, bits), merge)
+
+def sync_masks_of(cursor, id_table):
+    """Recompute the masks of the puzzles listed in `id_table`.id from puzzle_theme, in one statement.
+
+    For puzzles written before their relations could be read back, e.g.
+    merged from a staging table. Returns the number of puzzles whose mask changed.
+    """
+    cursor.execute(f"""
+        UPDATE puzzle p
+        JOIN (
+            SELECT pt.puzzle_id, BIT_OR(1 << t.bit_position) AS theme_mask
+            FROM (SELECT DISTINCT id FROM {id_table}) i
+            JOIN puzzle_theme pt ON pt.puzzle_id = i.id
+            JOIN theme t ON t.id = pt.theme_id
+            WHERE t.bit_position IS NOT NULL
+            GROUP BY pt.puzzle_id
+        ) m ON m.puzzle_id = p.id
+        SET p.theme_mask = m.theme_mask
+        WHERE p.theme_mask != m.theme_mask
+    """)
+    return cursor.rowcount
+
+def compute_all_masks(connection, bits, fetch_size=100000):
+    """Stream puzzle_theme once and OR the bits of every relation into a mask per puzzle.
+
+    Returns (sorted packed puzzle IDs, their new masks, their current masks).
+    """
+    cursor = connection.cursor(buffered=False)
+    try:
+        keys, current = [], []
+        cursor.execute("SELECT id, theme_mask FROM puzzle")
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            ids, masks = zip(*rows)
+            keys.append(encode_ids(ids))
+            current.append(np.asarray(masks, dtype=np.uint64))
+    finally:
+        cursor.close()
+
+    keys = np.concatenate(keys) if keys else np.array([], dtype=np.uint64)
+    current = np.concatenate(current) if current else np.array([], dtype=np.uint64)
+    valid = keys != INVALID_KEY
+    if not valid.all():
+        print(f"Skipping {int((~valid).sum())} puzzles whose ID cannot be packed")
+    order = np.argsort(keys[valid])
+    keys, current = keys[valid][order], current[valid][order]
+
+    masks = np.zeros(len(keys), dtype=np.uint64)
+    if not len(keys):
+        return keys, masks, current
+    lookup = bit_lookup(bits)
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM puzzle_theme")
+    total = cursor.fetchone()[0]
+    cursor.close()
+
+    cursor = connection.cursor(buffered=False)
+    try:
+        cursor.execute("SELECT puzzle_id, theme_id FROM puzzle_theme")
+        with tqdm(total=total, desc="Reading puzzle_theme") as pbar:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                puzzle_ids, theme_ids = zip(*rows)
+                relation_keys = encode_ids(puzzle_ids)
+                theme_ids = np.asarray(theme_ids, dtype=np.int64)
+
+                positions = np.minimum(np.searchsorted(keys, relation_keys), len(keys) - 1)
+                found = (keys[positions] == relation_keys) & (theme_ids < len(lookup))
+                np.bitwise_or.at(masks, positions[found], lookup[theme_ids[found]])
+                pbar.update(len(rows))
+    finally:
+        cursor.close()
+
+    return keys, masks, current
+
+def build_theme_masks(batch_size=10000):
+    start_time = time.time()
+    connection = create_connection()
+    cursor = connection.cursor()
+    changes = DataChanges(connection)
+
+    try:
+        if not has_mask_column(cursor):
+            print("Error: puzzle.theme_mask does not exist, run the Doctrine migrations first")
+            return
+
+        cursor.execute('SET autocommit=0')
+
+        bits = assign_bits(cursor)
+        connection.commit()
+        print(f"{len(bits)} themes have a bit position")
+
+        keys, masks, current = compute_all_masks(connection, bits)
+        changed = np.flatnonzero(masks != current)
+        print(f"Computed masks for {len(keys):,} puzzles, {len(changed):,} differ from the stored ones")
+
+        if len(changed):
+            changes.begin()
+        updated = 0
+        for i in tqdm(range(0, len(changed), batch_size), desc="Writing masks"):
+            batch = changed[i:i + batch_size]
+            updated += write_masks(cursor, decode_ids(keys[batch]), masks[batch])
+            connection.commit()
+
+        print(f"\nPuzzles updated: {updated:,}")
+        print(f"Total time: {time.time() - start_time:.2f} seconds")
+
+    except Error as e:
+        print(f"Error while building theme masks: {e}")
+        connection.rollback()
+        sys.exit(1)
+
+    finally:
+        changes.end()
+        cursor.execute('SET autocommit=1')
+        cursor.close()
+        connection.close()
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Assign a bit to every theme and store the theme bitmask of every puzzle in puzzle.theme_mask')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Changed masks written per transaction (default: 10000)')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_theme_masks(batch_size=args.batch_size)
@@ -1,16 +1,36 @@
+import numpy as np
 import pandas as pd
 import mysql.connector
 from mysql.connector import Error
 import sys
+import argparse
 from tqdm import tqdm
 import warnings
-from collections import defaultdict
+from change_log import DataChanges
+from csv_stream import CsvStream
+from id_index import IdIndex, encode_ids, decode_ids, DEFAULT_CACHE
+from import_puzzles import COLUMN_MAP, REPORT_INTERVAL, csv_options, load_theme_map, theme_relations
+from pipeline import Pipeline, DEFAULT_DEPTH
+from theme_mask import has_mask_column, load_bits, sync_masks
+from metrics import StageMetrics
 
 # Silence pandas warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 warnings.simplefilter(action='ignore', category=UserWarning)
 pd.options.mode.chained_assignment = None  # default='warn'
 
+# Columns that can be refreshed from the CSV and their temporary table definition
+STAT_COLUMNS = {
+    'rating': 'SMALLINT',
+    'rating_deviation': 'SMALLINT',
+    'popularity': 'SMALLINT',
+    'nb_plays': 'INT'
+}
+REFRESHABLE_COLUMNS = ['themes'] + list(STAT_COLUMNS)
+
+# puzzle table column -> CSV header
+CSV_COLUMNS = {column: header for header, column in COLUMN_MAP.items()}
+
 def create_connection():
     try:
         connection = mysql.connector.connect(
@@ -24,124 +44,269 @@ def create_connection():
         print(f"Error connecting to MySQL: {e}")
         sys.exit(1)
 
-def update_themes(file_path, batch_size=5000):
+def create_update_tables(cursor, stat_columns):
+    """Create the session-local tables each chunk is loaded into before being joined."""
+    definitions = ''.join(f", {column} {STAT_COLUMNS[column]}" for column in stat_columns)
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS puzzle_update")
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE puzzle_update (
+            id VARCHAR(10) COLLATE utf8mb4_bin PRIMARY KEY{definitions}
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS puzzle_theme_update")
+    cursor.execute("""
+        CREATE TEMPORARY TABLE puzzle_theme_update (
+            puzzle_id VARCHAR(10) COLLATE utf8mb4_bin,
+            theme_id INT,
+            PRIMARY KEY (puzzle_id, theme_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+def apply_stats(cursor, stat_columns, changes):
+    """Copy changed stat columns from puzzle_update with one join. Returns the rows changed.
+
+    Puzzles whose rating changes are logged in `changes` first.
+    """
+    if 'rating' in stat_columns:
+        changes.log_query(cursor, "SELECT p.id FROM puzzle p JOIN puzzle_update u ON u.id = p.id "
+                                  "WHERE NOT (p.rating <=> u.rating)")
+    assignments = ', '.join(f"p.{c} = u.{c}" for c in stat_columns)
+    changed = ' OR '.join(f"NOT (p.{c} <=> u.{c})" for c in stat_columns)
+    cursor.execute(f"UPDATE IGNORE puzzle p JOIN puzzle_update u ON u.id = p.id SET {assignments} WHERE {changed}")
+    return cursor.rowcount
+
+def apply_themes(cursor, changes):
+    """Make puzzle_theme match puzzle_theme_update for the puzzles in puzzle_update.
+
+    Puzzles losing or gaining a theme are logged in `changes` first. Returns
+    (relations removed, relations added).
+    """
+    changes.log_query(cursor, """
+        SELECT pt.puzzle_id AS id FROM puzzle_theme pt
+        JOIN puzzle_update u ON u.id = pt.puzzle_id
+        LEFT JOIN puzzle_theme_update n ON n.puzzle_id = pt.puzzle_id AND n.theme_id = pt.theme_id
+        WHERE n.puzzle_id IS NULL
+    """)
+    changes.log_query(cursor, """
+        SELECT n.puzzle_id AS id FROM puzzle_theme_update n
+        LEFT JOIN puzzle_theme pt ON pt.puzzle_id = n.puzzle_id AND pt.theme_id = n.theme_id
+        WHERE pt.puzzle_id IS NULL
+    """)
+    cursor.execute("""
+        DELETE pt FROM puzzle_theme pt
+        JOIN puzzle_update u ON u.id = pt.puzzle_id
+        LEFT JOIN puzzle_theme_update n ON n.puzzle_id = pt.puzzle_id AND n.theme_id = pt.theme_id
+        WHERE n.puzzle_id IS NULL
+    """)
+    removed = cursor.rowcount
+    cursor.execute("INSERT IGNORE INTO puzzle_theme (puzzle_id, theme_id) SELECT puzzle_id, theme_id FROM puzzle_theme_update")
+    return removed, cursor.rowcount
+
+def prepare_chunk(chunk, index, csv_columns):
+    """Resolve the IDs of a chunk against the index.
+
+    Returns (rows in chunk, rows to apply keyed by the stored ID, IDs not found).
+    """
+    rows = len(chunk)
+
+    # Rows without an ID are dropped first, as strings they would read 'nan' and could match a stored ID
+    chunk = chunk[chunk['PuzzleId'].notna()]
+    # Force ID to be string and preserve exact format
+    chunk['PuzzleId'] = chunk['PuzzleId'].astype(str).str.strip()
+
+    # IDs are case-sensitive (utf8mb4_bin), so an exact match always wins; only IDs
+    # missing as written fall back to a case-insensitive lookup
+    keys = encode_ids(chunk['PuzzleId'])
+    exact = index.contains(keys)
+    found, db_keys = index.resolve_ci(keys)
+    found |= exact
+    db_keys = np.where(exact, keys, db_keys)
+    complete = chunk[csv_columns].notna().all(axis=1).to_numpy()
+    matched = complete & found
+    skipped_ids = chunk['PuzzleId'][complete & ~found].tolist()
+
+    # Rows to apply, keyed by the actual ID with correct case
+    data = chunk.loc[matched, csv_columns].rename(columns={v: k for k, v in CSV_COLUMNS.items()})
+    data.insert(0, 'id', decode_ids(db_keys[matched]))
+    return rows, data.drop_duplicates(subset='id'), skipped_ids
+
+def update_themes(file_path, batch_size=5000, columns=('themes',), pipeline_depth=0, metrics_path=None,
+                  id_cache=DEFAULT_CACHE):
+    stat_columns = [c for c in columns if c in STAT_COLUMNS]
+    refresh_themes = 'themes' in columns
+
     # Create database connection
     connection = create_connection()
     cursor = connection.cursor()
+    pipeline = None
+    changes = DataChanges(connection)
+    metrics = StageMetrics('update_themes', columns=','.join(columns))
 
     try:
         # Check total count in database
         cursor.execute("SELECT COUNT(*) FROM puzzle")
         db_count = cursor.fetchone()[0]
         print(f"Total puzzle count in database: {db_count}")
+        print(f"Refreshing columns: {', '.join(columns)}")
 
         # Disable checks for performance
         cursor.execute('SET FOREIGN_KEY_CHECKS=0')
         cursor.execute('SET UNIQUE_CHECKS=0')
         cursor.execute('SET autocommit=0')
 
-        # Read CSV in chunks to manage memory
-        chunks = pd.read_csv(file_path, chunksize=batch_size)
-        total_rows = sum(1 for _ in open(file_path)) - 1  # Subtract header row
-        print(f"Total rows in CSV: {total_rows}")
+        create_update_tables(cursor, stat_columns)
+        theme_map = load_theme_map(cursor) if refresh_themes else None
+        bits = (load_bits(cursor) or None) if refresh_themes and has_mask_column(cursor) else None
+
+        # Read only the needed columns in chunks, a single pass with progress measured in bytes
+        csv_columns = [CSV_COLUMNS[c] for c in columns]
+        chunks = CsvStream(file_path, batch_size, **csv_options(['PuzzleId'] + csv_columns))
+        print(f"CSV size: {chunks.total_bytes / 1024 ** 2:.1f} MB")
+
+        # We'll first create a case-insensitive index of all puzzle IDs in the database
+        print("Building ID index...")
+        index = IdIndex.cached(connection, id_cache)
 
-        # We'll first create a case-insensitive mapping of all puzzle IDs in the database
-        print("Building ID mapping...")
-        cursor.execute("SELECT id FROM puzzle")
-        db_ids = cursor.fetchall()
-        
         # Check if there are IDs that differ only by case
-        case_variants = defaultdict(list)
-        for row in db_ids:
-            case_variants[row[0].lower()].append(row[0])
-        
-        multi_case_ids = {k: v for k, v in case_variants.items() if len(v) > 1}
+        multi_case_ids = index.case_variants()
         if multi_case_ids:
             print(f"Found {len(multi_case_ids)} IDs with multiple case variants!")
             print("Examples:")
             for k, v in list(multi_case_ids.items())[:5]:
                 print(f"  {k}: {v}")
-        
-        # Create a dictionary to map lowercase IDs to their actual case in the database
-        # If multiple cases exist, use the first one for updates
-        id_mapping = {k.lower(): v[0] for k, v in case_variants.items()}
-        print(f"Found {len(id_mapping)} unique case-insensitive puzzle IDs in database")
-        
+
+        # IDs without an exact match are mapped to their actual case in the database
+        # If multiple cases exist, the smallest stored ID is used for updates
+        print(f"Found {len(index) - sum(len(v) - 1 for v in multi_case_ids.values())} unique case-insensitive puzzle IDs in database")
+
         # Track progress
         processed_rows = 0
+        matched_rows = 0
         updated_rows = 0
+        relations_added = 0
+        relations_removed = 0
         not_found = 0
-        
-        # Prepare batched update
-        update_query = "UPDATE puzzle SET themes = %s WHERE id = %s"
-        
-        with tqdm(total=total_rows, desc="Updating themes") as pbar:
-            for chunk in chunks:
-                # Extract only puzzle ID and themes
-                data = chunk[['PuzzleId', 'Themes']]
-                
-                # Force ID to be string and preserve exact format
-                data['PuzzleId'] = data['PuzzleId'].apply(lambda x: str(x).strip())
-                
-                # Batch updates for performance
-                batch_updates = []
-                skipped_ids = []
-                
-                for _, row in data.iterrows():
-                    if pd.notna(row['Themes']):
-                        # Use lowercase lookup to find the actual ID
-                        csv_id_lower = row['PuzzleId'].lower()
-                        if csv_id_lower in id_mapping:
-                            # Use the actual ID from the database with correct case
-                            db_id = id_mapping[csv_id_lower]
-                            batch_updates.append((row['Themes'], db_id))
-                        else:
-                            skipped_ids.append(row['PuzzleId'])
-                
-                # Execute batch update
-                if batch_updates:
-                    cursor.executemany(update_query, batch_updates)
-                    updated_in_batch = cursor.rowcount
-                    updated_rows += updated_in_batch
-                    not_found += len(skipped_ids)
-                
+
+        with tqdm(total=chunks.total_bytes, desc="Updating puzzles", unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+            def prepare(chunk, size):
+                with metrics.stage('validate', len(chunk), size):
+                    return (size,) + prepare_chunk(chunk, index, csv_columns)
+
+            prepared = (prepare(chunk, size) for chunk, size in metrics.chunks(chunks))
+            if pipeline_depth:
+                pipeline = prepared = Pipeline(prepared, pipeline_depth)
+
+            for size, rows, data, skipped_ids in prepared:
+                not_found += len(skipped_ids)
+                matched_rows += len(data)
+
+                if not data.empty:
+                    changes.begin()
+                    with metrics.stage('write', rows, size):
+                        cursor.execute("TRUNCATE TABLE puzzle_update")
+                        update_columns = ['id'] + stat_columns
+                        values = data[update_columns].astype({c: 'int64' for c in stat_columns}).values.tolist()
+                        cursor.executemany(
+                            f"INSERT INTO puzzle_update ({', '.join(update_columns)}) "
+                            f"VALUES ({', '.join(['%s'] * len(update_columns))})",
+                            values
+                        )
+
+                    if stat_columns:
+                        with metrics.stage('apply_stats', rows, size):
+                            updated_rows += apply_stats(cursor, stat_columns, changes)
+
+                    if refresh_themes:
+                        with metrics.stage('apply_themes', rows, size):
+                            cursor.execute("TRUNCATE TABLE puzzle_theme_update")
+                            relations = theme_relations(cursor, data[['id', 'themes']], theme_map)
+                            if relations:
+                                cursor.executemany(
+                                    "INSERT IGNORE INTO puzzle_theme_update (puzzle_id, theme_id) VALUES (%s, %s)",
+                                    relations
+                                )
+                            removed, added = apply_themes(cursor, changes)
+                            relations_removed += removed
+                            relations_added += added
+                            if bits is not None:
+                                sync_masks(cursor, data['id'], relations, bits)
+
                 # Commit every batch
-                connection.commit()
-                
+                with metrics.stage('commit', rows, size):
+                    connection.commit()
+
                 # Update progress
-                processed_rows += len(chunk)
-                pbar.update(len(chunk))
-                
-                # Print progress every 100k rows
-                if processed_rows % 100000 == 0:
+                reported_rows = processed_rows
+                processed_rows += rows
+                pbar.update(chunks.advance())
+
+                # Print progress each time another REPORT_INTERVAL rows are done, whatever the batch size
+                if processed_rows // REPORT_INTERVAL > reported_rows // REPORT_INTERVAL:
                     print(f"\nProcessed: {processed_rows}, Updated: {updated_rows}, Not found: {not_found}")
                     if skipped_ids and len(skipped_ids) <= 5:
                         print(f"Sample skipped IDs: {skipped_ids}")
 
+        if pipeline is not None:
+            pipeline.report(producer='parse/resolve', consumer='update/commit')
+
         print(f"\nFinal statistics:")
         print(f"Total rows processed: {processed_rows}")
-        print(f"Total puzzles updated: {updated_rows}")
+        print(f"Puzzles matched in database: {matched_rows}")
+        if stat_columns:
+            print(f"Puzzles with changed {', '.join(stat_columns)}: {updated_rows}")
+        if refresh_themes:
+            print(f"Puzzle-theme relations added: {relations_added}")
+            print(f"Puzzle-theme relations removed: {relations_removed}")
         print(f"Puzzles not found: {not_found}")
 
+        metrics.report()
+        if metrics_path:
+            metrics.write(metrics_path)
+
     except Error as e:
-        print(f"Error during theme update: {e}")
+        print(f"Error during update: {e}")
         connection.rollback()
         sys.exit(1)
 
     finally:
+        if pipeline is not None:
+            pipeline.close()
+        changes.end()
+
         # Re-enable checks
         cursor.execute('SET FOREIGN_KEY_CHECKS=1')
         cursor.execute('SET UNIQUE_CHECKS=1')
         cursor.execute('SET autocommit=1')
-        
+
         # Close connections
         cursor.close()
         connection.close()
 
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Refresh puzzle themes and statistics from the Lichess CSV')
+    parser.add_argument('file_path', help='Path to the Lichess puzzle CSV (.csv, .csv.gz, .csv.bz2 or .csv.zst)')
+    parser.add_argument('--columns', default='themes',
+                        help=f'Comma-separated columns to refresh, any of {", ".join(REFRESHABLE_COLUMNS)} '
+                             '(default: themes)')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='Rows per chunk (default: 5000)')
+    parser.add_argument('--id-cache', default=DEFAULT_CACHE,
+                        help=f'File caching the puzzle ID index between runs (default: {DEFAULT_CACHE})')
+    parser.add_argument('--pipeline', type=int, nargs='?', const=DEFAULT_DEPTH, default=0, metavar='DEPTH',
+                        help='Parse chunks in a background thread while the previous ones are written, '
+                             f'with at most DEPTH parsed chunks waiting (default depth: {DEFAULT_DEPTH})')
+    parser.add_argument('--metrics', default=None, metavar='PATH',
+                        help='Write the time, rows/s and MB/s of every stage: a Prometheus textfile '
+                             'for a .prom path, JSON lines appended to any other path')
+    args = parser.parse_args()
+    args.columns = [c.strip() for c in args.columns.split(',') if c.strip()]
+    unknown = set(args.columns) - set(REFRESHABLE_COLUMNS)
+    if unknown or not args.columns:
+        parser.error(f"--columns must be a non-empty list of {', '.join(REFRESHABLE_COLUMNS)}")
+    return args
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python update_themes.py <path_to_csv>")
-        sys.exit(1)
-    
-    file_path = sys.argv[1]
-    update_themes(file_path) 
\ No newline at end of file
+    args = parse_args()
+    update_themes(args.file_path, batch_size=args.batch_size, columns=args.columns,
+                  pipeline_depth=args.pipeline, metrics_path=args.metrics, id_cache=args.id_cache)
\ No newline at end of file